@@ -1,13 +1,14 @@
 # auth_package/__init__.py
 
 from .db import AbstractDatabase, mongodb, sql
-from .cache import abstract_cache, redis_cache
+from .cache import abstract_cache, redis_cache, memory_cache, sql_cache, mongo_cache
 from .cognito import CognitoManager
 from .core import TraditionalAuthManager, SocialAuthManager, CognitoManager
 from .db import mongodb, sql
 from .mfa import MFAAuthManager
 from .social import apple, github, google, facebook
 from .utils import SecurityManager, hash_password, verify_password, generate_reset_token
+from .telemetry import Instrumentation, MetricsInstrumentation, OpenTelemetryInstrumentation
 
 __all__ = [
     'AbstractDatabase',
@@ -27,5 +28,11 @@ __all__ = [
     'sql',
     'abstract_cache', 
     'redis_cache', 
-    'MFAAuthManager'
+    'memory_cache',
+    'sql_cache',
+    'mongo_cache',
+    'MFAAuthManager',
+    'Instrumentation',
+    'MetricsInstrumentation',
+    'OpenTelemetryInstrumentation'
 ]
@@ -0,0 +1 @@
+# auth_package/bench/__init__.py
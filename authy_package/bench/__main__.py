@@ -0,0 +1,76 @@
+"""
+Benchmark entry point.
+
+    python -m authy_package.bench [--operations N] [--concurrency N] [--db memory|sqlite]
+                                  [--scenario NAME ...] [--provider-latency-ms MS]
+                                  [--output results.json] [--baseline old.json]
+
+Runs the end-to-end flows from `authy_package.bench.flows` and prints ops/sec with p50/p95/p99
+latency. `--output` writes the results as JSON; `--baseline` compares against such a file from
+a previous version. The component benchmarks are run on their own:
+`python -m authy_package.bench.tokens` and `python -m authy_package.bench.cache_backends`.
+"""
+import argparse
+import asyncio
+import json
+import platform
+import time
+from importlib import metadata
+
+from authy_package.bench import flows
+from authy_package.bench.runner import print_results
+
+
+def package_version() -> str:
+    try:
+        return metadata.version("authy_package")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def compare(results: dict, baseline: dict):
+    """Prints the relative change of throughput and p99 latency per scenario."""
+    print(f"\n{'scenario':40} {'ops/sec':>10} {'p99':>10}   (vs {baseline.get('version', 'baseline')})")
+    for name, result in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous:
+            continue
+        throughput = (result["ops_per_sec"] / previous["ops_per_sec"] - 1) * 100 if previous["ops_per_sec"] else 0.0
+        p99 = (result["p99_ms"] / previous["p99_ms"] - 1) * 100 if previous["p99_ms"] else 0.0
+        print(f"{name:40} {throughput:+9.1f}% {p99:+9.1f}%")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m authy_package.bench", description="End-to-end auth flow benchmark")
+    parser.add_argument("--operations", type=int, default=200, help="operations per scenario")
+    parser.add_argument("--concurrency", type=int, default=8, help="operations in flight at once")
+    parser.add_argument("--db", choices=("memory", "sqlite"), default="memory", help="database stand-in")
+    parser.add_argument("--scenario", action="append", choices=flows.SCENARIOS, help="run only these scenarios")
+    parser.add_argument("--provider-latency-ms", type=float, default=0.0, help="simulated round trip of every provider call")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="compare against a JSON file written by --output")
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(flows.run(args.operations, args.concurrency, db=args.db, scenarios=args.scenario or flows.SCENARIOS,
+                                    provider_latency=args.provider_latency_ms / 1000))
+    print_results(results)
+
+    report = {
+        "version": package_version(),
+        "python": platform.python_version(),
+        "timestamp": time.time(),
+        "config": {"operations": args.operations, "concurrency": args.concurrency, "db": args.db,
+                   "provider_latency_ms": args.provider_latency_ms},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            compare(results, json.load(baseline))
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Cache backend benchmark.
+
+Drives every AbstractCache backend through the same token workload: issuing token pairs,
+validating access tokens, refreshing, and storing/reading social tokens. `MemoryCaching` is always
+run and serves as the baseline; Redis is added when `--redis-url` is given, SQLCaching when
+`--sql-url` is given (e.g. `postgresql+asyncpg://...` or `sqlite+aiosqlite:///bench.db`) and
+MongoCaching when `--mongo-url` is given.
+
+Usage:
+    python -m authy_package.bench.cache_backends [--operations N] [--concurrency N] [--redis-url URL] [--sql-url URL] [--mongo-url URL]
+"""
+import argparse
+import asyncio
+
+from authy_package.bench.runner import measure, print_results
+from authy_package.cache.memory_cache import MemoryCaching
+
+
+async def run_backend(name: str, cache, operations: int, concurrency: int) -> dict:
+    """Runs the token workload against one cache backend."""
+    identifiers = [f"bench-user-{i}" for i in range(operations)]
+    pairs = [None] * operations
+
+    async def issue(i):
+        pairs[i] = await cache.create_token_pair(identifiers[i])
+
+    async def validate(i):
+        await cache.validate_access_token(pairs[i][0])
+
+    async def refresh(i):
+        await cache.validate_refresh_token(pairs[i][1])
+        await cache.create_token_pair(identifiers[i])
+
+    async def store_social(i):
+        await cache.store_social_token(identifiers[i], "social-access-token", "social-refresh-token", "social-id-token")
+
+    async def retrieve_social(i):
+        await cache.retrieve_access_token(identifiers[i])
+
+    results = {}
+    for scenario, operation in (("create_token_pair", issue), ("validate_access_token", validate), ("refresh", refresh),
+                                ("store_social_token", store_social), ("retrieve_access_token", retrieve_social)):
+        results[f"{name}.{scenario}"] = await measure(operation, operations, concurrency)
+    return results
+
+
+async def run(operations: int, concurrency: int, redis_url: str = None, sql_url: str = None, mongo_url: str = None) -> dict:
+    results = await run_backend("memory", MemoryCaching(), operations, concurrency)
+    if redis_url:
+        from authy_package.cache.redis_cache import RedisCaching
+        results.update(await run_backend("redis", RedisCaching(redis_url, key_prefix="authy-bench"), operations, concurrency))
+    if sql_url:
+        from authy_package.cache.sql_cache import SQLCaching
+        cache = SQLCaching(sql_url, table_name="authy_bench_sessions")
+        await cache.create_table()
+        try:
+            results.update(await run_backend("sql", cache, operations, concurrency))
+        finally:
+            async with cache.engine.begin() as connection:
+                await connection.run_sync(cache.metadata.drop_all)
+            await cache.engine.dispose()
+    if mongo_url:
+        from authy_package.cache.mongo_cache import MongoCaching
+        cache = MongoCaching(mongo_url, "authy_bench")
+        await cache.create_indexes()
+        try:
+            results.update(await run_backend("mongo", cache, operations, concurrency))
+        finally:
+            await cache.collection.drop()
+            cache.client.close()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cache backend benchmark")
+    parser.add_argument("--operations", type=int, default=20_000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--redis-url", default=None)
+    parser.add_argument("--sql-url", default=None)
+    parser.add_argument("--mongo-url", default=None)
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(run(args.operations, args.concurrency, args.redis_url, args.sql_url, args.mongo_url))
+    print_results(results)
+    return results
+
+
+if __name__ == "__main__":
+    main()
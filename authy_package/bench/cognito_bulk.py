@@ -0,0 +1,95 @@
+"""
+Bulk Cognito admin operation benchmark.
+
+Enables TOTP MFA for `--users` users against a local Cognito stub that throttles above `--rate`
+requests per second, three ways:
+
+- sequential: one `enable_totp_mfa` call after the other, as a migration script would;
+- fixed: `bulk_enable_totp_mfa` at a fixed concurrency without backoff or retries;
+- adaptive: `bulk_enable_totp_mfa` with the default adaptive concurrency and throttling backoff.
+
+Each reports users per second, the users left without MFA and the throttled requests.
+
+It then exports the same pool to a JSON Lines file with `export_users`, once as a single
+paginated scan and once as 16 parallel scans segmented by username prefix.
+
+Usage:
+    python -m authy_package.bench.cognito_bulk [--users N] [--rate RPS] [--latency-ms MS] [--fixed-concurrency N]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from authy_package.bench.fakes import FakeCognitoServer
+from authy_package.cognito.cognito_manager import HEX_PREFIXES, CognitoManager
+from authy_package.utils.resilience import AdaptiveConcurrency
+
+
+async def sequential(manager: CognitoManager, usernames: list) -> int:
+    failed = 0
+    for username in usernames:
+        response = await asyncio.to_thread(manager.enable_totp_mfa, username)
+        failed += "Error" in response
+    return failed
+
+
+async def bulk(manager: CognitoManager, usernames: list, concurrency: AdaptiveConcurrency = None, max_retries: int = 8) -> int:
+    failed = 0
+    async for result in manager.bulk_enable_totp_mfa(usernames, concurrency=concurrency, max_retries=max_retries):
+        failed += "Error" in result
+    return failed
+
+
+async def run(users: int, rate: float, latency: float, fixed_concurrency: int) -> dict:
+    # botocore signs every request, so it needs credentials even for the stub
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+    cognito = FakeCognitoServer(rate=rate, latency=latency, users=users, seed=1).start()
+    manager = CognitoManager("us-east-1", "us-east-1_bench", "bench-client", endpoint_url=cognito.url, failure_rate=None)
+    usernames = [f"user{i}" for i in range(users)]
+    modes = {
+        "sequential": lambda: sequential(manager, usernames),
+        "fixed": lambda: bulk(manager, usernames, AdaptiveConcurrency(fixed_concurrency, fixed_concurrency, fixed_concurrency), max_retries=0),
+        "adaptive": lambda: bulk(manager, usernames),
+    }
+    results = {}
+    try:
+        for mode, job in modes.items():
+            cognito.reset()
+            start = time.perf_counter()
+            failed = await job()
+            elapsed = time.perf_counter() - start
+            results[mode] = {"users_per_sec": users / elapsed, "failed": failed, "requests": cognito.requests, "throttled": cognito.throttled}
+
+        with tempfile.TemporaryDirectory() as directory:
+            for mode, segments in (("export", None), ("export-segmented", HEX_PREFIXES)):
+                cognito.reset()
+                start = time.perf_counter()
+                exported = await manager.export_users(os.path.join(directory, f"{mode}.jsonl"), segments=segments)
+                elapsed = time.perf_counter() - start
+                results[mode] = {"users_per_sec": exported / elapsed, "failed": users - exported, "requests": cognito.requests,
+                                 "throttled": cognito.throttled}
+    finally:
+        cognito.stop()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk Cognito admin operation benchmark")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--rate", type=float, default=100.0, help="requests per second the stub admits")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="simulated round trip of every Cognito call")
+    parser.add_argument("--fixed-concurrency", type=int, default=32)
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(run(args.users, args.rate, args.latency_ms / 1000, args.fixed_concurrency))
+    print(f"{'mode':16} {'users/sec':>10} {'failed':>8} {'requests':>9} {'throttled':>10}")
+    for mode, result in results.items():
+        print(f"{mode:16} {result['users_per_sec']:10,.0f} {result['failed']:8} {result['requests']:9} {result['throttled']:10}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
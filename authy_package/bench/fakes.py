@@ -0,0 +1,411 @@
+"""
+Local stand-ins for the external services the managers talk to, used by the benchmarks.
+"""
+import json
+import random
+import re
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from authy_package.db.abstract_db import AbstractDatabase
+from authy_package.utils.tokens import generate_token
+
+
+class InMemoryDatabase(AbstractDatabase):
+    """A dict-backed AbstractDatabase with the lookup semantics of MongoDB (mongomock style)."""
+
+    IDENTIFIER_FIELDS = ("username", "email", "phone")
+
+    def __init__(self):
+        self.users = []
+        self.indexes = {field: {} for field in self.IDENTIFIER_FIELDS}
+        # (provider, subject) -> user
+        self.identities = {}
+        # (source, key) -> {"key", "profile", "synced_at"}
+        self.profiles = {}
+
+    def _find(self, identifier: str):
+        if "@" in identifier:
+            return self.indexes["email"].get(identifier)
+        if identifier.isdigit():
+            return self.indexes["phone"].get(identifier)
+        return self.indexes["username"].get(identifier)
+
+    async def create_user(self, user_data: dict):
+        user = dict(user_data)
+        self.users.append(user)
+        for field in self.IDENTIFIER_FIELDS:
+            if user.get(field):
+                self.indexes[field][user[field]] = user
+
+    async def upsert_user(self, user_data: dict, key: str = "username"):
+        if user_data.get(key) is None:
+            raise ValueError(f"upsert_user requires a value for {key}.")
+        # Nothing awaits in between, so the check and the insert are atomic on the event loop
+        user = self.indexes[key].get(user_data[key])
+        if user is None:
+            await self.create_user(user_data)
+            user = self.indexes[key][user_data[key]]
+        return user
+
+    async def get_user_by_identity(self, provider: str, subject: str):
+        return self.identities.get((provider, subject))
+
+    async def link_identity(self, provider: str, subject: str, user):
+        linked = self.identities.setdefault((provider, subject), user)
+        if linked is not user:
+            raise ValueError(f"The {provider} identity is already linked to another user.")
+
+    async def get_mirrored_profile(self, source: str, key: str):
+        entry = self.profiles.get((source, key))
+        return dict(entry) if entry else None
+
+    async def store_mirrored_profiles(self, source: str, entries: list):
+        for entry in entries:
+            current = self.profiles.get((source, entry["key"]))
+            if current is None or current["synced_at"] < entry["synced_at"]:
+                self.profiles[(source, entry["key"])] = dict(entry)
+
+    async def prune_mirrored_profiles(self, source: str, synced_before: float) -> int:
+        stale = [key for key, entry in self.profiles.items() if key[0] == source and entry["synced_at"] < synced_before]
+        for key in stale:
+            del self.profiles[key]
+        return len(stale)
+
+    async def get_user_by_identifier(self, username=None, email=None, phone=None):
+        if username:
+            return self.indexes["username"].get(username)
+        elif email:
+            return self.indexes["email"].get(email)
+        elif phone:
+            return self.indexes["phone"].get(phone)
+        return None
+
+    async def update_user_with_mfa(self, identifier, mfa_secret, mfa_enabled=False):
+        user = self._find(identifier)
+        if not user:
+            raise ValueError("User not found or MFA information not updated.")
+        user.update(mfa_secret=mfa_secret, mfa_enabled=mfa_enabled)
+        return {"message": "MFA information updated successfully."}
+
+    async def update_user_password(self, identifier: str, new_password: str):
+        user = self._find(identifier)
+        if not user:
+            raise ValueError("User not found.")
+        user["hashed_password"] = new_password
+        return {"message": "Password updated successfully."}
+
+    async def update_user_password_if_unchanged(self, identifier: str, expected_password: str, new_password: str) -> bool:
+        user = self._find(identifier)
+        if not user or user["hashed_password"] != expected_password:
+            return False
+        user["hashed_password"] = new_password
+        return True
+
+
+def create_sqlite_database(path: str):
+    """
+    Builds a SQLDatabase on a SQLite file (requires `aiosqlite`) with a minimal user model.
+
+    :param path: The database file to create.
+    :return: A coroutine resolving to the SQLDatabase once its table exists.
+    """
+    from sqlalchemy import Boolean, Column, Integer, String, event
+    from sqlalchemy.orm import declarative_base
+    from authy_package.db.sql import SQLDatabase
+
+    Base = declarative_base()
+
+    class BenchUser(Base):
+        __tablename__ = "bench_users"
+        id = Column(Integer, primary_key=True)
+        username = Column(String, unique=True)
+        email = Column(String, index=True)
+        phone = Column(String, index=True)
+        hashed_password = Column(String)
+        provider = Column(String)
+        mfa_enabled = Column(Boolean, default=False)
+        mfa_secret = Column(String)
+
+        # The managers read users as mappings
+        def __getitem__(self, key):
+            return getattr(self, key)
+
+        def get(self, key, default=None):
+            return getattr(self, key, default)
+
+    async def build():
+        db = SQLDatabase(f"sqlite+aiosqlite:///{path}", orm_model=BenchUser, echo=False)
+
+        @event.listens_for(db.engine.sync_engine, "connect")
+        def configure(connection, _):
+            # Let concurrent writers wait for each other instead of failing with "database is locked"
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA busy_timeout=30000")
+
+        async with db.engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        await db.create_identity_table()
+        return db
+
+    return build()
+
+
+class _ProviderHandler(BaseHTTPRequestHandler):
+    """Answers the GitHub and Facebook endpoints the social managers call."""
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, payload: dict, status: int = 200, etag: bool = False):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        roll = self.server.random.random()
+        if roll < self.server.error_rate:
+            payload, status, etag = {"error": "service_unavailable"}, 503, False
+        elif roll < self.server.error_rate + self.server.stall_rate:
+            time.sleep(self.server.stall)
+        body = json.dumps(payload).encode()
+        tag = f'W/"{zlib.crc32(body):08x}"' if etag else None
+        if tag and self.headers.get("If-None-Match") == tag:
+            status, body = 304, b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if tag:
+            self.send_header("ETag", tag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _user(self, code_or_token: str) -> str:
+        # Tokens are minted as "<user>.<random>" so the profile endpoints know who is asking
+        return code_or_token.split(".", 1)[0]
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        form = parse_qs(self.rfile.read(length).decode())
+        if self.path == "/login/oauth/access_token":
+            user = self._user(form["code"][0])
+            return self._reply({"access_token": f"{user}.{generate_token()}", "token_type": "bearer"})
+        self._reply({"error": "not_found"}, 404)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path == "/user":
+            user = self._user(self.headers["Authorization"].split(" ", 1)[1])
+            return self._reply({"id": zlib.crc32(user.encode()), "login": user, "name": user, "email": f"{user}@github.test"}, etag=True)
+        if url.path == "/v10.0/oauth/access_token":
+            user = self._user(query.get("code") or query.get("fb_exchange_token"))
+            return self._reply({"access_token": f"{user}.{generate_token()}", "token_type": "bearer", "expires_in": 5183944})
+        if url.path == "/me":
+            user = self._user(query["access_token"])
+            return self._reply({"id": str(zlib.crc32(user.encode())), "name": user, "email": f"{user}@facebook.test"}, etag=True)
+        self._reply({"error": "not_found"}, 404)
+
+
+class _ProviderServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 makes concurrent clients wait for SYN retransmits (1s and more)
+    request_queue_size = 128
+
+
+class FakeProviderServer:
+    """
+    A local HTTP server standing in for the GitHub and Facebook OAuth/Graph APIs.
+
+    Authorization codes are plain user names; every token the server issues carries the user
+    name as prefix so subsequent profile requests resolve to the same user. `latency` delays every
+    response to stand in for the round trip to a real provider.
+
+    Faults are injected at random: a share `error_rate` of the responses are 503s, and a share
+    `stall_rate` is held back for `stall` seconds, as a degraded provider would. `inject()` changes
+    them while the server runs.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, error_rate: float = 0.0,
+                 stall_rate: float = 0.0, stall: float = 2.0, seed: int = None):
+        self.server = _ProviderServer((host, port), _ProviderHandler)
+        self.server.latency = latency
+        self.server.random = random.Random(seed)
+        self.inject(error_rate, stall_rate, stall)
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def inject(self, error_rate: float = 0.0, stall_rate: float = 0.0, stall: float = 2.0):
+        """Sets the share of failing and stalling responses; all zero restores a healthy provider."""
+        self.server.error_rate = error_rate
+        self.server.stall_rate = stall_rate
+        self.server.stall = stall
+
+    def configure(self, github_manager=None, facebook_manager=None):
+        """Points the given managers at this server."""
+        if github_manager:
+            github_manager.AUTHORIZE_URL = f"{self.url}/login/oauth/authorize"
+            github_manager.TOKEN_URL = f"{self.url}/login/oauth/access_token"
+            github_manager.USER_URL = f"{self.url}/user"
+        if facebook_manager:
+            facebook_manager.DIALOG_URL = f"{self.url}/v10.0/dialog/oauth"
+            facebook_manager.GRAPH_URL = self.url
+
+
+# A ListUsers filter: `<attribute> = "<value>"` or `<attribute> ^= "<prefix>"`
+_LIST_USERS_FILTER = re.compile(r'(\w+) (\^?=) "(.*)"')
+
+
+class _CognitoHandler(BaseHTTPRequestHandler):
+    """Answers the Cognito admin operations (JSON 1.1 protocol) the bulk operations and exports use, or throttles."""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        operation = self.headers.get("X-Amz-Target", "").rpartition(".")[2]
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if not self.server.take_token():
+            status, payload = 400, {"__type": "TooManyRequestsException", "message": "Rate exceeded"}
+        elif operation in ("AdminSetUserMFAPreference", "AdminUpdateUserAttributes"):
+            self.server.record(operation, request.get("Username"))
+            status, payload = 200, {}
+        elif operation == "ListUsers":
+            status, payload = self._list_users(request)
+        else:
+            status, payload = 400, {"__type": "InvalidParameterException", "message": f"Unsupported operation {operation}"}
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/x-amz-json-1.1")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    @staticmethod
+    def _attribute(user: dict, name: str) -> str:
+        if name == "username":
+            return user["Username"]
+        return next((attribute["Value"] for attribute in user["Attributes"] if attribute["Name"] == name), "")
+
+    def _list_users(self, request: dict):
+        users = self.server.users
+        match = _LIST_USERS_FILTER.fullmatch(request.get("Filter") or "")
+        if request.get("Filter") and not match:
+            return 400, {"__type": "InvalidParameterException", "message": "Invalid filter"}
+        if match:
+            name, operator, value = match.groups()
+            if operator == "^=":
+                users = [user for user in users if self._attribute(user, name).startswith(value)]
+            else:
+                users = [user for user in users if self._attribute(user, name) == value]
+        start = int(request.get("PaginationToken") or 0)
+        end = start + min(int(request.get("Limit") or 60), 60)
+        page = users[start:end]
+        if request.get("AttributesToGet") is not None:
+            wanted = set(request["AttributesToGet"])
+            page = [{**user, "Attributes": [attribute for attribute in user["Attributes"] if attribute["Name"] in wanted]} for user in page]
+        payload = {"Users": page}
+        if end < len(users):
+            payload["PaginationToken"] = str(end)
+        return 200, payload
+
+
+class _CognitoServer(_ProviderServer):
+    def take_token(self) -> bool:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.requests += 1
+            if self.tokens < 1:
+                self.throttled += 1
+                return False
+            self.tokens -= 1
+            return True
+
+    def record(self, operation: str, username: str):
+        with self.lock:
+            self.applied.setdefault(operation, set()).add(username)
+
+
+class FakeCognitoServer:
+    """
+    A local HTTP server standing in for the Cognito user pool admin API, with Cognito's throttling.
+
+    Requests are admitted by a token bucket refilled at `rate` per second up to `burst`, like the
+    per-category request quotas of a user pool; the rest are answered with TooManyRequestsException.
+    The pool holds `users` users with UUID usernames, listed by ListUsers with Cognito's pagination
+    and its `=`/`^=` filters.
+    Point a CognitoManager at `url` through its `endpoint_url`. `requests`, `throttled` and `applied`
+    (operation -> usernames) count what the server saw.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, rate: float = 50.0, burst: float = None, latency: float = 0.0,
+                 users: int = 0, seed: int = None):
+        self.server = _CognitoServer((host, port), _CognitoHandler)
+        generator = random.Random(seed)
+        self.server.users = sorted((self._user(generator, index) for index in range(users)), key=lambda user: user["Username"])
+        self.server.rate = rate
+        self.server.burst = burst or rate
+        self.server.latency = latency
+        self.server.lock = threading.Lock()
+        self.server.tokens = self.server.burst
+        self.server.updated = time.monotonic()
+        self.server.requests = self.server.throttled = 0
+        self.server.applied = {}
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+        self._thread = None
+
+    @staticmethod
+    def _user(generator: random.Random, index: int) -> dict:
+        username = str(uuid.UUID(int=generator.getrandbits(128), version=4))
+        return {
+            "Username": username,
+            "Attributes": [{"Name": "sub", "Value": username}, {"Name": "email", "Value": f"user{index}@cognito.test"}],
+            "UserCreateDate": 1700000000.0 + index,
+            "UserLastModifiedDate": 1700000000.0 + index,
+            "Enabled": True,
+            "UserStatus": "CONFIRMED",
+        }
+
+    @property
+    def requests(self) -> int:
+        return self.server.requests
+
+    @property
+    def throttled(self) -> int:
+        return self.server.throttled
+
+    @property
+    def applied(self) -> dict:
+        return self.server.applied
+
+    def reset(self):
+        """Clears the counters and refills the bucket."""
+        with self.server.lock:
+            self.server.requests = self.server.throttled = 0
+            self.server.applied = {}
+            self.server.tokens = self.server.burst
+            self.server.updated = time.monotonic()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,102 @@
+"""
+End-to-end auth flow benchmark.
+
+Drives TraditionalAuthManager and SocialAuthManager against local stand-ins: MemoryCaching,
+an in-memory or SQLite database and a fake GitHub/Facebook HTTP server.
+"""
+import os
+import tempfile
+
+from authy_package.bench.fakes import FakeProviderServer, InMemoryDatabase, create_sqlite_database
+from authy_package.bench.runner import measure
+from authy_package.cache.memory_cache import MemoryCaching
+from authy_package.core.auth_manager import SocialAuthManager, TraditionalAuthManager
+from authy_package.social.facebook import FacebookManager
+from authy_package.social.github import GitHubManager
+
+SCENARIOS = (
+    "register_user",
+    "login_user",
+    "refresh_token",
+    "social_login_new_user",
+    "social_login_returning_user",
+    "github_social_login",
+    "facebook_social_login",
+)
+
+
+async def build_database(kind: str, directory: str):
+    if kind == "memory":
+        return InMemoryDatabase()
+    if kind == "sqlite":
+        return await create_sqlite_database(os.path.join(directory, "bench.db"))
+    raise ValueError(f"Unknown database stand-in: {kind}")
+
+
+async def run(operations: int, concurrency: int, db: str = "memory", scenarios=SCENARIOS, provider_latency: float = 0.0) -> dict:
+    """
+    Runs the selected scenarios and returns `{scenario: measure(...)}`.
+
+    `provider_latency` (seconds) is added to every fake provider response, so flows that overlap
+    provider calls show their gain as they would against the real APIs.
+
+    Scenarios depend on each other in the order of SCENARIOS (logins need registered users, refreshes
+    need logins), so the prerequisites of a selected scenario are run unmeasured when it is skipped.
+    """
+    results = {}
+    provider = FakeProviderServer(latency=provider_latency).start()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            database = await build_database(db, directory)
+            cache = MemoryCaching()
+            traditional = TraditionalAuthManager(db=database, cache=cache)
+            github_manager = GitHubManager("bench-client", "bench-secret", "http://localhost/callback")
+            facebook_manager = FacebookManager("bench-app", "bench-secret", "http://localhost/callback")
+            provider.configure(github_manager=github_manager, facebook_manager=facebook_manager)
+            social = SocialAuthManager(db=database, cache=cache, github_manager=github_manager, facebook_manager=facebook_manager)
+
+            logins = [None] * operations
+
+            async def register_user(i):
+                await traditional.register_user(username=f"user{i}", email=f"user{i}@bench.test", password="bench-password")
+
+            async def login_user(i):
+                logins[i] = await traditional.login_user(username=f"user{i}", password="bench-password")
+
+            async def refresh_token(i):
+                logins[i] = await traditional.refresh_token(logins[i]["refresh_token"])
+
+            async def social_login(i):
+                await social._handle_social_login("github", {"name": f"social{i}", "email": f"social{i}@bench.test"}, {"access_token": f"social{i}.token"})
+
+            async def github_social_login(i):
+                await social.github_social_login(f"gh{i % 100}")
+
+            async def facebook_social_login(i):
+                await social.facebook_social_login(f"fb{i % 100}")
+
+            steps = (
+                ("register_user", register_user),
+                ("login_user", login_user),
+                ("refresh_token", refresh_token),
+                ("social_login_new_user", social_login),
+                ("social_login_returning_user", social_login),
+                ("github_social_login", github_social_login),
+                ("facebook_social_login", facebook_social_login),
+            )
+            selected = set(scenarios)
+            required = {"login_user": {"register_user"}, "refresh_token": {"register_user", "login_user"},
+                        "social_login_returning_user": {"social_login_new_user"}}
+            needed = set(selected)
+            for scenario in selected:
+                needed |= required.get(scenario, set())
+
+            for name, operation in steps:
+                if name not in needed:
+                    continue
+                result = await measure(operation, operations, concurrency)
+                if name in selected:
+                    results[name] = result
+    finally:
+        provider.stop()
+    return results
@@ -0,0 +1,98 @@
+"""
+Provider fault benchmark.
+
+Runs GitHub and Facebook social logins against the fake provider while it injects faults, once
+with the provider calls passed straight through ("plain") and once with the default
+ResilientHTTPClient policies plus hedging ("resilient"). Three phases are measured:
+
+- degraded: a share of the responses fail with 503 or stall for `--stall-ms`;
+- outage: every response fails, so the circuit breakers open and logins fail fast;
+- recovery: the provider is healthy again. After the reset timeout one unmeasured login probes
+  the provider and closes the breakers before the phase is measured.
+
+Each phase reports throughput, latency and the share of failed logins.
+
+Usage:
+    python -m authy_package.bench.resilience [--operations N] [--concurrency N] [--error-rate R]
+                                             [--stall-rate R] [--stall-ms MS] [--seed N]
+"""
+import argparse
+import asyncio
+
+from authy_package.bench.fakes import FakeProviderServer, InMemoryDatabase
+from authy_package.bench.runner import measure
+from authy_package.cache.memory_cache import MemoryCaching
+from authy_package.core.auth_manager import SocialAuthManager
+from authy_package.social.facebook import FacebookManager
+from authy_package.social.github import GitHubManager
+from authy_package.social.http import ResilientHTTPClient
+
+RESET_TIMEOUT = 0.5
+
+
+def http_client(mode: str) -> ResilientHTTPClient:
+    if mode == "plain":
+        return ResilientHTTPClient(deadline=None, max_attempts=1, failure_rate=None)
+    return ResilientHTTPClient(deadline=1.0, hedge_after=0.05, reset_timeout=RESET_TIMEOUT)
+
+
+async def run_mode(mode: str, provider: FakeProviderServer, operations: int, concurrency: int, error_rate: float,
+                   stall_rate: float, stall: float) -> dict:
+    """Runs the three phases with one client configuration."""
+    client = http_client(mode)
+    github_manager = GitHubManager("bench-client", "bench-secret", "http://localhost/callback", http_client=client)
+    facebook_manager = FacebookManager("bench-app", "bench-secret", "http://localhost/callback", http_client=client)
+    provider.configure(github_manager=github_manager, facebook_manager=facebook_manager)
+    social = SocialAuthManager(db=InMemoryDatabase(), cache=MemoryCaching(), github_manager=github_manager, facebook_manager=facebook_manager)
+
+    results = {}
+    for phase, faults in (("degraded", (error_rate, stall_rate, stall)), ("outage", (1.0, 0.0, stall)), ("recovery", (0.0, 0.0, stall))):
+        provider.inject(*faults)
+        for flow, login in (("github", social.github_social_login), ("facebook", social.facebook_social_login)):
+            if phase == "recovery":
+                await asyncio.sleep(RESET_TIMEOUT)
+                await login(f"{flow}-probe")
+            failures = 0
+
+            async def operation(i):
+                nonlocal failures
+                try:
+                    await login(f"{flow}{i % 100}")
+                except Exception:
+                    failures += 1
+
+            result = await measure(operation, operations, concurrency)
+            result["failure_rate"] = failures / operations
+            results[f"{mode}.{phase}.{flow}_social_login"] = result
+    return results
+
+
+async def run(operations: int, concurrency: int, error_rate: float = 0.1, stall_rate: float = 0.05, stall: float = 2.0, seed: int = None) -> dict:
+    provider = FakeProviderServer(seed=seed).start()
+    try:
+        results = await run_mode("plain", provider, operations, concurrency, error_rate, stall_rate, stall)
+        results.update(await run_mode("resilient", provider, operations, concurrency, error_rate, stall_rate, stall))
+    finally:
+        provider.stop()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Provider fault benchmark")
+    parser.add_argument("--operations", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--error-rate", type=float, default=0.1, help="share of provider responses that fail with 503")
+    parser.add_argument("--stall-rate", type=float, default=0.05, help="share of provider responses that stall")
+    parser.add_argument("--stall-ms", type=float, default=2000, help="how long a stalled response is held back")
+    parser.add_argument("--seed", type=int, default=None, help="seed of the fault injection")
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(run(args.operations, args.concurrency, args.error_rate, args.stall_rate, args.stall_ms / 1000, args.seed))
+    print(f"{'scenario':45} {'ops/sec':>10} {'p50 ms':>9} {'p99 ms':>9} {'failed':>8}")
+    for name, result in results.items():
+        print(f"{name:45} {result['ops_per_sec']:10,.0f} {result['p50_ms']:9.1f} {result['p99_ms']:9.1f} {result['failure_rate']:8.1%}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import asyncio
+import time
+
+
+def percentile(sorted_samples: list, fraction: float) -> float:
+    """Returns the nearest-rank percentile of already sorted samples."""
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, max(0, int(round(fraction * len(sorted_samples))) - 1))
+    return sorted_samples[index]
+
+
+async def measure(operation, operations: int, concurrency: int = 1) -> dict:
+    """
+    Runs an async operation a fixed number of times with bounded concurrency.
+
+    :param operation: An async callable taking the (zero based) index of the call.
+    :param operations: The total number of calls.
+    :param concurrency: The number of calls in flight at once.
+    :return: Throughput in ops/sec and p50/p95/p99 latency in milliseconds.
+    """
+    latencies = []
+    counter = iter(range(operations))
+
+    async def worker():
+        for index in counter:
+            start = time.perf_counter()
+            await operation(index)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "operations": operations,
+        "concurrency": concurrency,
+        "ops_per_sec": operations / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+
+def print_results(results: dict):
+    """Prints `{scenario: measure(...)}` results as an aligned table."""
+    print(f"{'scenario':40} {'ops/sec':>12} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, result in results.items():
+        print(f"{name:40} {result['ops_per_sec']:12,.0f} {result['p50_ms']:9.3f} {result['p95_ms']:9.3f} {result['p99_ms']:9.3f}")
@@ -0,0 +1,106 @@
+"""
+Token minting benchmark.
+
+Compares the legacy `sha256(identifier + time.time())` tokens with the `secrets` based tokens
+from `authy_package.utils.tokens` and reports minting rate, same-tick collisions and the
+Redis payload per million sessions. When `--redis-url` is given, the real memory growth of
+a Redis server is measured while sessions are created through `RedisCaching`.
+
+Usage:
+    python -m authy_package.bench.tokens [--iterations N] [--redis-url URL] [--sessions N]
+"""
+import argparse
+import asyncio
+import hashlib
+import time
+
+from authy_package.cache.key_schema import KeySchema
+from authy_package.utils.tokens import generate_token
+
+MILLION = 1_000_000
+
+
+def _legacy_token(identifier: str) -> str:
+    return hashlib.sha256(f"{identifier}_{time.time()}".encode()).hexdigest()
+
+
+def _mint_rate(mint, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        mint()
+    return iterations / (time.perf_counter() - start)
+
+
+def _duplicates(mint, iterations: int) -> int:
+    return iterations - len({mint() for _ in range(iterations)})
+
+
+def run_minting(iterations: int) -> dict:
+    """Measures tokens/sec and duplicate tokens for both generators minting for a single user."""
+    identifier = "user@example.com"
+    legacy = lambda: _legacy_token(identifier)
+    current = lambda: generate_token()
+    keys = KeySchema()
+    keyed = lambda: keys.access_token(generate_token())
+    return {
+        "legacy_tokens_per_sec": _mint_rate(legacy, iterations),
+        "tokens_per_sec": _mint_rate(current, iterations),
+        "tokens_with_key_per_sec": _mint_rate(keyed, iterations),
+        "legacy_duplicates": _duplicates(legacy, iterations),
+        "duplicates": _duplicates(current, iterations),
+    }
+
+
+def run_payload(identifier: str = "user@example.com") -> dict:
+    """Key and value bytes written for one token pair, scaled to a million sessions."""
+    keys = KeySchema()
+    legacy_token = _legacy_token(identifier)
+    token = generate_token()
+    legacy_pair = 2 * (len(legacy_token) + len(identifier))
+    pair = len(keys.access_token(token)) + len(keys.refresh_token(token)) + 2 * len(identifier)
+    return {
+        "legacy_token_length": len(legacy_token),
+        "token_length": len(token),
+        "legacy_payload_mb_per_million": legacy_pair * MILLION / 2**20,
+        "payload_mb_per_million": pair * MILLION / 2**20,
+    }
+
+
+async def run_redis_memory(redis_url: str, sessions: int) -> dict:
+    """Creates `sessions` token pairs through RedisCaching and measures `used_memory` growth."""
+    from authy_package.cache.redis_cache import RedisCaching
+
+    cache = RedisCaching(redis_url)
+    before = (await cache.redis.info("memory"))["used_memory"]
+    start = time.perf_counter()
+    tokens = [await cache.create_token_pair(f"bench-user-{i}") for i in range(sessions)]
+    elapsed = time.perf_counter() - start
+    after = (await cache.redis.info("memory"))["used_memory"]
+    for i, (access_token, refresh_token) in enumerate(tokens):
+        await cache.redis.delete(cache.keys.access_token(access_token), cache.keys.refresh_token(refresh_token), cache.keys.user(f"bench-user-{i}"))
+    return {
+        "redis_sessions_per_sec": sessions / elapsed,
+        "redis_bytes_per_session": (after - before) / sessions,
+        "redis_mb_per_million": (after - before) / sessions * MILLION / 2**20,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Token minting benchmark")
+    parser.add_argument("--iterations", type=int, default=200_000)
+    parser.add_argument("--redis-url", default=None)
+    parser.add_argument("--sessions", type=int, default=10_000)
+    args = parser.parse_args(argv)
+
+    results = run_minting(args.iterations)
+    results.update(run_payload())
+    if args.redis_url:
+        results.update(asyncio.run(run_redis_memory(args.redis_url, args.sessions)))
+
+    for name, value in results.items():
+        print(f"{name:32} {value:,.1f}" if isinstance(value, float) else f"{name:32} {value:,}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,42 @@
+import time
 from abc import ABC, abstractmethod
 
+# An `exp` above ten years of seconds is an epoch timestamp (any date after 1980), below it a lifetime
+EPOCH_THRESHOLD = 10 * 365 * 24 * 3600
+
 class AbstractCache(ABC):
     @abstractmethod
-    def create_token_pair(self, identifier: str):
+    async def create_token_pair(self, identifier: str):
         """Creates a pair of access and refresh tokens for the given identifier."""
         pass
 
     @abstractmethod
-    def delete_access_token(self, access_token: str):
+    async def delete_access_token(self, access_token: str):
         """Deletes the specified access token from the cache."""
         pass
 
     @abstractmethod
-    def delete_refresh_token(self, identifier: str):
+    async def delete_refresh_token(self, identifier: str):
         """Deletes the refresh token associated with the given identifier from the cache."""
         pass 
 
     @abstractmethod
-    def validate_access_token(self, access_token: str):
+    async def validate_access_token(self, access_token: str):
         """Validates the specified access token and returns the associated identifier if valid."""
         pass
 
     @abstractmethod
-    def validate_refresh_token(self, refresh_token: str):
+    async def validate_refresh_token(self, refresh_token: str):
         """Validates the specified refresh token and returns the associated identifier if valid."""
         pass
 
     @abstractmethod
-    def store_social_token(self, identifier: str, access_token: str, refresh_token: str = None):
+    async def store_social_token(self, identifier: str, access_token: str, refresh_token: str = None):
         """Stores social login tokens in the cache."""
         pass
 
     @abstractmethod
-    def update_social_token(self, identifier: str, new_access_token: str, new_refresh_token: str = None):
+    async def update_social_token(self, identifier: str, new_access_token: str, new_refresh_token: str = None):
         """Updates social login tokens in the cache."""
         pass
     
@@ -50,3 +54,24 @@ class AbstractCache(ABC):
     async def store_reset_token(self, email: str, reset_token: str, expiration: int = 900):
         """ Store reset Token for update password in the cache."""
         pass
+
+    async def claim_once(self, key: str, ttl: float) -> bool:
+        """
+        Claims `key` for `ttl` seconds, atomically: returns True for the first claim and False while
+        the key is already claimed, across every process sharing the cache.
+
+        Only needed for single-use OAuth states, so custom backends that do not implement it keep working.
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not implement claim_once, which single-use OAuth states require.")
+
+    def _ttl(self, exp, default: int) -> int:
+        """
+        Turns an `exp` that is either a lifetime in seconds or an absolute epoch timestamp into a TTL.
+
+        Values above EPOCH_THRESHOLD are timestamps; one already in the past yields a TTL of one second.
+        """
+        if not exp:
+            return default
+        if exp > EPOCH_THRESHOLD:
+            return max(int(exp - time.time()), 1)
+        return max(int(exp), 1)
@@ -0,0 +1,149 @@
+from authy_package.utils.tokens import token_digest
+
+# Approximate per-allocation overheads of a 64-bit Redis 7 server, used by `estimate_*` below
+DICT_ENTRY_BYTES = 24
+ROBJ_BYTES = 16
+SDS_HEADER_BYTES = 3
+EMBSTR_MAX_LENGTH = 44
+BUCKET_BYTES = 8
+
+
+def jemalloc_size(size: int) -> int:
+    """
+    Rounds an allocation up to the jemalloc size class Redis would actually use.
+
+    :param size: The requested allocation in bytes.
+    :return: The allocated size in bytes.
+    """
+    if size <= 8:
+        return 8
+    if size <= 128:
+        return (size + 15) // 16 * 16
+    spacing = 1 << ((size - 1).bit_length() - 3)
+    return (size + spacing - 1) // spacing * spacing
+
+
+def estimate_key_overhead(key_length: int, has_ttl: bool = True) -> int:
+    """Estimates the bytes a top-level key costs before its value is counted."""
+    size = DICT_ENTRY_BYTES + BUCKET_BYTES + jemalloc_size(SDS_HEADER_BYTES + key_length + 1)
+    if has_ttl:
+        size += DICT_ENTRY_BYTES + BUCKET_BYTES
+    return size
+
+
+def estimate_string_bytes(key_length: int, value_length: int, has_ttl: bool = True) -> int:
+    """
+    Estimates the memory used by a string key and its value.
+
+    :param key_length: Length of the key in bytes.
+    :param value_length: Length of the value in bytes.
+    :param has_ttl: Whether the key carries an expiry.
+    :return: Estimated bytes.
+    """
+    if value_length <= EMBSTR_MAX_LENGTH:
+        value = jemalloc_size(ROBJ_BYTES + SDS_HEADER_BYTES + value_length + 1)
+    else:
+        value = ROBJ_BYTES + jemalloc_size(SDS_HEADER_BYTES + value_length + 1)
+    return estimate_key_overhead(key_length, has_ttl) + value
+
+
+def estimate_hash_bytes(key_length: int, fields: dict, has_ttl: bool = True) -> int:
+    """
+    Estimates the memory used by a small (listpack encoded) hash.
+
+    :param key_length: Length of the key in bytes.
+    :param fields: Mapping of field name to value; only their lengths are used.
+    :param has_ttl: Whether the key carries an expiry.
+    :return: Estimated bytes.
+    """
+    listpack = 7 + 1
+    for name, value in fields.items():
+        for entry in (str(name), str(value)):
+            listpack += len(entry) + 2 + (len(entry) > 63)
+    return estimate_key_overhead(key_length, has_ttl) + ROBJ_BYTES + jemalloc_size(listpack)
+
+
+class KeySchema:
+    """
+    Versioned key layout for the Redis cache.
+
+    Every key lives under `<prefix>:v<VERSION>:`, so several deployments can share a server and a
+    future layout change can be rolled out next to the old one. Token keys hold a digest of the
+    token, never the token itself. Everything stored per user (social tokens and the pointer to the
+    current refresh token) is packed into a single hash, saving a top-level key per token.
+
+    With `hash_tags` enabled (Redis Cluster), tokens are minted as `<tag>.<random>` where the tag is
+    derived from the user identifier, and every key of a user's token family carries `{<tag>}`.
+    All of them then hash to the same slot, so the multi-key pipelines keep working, while different
+    users still spread evenly over the shards.
+    """
+    VERSION = 1
+    TAG_LENGTH = 4
+    TAG_SEPARATOR = "."
+
+    # Fields of the per-user hash
+    SOCIAL_ACCESS_TOKEN = "sat"
+    SOCIAL_REFRESH_TOKEN = "srt"
+    SOCIAL_ID_TOKEN = "sid"
+    REFRESH_TOKEN_KEY = "rt"
+    EXPIRES_SUFFIX = ":exp"
+
+    def __init__(self, prefix: str = "authy", hash_tags: bool = False):
+        """
+        :param prefix: The namespace prepended to every key.
+        :param hash_tags: Co-locate each user's keys in one cluster slot.
+        """
+        self.prefix = prefix
+        self.hash_tags = hash_tags
+        self.namespace = f"{prefix}:v{self.VERSION}:"
+
+    def slot_tag(self, identifier: str) -> str:
+        """Returns the short tag that pins the keys of a user to one cluster slot."""
+        return token_digest(identifier)[:self.TAG_LENGTH]
+
+    def tag_token(self, identifier: str, token: str) -> str:
+        """Prefixes a freshly minted token with the slot tag of its user when hash tags are enabled."""
+        if not self.hash_tags:
+            return token
+        return f"{self.slot_tag(identifier)}{self.TAG_SEPARATOR}{token}"
+
+    def _tagged_namespace(self, tag: str = None) -> str:
+        if not self.hash_tags or not tag:
+            return self.namespace
+        return f"{self.namespace}{{{tag}}}:"
+
+    def _token_namespace(self, token: str) -> str:
+        tag, separator, _ = token.partition(self.TAG_SEPARATOR)
+        return self._tagged_namespace(tag if separator else None)
+
+    def access_token_prefix(self) -> str:
+        """The prefix shared by all access-token keys (without hash tags)."""
+        return f"{self.namespace}at:"
+
+    def access_token(self, token: str) -> str:
+        return f"{self._token_namespace(token)}at:{token_digest(token)}"
+
+    def refresh_token(self, token: str) -> str:
+        return f"{self._token_namespace(token)}rt:{token_digest(token)}"
+
+    def user(self, identifier: str) -> str:
+        tag = self.slot_tag(identifier) if self.hash_tags else None
+        return f"{self._tagged_namespace(tag)}u:{identifier}"
+
+    def reset_token(self, email: str) -> str:
+        return f"{self.namespace}rs:{email}"
+
+    def claim(self, key: str) -> str:
+        """Marks a single-use value (e.g. an OAuth state) as used."""
+        return f"{self.namespace}cl:{key}"
+
+    def refresh_schedule(self) -> str:
+        """The sorted set of social token refreshes, scored by when each one is due."""
+        return f"{self.namespace}sched:refresh"
+
+    def refresh_leader(self) -> str:
+        """The lock held by the worker that runs the scheduled refreshes."""
+        return f"{self.namespace}sched:leader"
+
+    def expires_field(self, field: str) -> str:
+        return field + self.EXPIRES_SUFFIX
@@ -0,0 +1,191 @@
+import heapq
+import itertools
+import time
+from collections import OrderedDict
+
+from authy_package.cache.abstract_cache import AbstractCache
+from authy_package.utils.tokens import generate_token
+
+class MemoryCaching(AbstractCache):
+    """
+    In-process cache backend with the same behaviour as RedisCaching.
+
+    Intended for single-node deployments and test suites that should not need a Redis server.
+    Entries expire through a heap ordered by expiry time, and memory stays bounded by evicting the
+    least recently used entries once `max_entries` is reached. Claims (`claim_once`) are kept apart
+    from that store and only ever expire, so filling the cache cannot make a claimed value claimable again.
+
+    None of the methods await while touching the store, so every operation runs atomically with
+    respect to other asyncio tasks on the loop without any locking. The cache is not shared between
+    processes, and must not be used from several threads.
+    """
+    ACCESS_TOKEN = "at"
+    REFRESH_TOKEN = "rt"
+    USER_REFRESH_TOKEN = "urt"
+    SOCIAL_ACCESS_TOKEN = "sat"
+    SOCIAL_REFRESH_TOKEN = "srt"
+    SOCIAL_ID_TOKEN = "sid"
+    RESET_TOKEN = "rs"
+
+    def __init__(self, token_expiration_time: int = 3600, refresh_token_expiration_time: int = 604800, id_token_expiration_time: int = 3600, max_entries: int = 1_000_000):
+        """
+        :param token_expiration_time: Lifetime of access tokens in seconds.
+        :param refresh_token_expiration_time: Lifetime of refresh tokens in seconds.
+        :param id_token_expiration_time: Lifetime of social ID tokens in seconds.
+        :param max_entries: Upper bound on stored entries; the least recently used are evicted beyond it.
+        """
+        self.TOKEN_EXPIRATION_TIME = token_expiration_time
+        self.REFRESH_TOKEN_EXPIRATION_TIME = refresh_token_expiration_time
+        self.ID_TOKEN_EXPIRATION_TIME = id_token_expiration_time
+        self.max_entries = max_entries
+        # key -> (value, expires_at), ordered from least to most recently used
+        self._entries = OrderedDict()
+        # (expires_at, sequence, key); stale items are skipped when popped
+        self._expiry_heap = []
+        self._sequence = itertools.count()
+        self.evictions = 0
+        # key -> expires_at, and the (expires_at, key) heap expiring them; never evicted
+        self._claims = {}
+        self._claim_expiry_heap = []
+
+    def _set(self, key: tuple, value, expiration: int, nx: bool = False) -> bool:
+        now = time.monotonic()
+        self._expire(now)
+        if nx and key in self._entries:
+            return False
+
+        expires_at = now + expiration
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        heapq.heappush(self._expiry_heap, (expires_at, next(self._sequence), key))
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        if len(self._expiry_heap) > 2 * len(self._entries) + 1024:
+            self._compact()
+        return True
+
+    def _get(self, key: tuple):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _delete(self, *keys: tuple):
+        for key in keys:
+            self._entries.pop(key, None)
+
+    def _expire(self, now: float):
+        """Drops every entry whose expiry time has passed."""
+        heap = self._expiry_heap
+        while heap and heap[0][0] <= now:
+            expires_at, _, key = heapq.heappop(heap)
+            entry = self._entries.get(key)
+            # The key may have been rewritten with a later expiry, deleted or evicted since
+            if entry is not None and entry[1] == expires_at:
+                del self._entries[key]
+
+    def _compact(self):
+        """Rebuilds the heap from live entries once overwritten and evicted keys dominate it."""
+        self._expiry_heap = [(expires_at, next(self._sequence), key) for key, (_, expires_at) in self._entries.items()]
+        heapq.heapify(self._expiry_heap)
+
+    async def create_token_pair(self, identifier: str):
+        access_token = self._store_new_token(self.ACCESS_TOKEN, identifier, self.TOKEN_EXPIRATION_TIME)
+        refresh_token = self._store_new_token(self.REFRESH_TOKEN, identifier, self.REFRESH_TOKEN_EXPIRATION_TIME)
+        self._set((self.USER_REFRESH_TOKEN, identifier), refresh_token, self.REFRESH_TOKEN_EXPIRATION_TIME)
+        return access_token, refresh_token
+
+    def _store_new_token(self, kind: str, identifier: str, expiration: int) -> str:
+        while True:
+            token = generate_token()
+            if self._set((kind, token), identifier, expiration, nx=True):
+                return token
+
+    async def delete_access_token(self, access_token: str):
+        self._delete((self.ACCESS_TOKEN, access_token))
+
+    async def delete_refresh_token(self, identifier: str):
+        refresh_token = self._get((self.USER_REFRESH_TOKEN, identifier))
+        if refresh_token:
+            self._delete((self.REFRESH_TOKEN, refresh_token))
+        self._delete((self.USER_REFRESH_TOKEN, identifier), (self.SOCIAL_REFRESH_TOKEN, identifier))
+
+    async def validate_access_token(self, access_token: str):
+        return self._get((self.ACCESS_TOKEN, access_token))
+
+    async def validate_refresh_token(self, refresh_token: str):
+        return self._get((self.REFRESH_TOKEN, refresh_token))
+
+    def _write_social_tokens(self, identifier: str, access_token: str, refresh_token: str = None, id_token: str = None, access_ttl: int = None, id_ttl: int = None):
+        self._set((self.SOCIAL_ACCESS_TOKEN, identifier), access_token, access_ttl)
+        if refresh_token:
+            self._set((self.SOCIAL_REFRESH_TOKEN, identifier), refresh_token, self.REFRESH_TOKEN_EXPIRATION_TIME)
+        if id_token:
+            self._set((self.SOCIAL_ID_TOKEN, identifier), id_token, id_ttl)
+
+    async def store_social_token(self, identifier: str, access_token: str, refresh_token: str = None, id_token: str = None, exp: int = None):
+        self._write_social_tokens(
+            identifier, access_token, refresh_token, id_token,
+            access_ttl=self._ttl(exp, self.TOKEN_EXPIRATION_TIME),
+            id_ttl=self._ttl(exp, self.ID_TOKEN_EXPIRATION_TIME)
+        )
+
+    async def update_social_token(self, identifier: str, new_access_token: str, new_refresh_token: str = None, id_token: str = None, exp: int = None):
+        self._write_social_tokens(
+            identifier, new_access_token, new_refresh_token, id_token,
+            access_ttl=self._ttl(exp, self.TOKEN_EXPIRATION_TIME),
+            id_ttl=self._ttl(exp, self.ID_TOKEN_EXPIRATION_TIME)
+        )
+
+        return {
+            "access_token": new_access_token,
+            "refresh_token": new_refresh_token,
+            "expires_in": self.TOKEN_EXPIRATION_TIME,
+            "refresh_expires_in": self.REFRESH_TOKEN_EXPIRATION_TIME if new_refresh_token else None
+        }
+
+    async def retrieve_access_token(self, identifier: str):
+        return self._get((self.SOCIAL_ACCESS_TOKEN, identifier))
+
+    async def retrieve_social_refresh_token(self, identifier: str):
+        return self._get((self.SOCIAL_REFRESH_TOKEN, identifier))
+
+    async def create_refresh_token_for_access_token(self, access_token: str):
+        identifier = await self.validate_access_token(access_token)
+        if not identifier:
+            raise ValueError("Invalid or expired access token.")
+
+        return await self.create_token_pair(identifier)
+
+    async def store_reset_token(self, email: str, reset_token: str, expiration: int = 900):
+        """Store the password reset token for the user."""
+        self._set((self.RESET_TOKEN, email), reset_token, expiration)
+
+    async def get_reset_token(self, email: str) -> str:
+        """Retrieve the reset token for the user."""
+        return self._get((self.RESET_TOKEN, email))
+
+    async def delete_reset_token(self, email: str):
+        """Delete the reset token after the password has been reset."""
+        self._delete((self.RESET_TOKEN, email))
+
+    async def claim_once(self, key: str, ttl: float) -> bool:
+        """Claims a key for `ttl` seconds; returns False if it is already claimed."""
+        now = time.monotonic()
+        heap = self._claim_expiry_heap
+        while heap and heap[0][0] <= now:
+            expires_at, expired = heapq.heappop(heap)
+            if self._claims.get(expired) == expires_at:
+                del self._claims[expired]
+        if key in self._claims:
+            return False
+        self._claims[key] = now + ttl
+        heapq.heappush(heap, (now + ttl, key))
+        return True
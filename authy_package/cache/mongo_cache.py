@@ -0,0 +1,183 @@
+from datetime import datetime, timedelta, timezone
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from authy_package.cache.abstract_cache import AbstractCache
+from authy_package.utils.tokens import generate_token, token_digest
+
+DUPLICATE_KEY = 11000
+
+
+class MongoCaching(AbstractCache):
+    """
+    Cache backend on a MongoDB sessions collection, for deployments that keep users in MongoDB and
+    do not run Redis.
+
+    Every entry is one small document `{_id: "<kind>:<key>", v: value, exp: expiry}`. Bearer tokens
+    are stored under their digest, so the collection never holds usable session tokens.
+
+    - Expiry: a TTL index on `exp` lets the server delete expired documents. The TTL monitor only
+      runs about once a minute, so reads also filter on `exp`.
+    - Lookups: they are covered by the `(_id, exp, v)` index and are answered from the index alone,
+      without fetching documents.
+    - Writes: a token pair, or a set of social tokens, goes to the server as one bulk write.
+    """
+    ACCESS_TOKEN = "at"
+    REFRESH_TOKEN = "rt"
+    USER_REFRESH_TOKEN = "urt"
+    SOCIAL_ACCESS_TOKEN = "sat"
+    SOCIAL_REFRESH_TOKEN = "srt"
+    SOCIAL_ID_TOKEN = "sid"
+    RESET_TOKEN = "rs"
+    CLAIM = "cl"
+
+    LOOKUP_INDEX = [("_id", ASCENDING), ("exp", ASCENDING), ("v", ASCENDING)]
+
+    def __init__(self, client, db_name: str, collection_name: str = "authy_sessions", token_expiration_time: int = 3600,
+                 refresh_token_expiration_time: int = 604800, id_token_expiration_time: int = 3600):
+        """
+        :param client: An AsyncIOMotorClient (e.g. `MongoDB(...).client`, to share its pool) or a MongoDB URL.
+        :param db_name: The name of the database holding the sessions collection.
+        :param collection_name: The name of the sessions collection.
+        :param token_expiration_time: Lifetime of access tokens in seconds.
+        :param refresh_token_expiration_time: Lifetime of refresh tokens in seconds.
+        :param id_token_expiration_time: Lifetime of social ID tokens in seconds.
+        """
+        self.client = AsyncIOMotorClient(client) if isinstance(client, str) else client
+        self.collection = self.client[db_name][collection_name]
+        self.TOKEN_EXPIRATION_TIME = token_expiration_time
+        self.REFRESH_TOKEN_EXPIRATION_TIME = refresh_token_expiration_time
+        self.ID_TOKEN_EXPIRATION_TIME = id_token_expiration_time
+
+    async def create_indexes(self):
+        """Creates the TTL index and the covering lookup index if they do not exist."""
+        await self.collection.create_index("exp", expireAfterSeconds=0, name="exp_ttl")
+        await self.collection.create_index(self.LOOKUP_INDEX, name="lookup")
+
+    @staticmethod
+    def _key(kind: str, value: str) -> str:
+        return f"{kind}:{value}"
+
+    def _token_key(self, kind: str, token: str) -> str:
+        return self._key(kind, token_digest(token))
+
+    @staticmethod
+    def _expiry(seconds: int) -> datetime:
+        return datetime.now(timezone.utc) + timedelta(seconds=seconds)
+
+    def _upsert(self, key: str, value: str, expiration: int) -> UpdateOne:
+        return UpdateOne({"_id": key}, {"$set": {"v": value, "exp": self._expiry(expiration)}}, upsert=True)
+
+    async def _get(self, key: str):
+        # Filter and projection only touch the lookup index, so the query is covered
+        document = await self.collection.find_one(
+            {"_id": key, "exp": {"$gt": datetime.now(timezone.utc)}},
+            {"_id": 0, "v": 1},
+            hint=self.LOOKUP_INDEX
+        )
+        return document["v"] if document else None
+
+    async def create_token_pair(self, identifier: str):
+        while True:
+            access_token, refresh_token = generate_token(), generate_token()
+            refresh_token_key = self._token_key(self.REFRESH_TOKEN, refresh_token)
+            try:
+                await self.collection.bulk_write([
+                    InsertOne({"_id": self._token_key(self.ACCESS_TOKEN, access_token), "v": identifier, "exp": self._expiry(self.TOKEN_EXPIRATION_TIME)}),
+                    InsertOne({"_id": refresh_token_key, "v": identifier, "exp": self._expiry(self.REFRESH_TOKEN_EXPIRATION_TIME)}),
+                    # Points the user at their refresh token's document so delete_refresh_token can revoke it
+                    self._upsert(self._key(self.USER_REFRESH_TOKEN, identifier), refresh_token_key, self.REFRESH_TOKEN_EXPIRATION_TIME),
+                ])
+                return access_token, refresh_token
+            except BulkWriteError as e:
+                # A token collided with an existing key; retry with fresh tokens
+                if any(error.get("code") != DUPLICATE_KEY for error in e.details.get("writeErrors", [])):
+                    raise
+
+    async def delete_access_token(self, access_token: str):
+        await self.collection.delete_one({"_id": self._token_key(self.ACCESS_TOKEN, access_token)})
+
+    async def delete_refresh_token(self, identifier: str):
+        pointer = self._key(self.USER_REFRESH_TOKEN, identifier)
+        keys = [pointer, self._key(self.SOCIAL_REFRESH_TOKEN, identifier)]
+        refresh_token_key = await self._get(pointer)
+        if refresh_token_key:
+            keys.append(refresh_token_key)
+        await self.collection.delete_many({"_id": {"$in": keys}})
+
+    async def validate_access_token(self, access_token: str):
+        return await self._get(self._token_key(self.ACCESS_TOKEN, access_token))
+
+    async def validate_refresh_token(self, refresh_token: str):
+        return await self._get(self._token_key(self.REFRESH_TOKEN, refresh_token))
+
+    async def _write_social_tokens(self, identifier: str, access_token: str, refresh_token: str = None, id_token: str = None, access_ttl: int = None, id_ttl: int = None):
+        operations = [self._upsert(self._key(self.SOCIAL_ACCESS_TOKEN, identifier), access_token, access_ttl)]
+        if refresh_token:
+            operations.append(self._upsert(self._key(self.SOCIAL_REFRESH_TOKEN, identifier), refresh_token, self.REFRESH_TOKEN_EXPIRATION_TIME))
+        if id_token:
+            operations.append(self._upsert(self._key(self.SOCIAL_ID_TOKEN, identifier), id_token, id_ttl))
+        await self.collection.bulk_write(operations, ordered=False)
+
+    async def store_social_token(self, identifier: str, access_token: str, refresh_token: str = None, id_token: str = None, exp: int = None):
+        await self._write_social_tokens(
+            identifier, access_token, refresh_token, id_token,
+            access_ttl=self._ttl(exp, self.TOKEN_EXPIRATION_TIME),
+            id_ttl=self._ttl(exp, self.ID_TOKEN_EXPIRATION_TIME)
+        )
+
+    async def update_social_token(self, identifier: str, new_access_token: str, new_refresh_token: str = None, id_token: str = None, exp: int = None):
+        await self._write_social_tokens(
+            identifier, new_access_token, new_refresh_token, id_token,
+            access_ttl=self._ttl(exp, self.TOKEN_EXPIRATION_TIME),
+            id_ttl=self._ttl(exp, self.ID_TOKEN_EXPIRATION_TIME)
+        )
+
+        return {
+            "access_token": new_access_token,
+            "refresh_token": new_refresh_token,
+            "expires_in": self.TOKEN_EXPIRATION_TIME,
+            "refresh_expires_in": self.REFRESH_TOKEN_EXPIRATION_TIME if new_refresh_token else None
+        }
+
+    async def retrieve_access_token(self, identifier: str):
+        return await self._get(self._key(self.SOCIAL_ACCESS_TOKEN, identifier))
+
+    async def create_refresh_token_for_access_token(self, access_token: str):
+        identifier = await self.validate_access_token(access_token)
+        if not identifier:
+            raise ValueError("Invalid or expired access token.")
+
+        return await self.create_token_pair(identifier)
+
+    async def store_reset_token(self, email: str, reset_token: str, expiration: int = 900):
+        """Store the password reset token for the user."""
+        await self.collection.update_one(
+            {"_id": self._key(self.RESET_TOKEN, email)},
+            {"$set": {"v": reset_token, "exp": self._expiry(expiration)}},
+            upsert=True
+        )
+
+    async def get_reset_token(self, email: str) -> str:
+        """Retrieve the reset token for the user."""
+        return await self._get(self._key(self.RESET_TOKEN, email))
+
+    async def delete_reset_token(self, email: str):
+        """Delete the reset token after the password has been reset."""
+        await self.collection.delete_one({"_id": self._key(self.RESET_TOKEN, email)})
+
+    async def claim_once(self, key: str, ttl: float) -> bool:
+        """Claims a key for `ttl` seconds; returns False if a live document already claims it."""
+        # Only an expired document matches; a live one makes the upsert's insert fail on the _id
+        now = datetime.now(timezone.utc)
+        try:
+            await self.collection.update_one(
+                {"_id": self._key(self.CLAIM, key), "exp": {"$lte": now}},
+                {"$set": {"v": 1, "exp": now + timedelta(seconds=ttl)}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return False
+        return True
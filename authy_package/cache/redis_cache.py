@@ -1,47 +1,228 @@
-import aioredis
+import asyncio
 import time
-import hashlib
+from collections import OrderedDict
+from redis.asyncio import Redis, Sentinel
+from redis.asyncio.cluster import RedisCluster
+from redis.asyncio.retry import Retry
+from redis.backoff import ExponentialBackoff
+from redis.exceptions import ConnectionError, RedisError, TimeoutError
 
 from authy_package.cache.abstract_cache import AbstractCache
+from authy_package.cache.key_schema import KeySchema, estimate_hash_bytes, estimate_string_bytes
+from authy_package.utils.tokens import generate_token
 
 class RedisCaching(AbstractCache):
-    def __init__(self, cache_url: str, token_expiration_time: int = 3600, refresh_token_expiration_time: int = 604800, id_token_expiration_time:int = 3600):
-        self.redis = aioredis.from_url(cache_url)
+    STANDALONE = "standalone"
+    SENTINEL = "sentinel"
+    CLUSTER = "cluster"
+    INVALIDATION_CHANNEL = "__redis__:invalidate"
+
+    def __init__(self, cache_url: str = None, token_expiration_time: int = 3600, refresh_token_expiration_time: int = 604800, id_token_expiration_time:int = 3600, key_prefix: str = "authy", field_ttl: bool = False,
+                 mode: str = STANDALONE, sentinels: list = None, service_name: str = None, read_from_replicas: bool = False,
+                 client_tracking: bool = False, local_cache_size: int = 10000, **connection_kwargs):
+        """
+        :param cache_url: The Redis URL. In cluster mode, the URL of any node of the cluster.
+        :param token_expiration_time: Lifetime of access tokens in seconds.
+        :param refresh_token_expiration_time: Lifetime of refresh tokens in seconds.
+        :param id_token_expiration_time: Lifetime of social ID tokens in seconds.
+        :param key_prefix: Namespace prepended to every key (see KeySchema).
+        :param field_ttl: Expire fields of the per-user hash individually with HEXPIRE (Redis >= 7.4).
+            When disabled the hash expires as a group and per-field expiry times are stored next to the values.
+        :param mode: One of "standalone", "sentinel" or "cluster".
+        :param sentinels: A list of (host, port) tuples of the sentinels to ask for the master (sentinel mode).
+            Commands failing with a connection error are retried with backoff, so a failover is ridden out
+            unless `retry` is given in `connection_kwargs`.
+        :param service_name: The name of the monitored master (sentinel mode).
+        :param read_from_replicas: Serve token validation and other reads from replicas. Replication is
+            asynchronous, so a token may not be readable on a replica for a few milliseconds after it was issued.
+        :param client_tracking: Cache validated access tokens in-process, kept coherent by Redis server-assisted
+            client-side caching (CLIENT TRACKING). Call `start_tracking()` once the event loop is running.
+            Not available in cluster mode.
+        :param local_cache_size: Maximum number of access tokens kept in the in-process cache.
+        :param connection_kwargs: Extra options passed to the underlying client (e.g. password, ssl).
+        """
+        if mode == self.STANDALONE:
+            self.redis = Redis.from_url(cache_url, **connection_kwargs)
+            self.replica = self.redis
+        elif mode == self.SENTINEL:
+            if not sentinels or not service_name:
+                raise ValueError("Sentinel mode requires sentinels and service_name.")
+            # A failover closes the connections to the old master; a retried command reconnects to the
+            # master the sentinels elected instead of failing
+            connection_kwargs.setdefault("retry", Retry(ExponentialBackoff(cap=1.0, base=0.05), 6))
+            connection_kwargs.setdefault("retry_on_error", [ConnectionError, TimeoutError])
+            sentinel = Sentinel(sentinels, **connection_kwargs)
+            self.redis = sentinel.master_for(service_name)
+            self.replica = sentinel.slave_for(service_name) if read_from_replicas else self.redis
+        elif mode == self.CLUSTER:
+            if client_tracking:
+                raise ValueError("Client tracking is not supported in cluster mode.")
+            # The cluster client routes read commands to replicas itself
+            self.redis = RedisCluster.from_url(cache_url, read_from_replicas=read_from_replicas, **connection_kwargs)
+            self.replica = self.redis
+        else:
+            raise ValueError(f"Unsupported Redis mode: {mode}")
+
+        self.mode = mode
+        # Cluster pipelines cannot run MULTI/EXEC; hash tags keep them on a single shard instead
+        self.transaction = mode != self.CLUSTER
+        self.keys = KeySchema(key_prefix, hash_tags=mode == self.CLUSTER)
+        self.field_ttl = field_ttl
         self.TOKEN_EXPIRATION_TIME = token_expiration_time
         self.REFRESH_TOKEN_EXPIRATION_TIME = refresh_token_expiration_time
         self.ID_TOKEN_EXPIRATION_TIME = id_token_expiration_time
 
-    async def create_token_pair(self, identifier: str):
-        access_token = self._generate_token(identifier)
-        refresh_token = self._generate_token(identifier)
-        await self.redis.set(access_token, identifier, ex=self.TOKEN_EXPIRATION_TIME)
-        await self.redis.set(refresh_token, identifier, ex=self.REFRESH_TOKEN_EXPIRATION_TIME)
-        return access_token, refresh_token
+        self.client_tracking = client_tracking
+        self.local_cache_size = local_cache_size
+        # access-token key -> (identifier, expires_at), only consulted while tracking is active
+        self._local_cache = OrderedDict()
+        self._tracking_active = False
+        self._tracking_epoch = 0
+        self._tracking_task = None
+        self.local_cache_hits = 0
+        self.local_cache_misses = 0
+
+    async def start_tracking(self):
+        """
+        Starts server-assisted client-side caching of access tokens.
+
+        A dedicated connection subscribes to the invalidation channel, and a second one enables
+        `CLIENT TRACKING ... BCAST PREFIX <access token prefix>` redirected to it, so Redis pushes the name
+        of every access-token key that is deleted or expires. Validated tokens are then served from the
+        in-process cache until Redis invalidates them. The redirect form of tracking is used because it
+        also works with the hiredis parser, which cannot deliver RESP3 push messages to async clients.
+        """
+        if not self.client_tracking or self._tracking_task:
+            return
+        self._tracking_task = asyncio.create_task(self._track_invalidations())
+
+    async def close(self):
+        """Stops client-side caching and closes the connection pools."""
+        if self._tracking_task:
+            self._tracking_task.cancel()
+            try:
+                await self._tracking_task
+            except asyncio.CancelledError:
+                pass
+            self._tracking_task = None
+        await self.redis.aclose()
+        if self.replica is not self.redis:
+            await self.replica.aclose()
+
+    async def _track_invalidations(self):
+        pool = self.redis.connection_pool
+        while True:
+            connections = []
+            try:
+                listener = await pool.get_connection("SUBSCRIBE")
+                connections.append(listener)
+                tracker = await pool.get_connection("CLIENT")
+                connections.append(tracker)
+
+                await listener.send_command("CLIENT", "ID")
+                client_id = await listener.read_response()
+                await listener.send_command("SUBSCRIBE", self.INVALIDATION_CHANNEL)
+                await listener.read_response()
+                await tracker.send_command("CLIENT", "TRACKING", "ON", "REDIRECT", client_id, "BCAST", "PREFIX", self.keys.access_token_prefix())
+                await tracker.read_response()
+                self._tracking_active = True
+
+                while True:
+                    message = await listener.read_response(timeout=None)
+                    if not message or message[0] != b"message":
+                        continue
+                    self._tracking_epoch += 1
+                    keys = message[2]
+                    if keys is None:
+                        # The server flushed its keyspace or lost track of this client
+                        self._local_cache.clear()
+                    else:
+                        for key in keys:
+                            self._local_cache.pop(key.decode("utf-8") if isinstance(key, bytes) else key, None)
+            except (RedisError, OSError):
+                pass
+            finally:
+                # Without invalidations the local copies can no longer be trusted
+                self._tracking_active = False
+                self._local_cache.clear()
+                # Both connections carry tracking or subscription state, so they are never handed back for reuse
+                for connection in connections:
+                    await connection.disconnect()
+                    await pool.release(connection)
+            await asyncio.sleep(1)
 
-    def _generate_token(self, identifier: str) -> str:
-        return hashlib.sha256(f"{identifier}_{time.time()}".encode()).hexdigest()
+    async def create_token_pair(self, identifier: str):
+        user_key = self.keys.user(identifier)
+        while True:
+            access_token = self.keys.tag_token(identifier, generate_token())
+            refresh_token = self.keys.tag_token(identifier, generate_token())
+            access_key, refresh_key = self.keys.access_token(access_token), self.keys.refresh_token(refresh_token)
+            async with self.redis.pipeline(transaction=self.transaction) as pipe:
+                # NX guarantees a token is only handed out once no live token maps to the same key
+                pipe.set(access_key, identifier, ex=self.TOKEN_EXPIRATION_TIME, nx=True)
+                pipe.set(refresh_key, identifier, ex=self.REFRESH_TOKEN_EXPIRATION_TIME, nx=True)
+                pipe.hset(user_key, self.keys.REFRESH_TOKEN_KEY, refresh_key)
+                pipe.expire(user_key, self.REFRESH_TOKEN_EXPIRATION_TIME)
+                stored_access, stored_refresh, *_ = await pipe.execute()
+            if stored_access and stored_refresh:
+                return access_token, refresh_token
+            # A key collided with a live token; drop whatever half was stored and draw again
+            stored_keys = [key for key, stored in ((access_key, stored_access), (refresh_key, stored_refresh)) if stored]
+            if stored_keys:
+                await self.redis.delete(*stored_keys)
 
     async def delete_access_token(self, access_token: str):
-        await self.redis.delete(access_token)
+        key = self.keys.access_token(access_token)
+        self._local_cache.pop(key, None)
+        await self.redis.delete(key)
 
     async def delete_refresh_token(self, identifier: str):
-        refresh_token = f"refresh_{identifier}"
-        await self.redis.delete(refresh_token)
+        user_key = self.keys.user(identifier)
+        refresh_key = await self.redis.hget(user_key, self.keys.REFRESH_TOKEN_KEY)
+        async with self.redis.pipeline(transaction=self.transaction) as pipe:
+            if refresh_key:
+                pipe.delete(refresh_key)
+            pipe.hdel(user_key, self.keys.REFRESH_TOKEN_KEY, self.keys.SOCIAL_REFRESH_TOKEN, self.keys.expires_field(self.keys.SOCIAL_REFRESH_TOKEN))
+            await pipe.execute()
 
-    async def store_social_token(self, identifier: str, access_token: str, refresh_token: str = None, id_token: str = None, exp: int = None):
-        await self.redis.set(f"{identifier}_access_token", access_token, ex=exp or self.TOKEN_EXPIRATION_TIME)
+    async def _write_social_tokens(self, identifier: str, access_token: str, refresh_token: str = None, id_token: str = None, access_ttl: int = None, id_ttl: int = None):
+        """Packs the social tokens of a user into their hash with a single round trip."""
+        fields = {self.keys.SOCIAL_ACCESS_TOKEN: (access_token, access_ttl)}
         if refresh_token:
-            await self.redis.set(f"{identifier}_refresh_token", refresh_token, ex=self.REFRESH_TOKEN_EXPIRATION_TIME)
+            fields[self.keys.SOCIAL_REFRESH_TOKEN] = (refresh_token, self.REFRESH_TOKEN_EXPIRATION_TIME)
         if id_token:
-            await self.redis.set(f"{identifier}_id_token", id_token, ex=exp or self.ID_TOKEN_EXPIRATION_TIME)
+            fields[self.keys.SOCIAL_ID_TOKEN] = (id_token, id_ttl)
+
+        now = int(time.time())
+        mapping = {}
+        for field, (value, ttl) in fields.items():
+            mapping[field] = value
+            if not self.field_ttl:
+                mapping[self.keys.expires_field(field)] = now + ttl
+
+        user_key = self.keys.user(identifier)
+        async with self.redis.pipeline(transaction=self.transaction) as pipe:
+            pipe.hset(user_key, mapping=mapping)
+            if self.field_ttl:
+                for field, (_, ttl) in fields.items():
+                    pipe.execute_command("HEXPIRE", user_key, ttl, "FIELDS", 1, field)
+            pipe.expire(user_key, max([self.REFRESH_TOKEN_EXPIRATION_TIME] + [ttl for _, ttl in fields.values()]))
+            await pipe.execute()
+
+    async def store_social_token(self, identifier: str, access_token: str, refresh_token: str = None, id_token: str = None, exp: int = None):
+        await self._write_social_tokens(
+            identifier, access_token, refresh_token, id_token,
+            access_ttl=self._ttl(exp, self.TOKEN_EXPIRATION_TIME),
+            id_ttl=self._ttl(exp, self.ID_TOKEN_EXPIRATION_TIME)
+        )
 
     async def update_social_token(self, identifier: str, new_access_token: str, new_refresh_token: str = None, id_token: str = None, exp: int = None):
-        await self.redis.set(f"{identifier}_access_token", new_access_token, ex=self.TOKEN_EXPIRATION_TIME)
-        if new_refresh_token:
-            await self.redis.set(f"{identifier}_refresh_token", new_refresh_token, ex=self.REFRESH_TOKEN_EXPIRATION_TIME)
-        if id_token:
-            await self.redis.set(f"{identifier}_id_token", id_token, ex=exp or self.REFRESH_TOKEN_EXPIRATION_TIME)
-        
+        await self._write_social_tokens(
+            identifier, new_access_token, new_refresh_token, id_token,
+            access_ttl=self._ttl(exp, self.TOKEN_EXPIRATION_TIME),
+            id_ttl=self._ttl(exp, self.ID_TOKEN_EXPIRATION_TIME)
+        )
+
         return {
             "access_token": new_access_token,
             "refresh_token": new_refresh_token,
@@ -50,52 +231,138 @@ class RedisCaching(AbstractCache):
         }
 
     async def validate_access_token(self, access_token: str):
-        identifier = await self.redis.get(access_token)
-        if identifier:
-            return identifier.decode('utf-8')
-        return None
+        key = self.keys.access_token(access_token)
+        if not self._tracking_active:
+            identifier = await self.replica.get(key)
+            if identifier:
+                return identifier.decode('utf-8')
+            return None
+
+        cached = self._local_cache.get(key)
+        if cached and cached[1] > time.monotonic():
+            self._local_cache.move_to_end(key)
+            self.local_cache_hits += 1
+            return cached[0]
+
+        self.local_cache_misses += 1
+        epoch = self._tracking_epoch
+        async with self.replica.pipeline(transaction=False) as pipe:
+            pipe.get(key)
+            pipe.pttl(key)
+            identifier, ttl = await pipe.execute()
+        if not identifier:
+            return None
+        identifier = identifier.decode('utf-8')
+        # An invalidation that arrived while the read was in flight may concern this key; do not cache it then
+        if epoch == self._tracking_epoch and ttl > 0:
+            self._local_cache[key] = (identifier, time.monotonic() + ttl / 1000)
+            if len(self._local_cache) > self.local_cache_size:
+                self._local_cache.popitem(last=False)
+        return identifier
+
+    def local_cache_hit_ratio(self) -> float:
+        """Share of tracked access-token validations answered from the client-side cache."""
+        lookups = self.local_cache_hits + self.local_cache_misses
+        return self.local_cache_hits / lookups if lookups else 0.0
 
     async def validate_refresh_token(self, refresh_token: str):
-        identifier = await self.redis.get(refresh_token)
+        # Expiry is enforced by the key TTL set in create_token_pair
+        identifier = await self.replica.get(self.keys.refresh_token(refresh_token))
         if identifier:
-            # Ensure token has not expired
-            token_creation_time = int(refresh_token.split("_")[-1])
-            if time.time() - token_creation_time > self.REFRESH_TOKEN_EXPIRATION_TIME:
-                await self.delete_refresh_token(identifier.decode('utf-8'))
-                return None
             return identifier.decode('utf-8')
         return None
-    
+
     async def retrieve_access_token(self, identifier: str):
-        access_token = await self.redis.get(f"{identifier}_access_token")
-        if access_token:
-            return access_token.decode('utf-8')
-        return None
-    
+        field = self.keys.SOCIAL_ACCESS_TOKEN
+        access_token, expires_at = await self.replica.hmget(self.keys.user(identifier), field, self.keys.expires_field(field))
+        if not access_token:
+            return None
+        if expires_at and int(expires_at) <= time.time():
+            return None
+        return access_token.decode('utf-8')
+
+    async def retrieve_social_refresh_token(self, identifier: str):
+        field = self.keys.SOCIAL_REFRESH_TOKEN
+        refresh_token, expires_at = await self.replica.hmget(self.keys.user(identifier), field, self.keys.expires_field(field))
+        if not refresh_token:
+            return None
+        if expires_at and int(expires_at) <= time.time():
+            return None
+        return refresh_token.decode('utf-8')
+
     async def create_refresh_token_for_access_token(self, access_token: str):
         identifier = await self.validate_access_token(access_token)
         if not identifier:
             raise ValueError("Invalid or expired access token.")
 
-        refresh_token = self._generate_token(identifier)
-        access_token = self._generate_token(identifier)
+        return await self.create_token_pair(identifier)
 
-        await self.redis.set(access_token, identifier, ex=self.TOKEN_EXPIRATION_TIME)
-        await self.redis.set(refresh_token, identifier, ex=self.REFRESH_TOKEN_EXPIRATION_TIME)
-        return access_token, refresh_token
-    
     # Store a reset change password token with an expiration time
     async def store_reset_token(self, email: str, reset_token: str, expiration: int = 900):
         """Store the password reset token for the user."""
-        await self.redis.set(f"reset_token_{email}", reset_token, ex=expiration)
+        await self.redis.set(self.keys.reset_token(email), reset_token, ex=expiration)
 
     # Retrieve the reset change password token from Redis
     async def get_reset_token(self, email: str) -> str:
         """Retrieve the reset token for the user."""
-        token = await self.redis.get(f"reset_token_{email}")
+        token = await self.replica.get(self.keys.reset_token(email))
         return token.decode('utf-8') if token else None
 
     # Delete the reset change password token after successful password update
     async def delete_reset_token(self, email: str):
         """Delete the reset token after the password has been reset."""
-        await self.redis.delete(f"reset_token_{email}")
+        await self.redis.delete(self.keys.reset_token(email))
+
+    async def claim_once(self, key: str, ttl: float) -> bool:
+        """Claims a key for `ttl` seconds with a `SET NX`; returns False if it is already claimed."""
+        return bool(await self.redis.set(self.keys.claim(key), 1, nx=True, px=max(int(ttl * 1000), 1)))
+
+    async def memory_report(self, identifier: str = "user@example.com", sessions: int = 1_000_000, measure: bool = False) -> dict:
+        """
+        Estimates the Redis memory used per session.
+
+        A session is a token pair plus the user's hash holding the social access, refresh and ID
+        tokens. The legacy layout (one top-level string per token) is estimated alongside for comparison.
+
+        :param identifier: A representative user identifier; its length affects the estimate.
+        :param sessions: The number of sessions to extrapolate the totals to.
+        :param measure: Also write a throwaway session and read back `MEMORY USAGE` for each of its keys.
+        :return: A dictionary with per-session bytes and extrapolated megabytes.
+        """
+        token = generate_token()
+        social_token = "x" * 200
+        user_fields = {self.keys.REFRESH_TOKEN_KEY: self.keys.refresh_token(token)}
+        for field in (self.keys.SOCIAL_ACCESS_TOKEN, self.keys.SOCIAL_REFRESH_TOKEN, self.keys.SOCIAL_ID_TOKEN):
+            user_fields[field] = social_token
+            if not self.field_ttl:
+                user_fields[self.keys.expires_field(field)] = int(time.time())
+
+        estimated = (
+            estimate_string_bytes(len(self.keys.access_token(token)), len(identifier))
+            + estimate_string_bytes(len(self.keys.refresh_token(token)), len(identifier))
+            + estimate_hash_bytes(len(self.keys.user(identifier)), user_fields)
+        )
+        legacy = 2 * estimate_string_bytes(64, len(identifier)) + sum(
+            estimate_string_bytes(len(f"{identifier}_{suffix}"), len(social_token))
+            for suffix in ("access_token", "refresh_token", "id_token")
+        )
+        report = {
+            "keys_per_session": 3,
+            "legacy_keys_per_session": 5,
+            "estimated_bytes_per_session": estimated,
+            "legacy_estimated_bytes_per_session": legacy,
+            "estimated_mb": estimated * sessions / 2**20,
+            "legacy_estimated_mb": legacy * sessions / 2**20,
+        }
+
+        if measure:
+            sample = f"memory-report-{generate_token(6)}"
+            access_token, refresh_token = await self.create_token_pair(sample)
+            await self.store_social_token(sample, social_token, social_token, social_token)
+            keys = [self.keys.access_token(access_token), self.keys.refresh_token(refresh_token), self.keys.user(sample)]
+            measured = sum([(await self.redis.memory_usage(key)) or 0 for key in keys])
+            await self.redis.delete(*keys)
+            report["measured_bytes_per_session"] = measured
+            report["measured_mb"] = measured * sessions / 2**20
+
+        return report
@@ -0,0 +1,252 @@
+import asyncio
+import logging
+import time
+
+from sqlalchemy import Column, Float, Index, MetaData, String, Table, delete, select
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from authy_package.cache.abstract_cache import AbstractCache
+from authy_package.utils.tokens import generate_token, token_digest
+
+logger = logging.getLogger(__name__)
+
+
+class SQLCaching(AbstractCache):
+    """
+    Cache backend on a SQLAlchemy async engine, for deployments with a SQL database but no Redis.
+
+    Everything lives in one compact table `(key, value, expires_at)`. Bearer tokens are stored under
+    `<kind>:<digest>` keys, so validating a token is a single primary-key lookup and the table never
+    holds usable session tokens. Expired rows are ignored by every read and removed in batches by `sweep()`,
+    which `start_sweeper()` runs periodically in the background.
+
+    On PostgreSQL the table is created UNLOGGED: sessions are cheap to lose on a crash (users log in
+    again), and skipping the WAL roughly halves the cost of every write. Upserts use
+    `INSERT ... ON CONFLICT`, available on PostgreSQL and SQLite.
+    """
+    ACCESS_TOKEN = "at"
+    REFRESH_TOKEN = "rt"
+    USER_REFRESH_TOKEN = "urt"
+    SOCIAL_ACCESS_TOKEN = "sat"
+    SOCIAL_REFRESH_TOKEN = "srt"
+    SOCIAL_ID_TOKEN = "sid"
+    RESET_TOKEN = "rs"
+    CLAIM = "cl"
+
+    def __init__(self, engine, table_name: str = "authy_sessions", token_expiration_time: int = 3600, refresh_token_expiration_time: int = 604800,
+                 id_token_expiration_time: int = 3600, unlogged: bool = True, sweep_interval: float = 60, sweep_batch_size: int = 5000):
+        """
+        :param engine: An AsyncEngine (e.g. `SQLDatabase(...).engine`, to share its pool) or a database URL.
+        :param table_name: The name of the session table.
+        :param token_expiration_time: Lifetime of access tokens in seconds.
+        :param refresh_token_expiration_time: Lifetime of refresh tokens in seconds.
+        :param id_token_expiration_time: Lifetime of social ID tokens in seconds.
+        :param unlogged: Create the table UNLOGGED on PostgreSQL.
+        :param sweep_interval: Seconds between two background sweeps.
+        :param sweep_batch_size: Rows deleted per statement while sweeping, to keep locks and transactions short.
+        """
+        self.engine = engine if isinstance(engine, AsyncEngine) else create_async_engine(engine)
+        self.dialect = self.engine.dialect.name
+        if self.dialect not in ("postgresql", "sqlite"):
+            raise ValueError(f"SQLCaching requires PostgreSQL or SQLite, got {self.dialect}")
+        self.TOKEN_EXPIRATION_TIME = token_expiration_time
+        self.REFRESH_TOKEN_EXPIRATION_TIME = refresh_token_expiration_time
+        self.ID_TOKEN_EXPIRATION_TIME = id_token_expiration_time
+        self.sweep_interval = sweep_interval
+        self.sweep_batch_size = sweep_batch_size
+        self._sweeper_task = None
+
+        self.metadata = MetaData()
+        self.table = Table(
+            table_name, self.metadata,
+            Column("key", String(255), primary_key=True),
+            Column("value", String, nullable=False),
+            Column("expires_at", Float, nullable=False),
+            Index(f"ix_{table_name}_expires_at", "expires_at"),
+            prefixes=["UNLOGGED"] if unlogged and self.dialect == "postgresql" else [],
+        )
+
+    async def create_table(self):
+        """Creates the session table and its expiry index if they do not exist."""
+        async with self.engine.begin() as connection:
+            await connection.run_sync(self.metadata.create_all)
+
+    def _insert(self):
+        if self.dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        return insert(self.table)
+
+    def _upsert(self, rows: list):
+        statement = self._insert().values(rows)
+        return statement.on_conflict_do_update(
+            index_elements=[self.table.c.key],
+            set_={"value": statement.excluded.value, "expires_at": statement.excluded.expires_at}
+        )
+
+    def _insert_new(self, row: dict, now: float):
+        """Inserts a row whose key is either absent or expired (Redis' SET NX)."""
+        statement = self._insert().values(row)
+        return statement.on_conflict_do_update(
+            index_elements=[self.table.c.key],
+            set_={"value": statement.excluded.value, "expires_at": statement.excluded.expires_at},
+            where=self.table.c.expires_at <= now
+        )
+
+    @staticmethod
+    def _key(kind: str, value: str) -> str:
+        return f"{kind}:{value}"
+
+    def _token_key(self, kind: str, token: str) -> str:
+        return self._key(kind, token_digest(token))
+
+    async def _get(self, key: str):
+        async with self.engine.connect() as connection:
+            return await connection.scalar(
+                select(self.table.c.value).where(self.table.c.key == key, self.table.c.expires_at > time.time())
+            )
+
+    async def _set(self, key: str, value: str, expiration: int):
+        async with self.engine.begin() as connection:
+            await connection.execute(self._upsert([{"key": key, "value": value, "expires_at": time.time() + expiration}]))
+
+    async def _delete(self, *keys: str):
+        async with self.engine.begin() as connection:
+            await connection.execute(delete(self.table).where(self.table.c.key.in_(keys)))
+
+    async def create_token_pair(self, identifier: str):
+        async with self.engine.begin() as connection:
+            access_token = await self._store_new_token(connection, self.ACCESS_TOKEN, identifier, self.TOKEN_EXPIRATION_TIME)
+            refresh_token = await self._store_new_token(connection, self.REFRESH_TOKEN, identifier, self.REFRESH_TOKEN_EXPIRATION_TIME)
+            # Points the user at their refresh token's row so delete_refresh_token can revoke it
+            await connection.execute(self._upsert([{
+                "key": self._key(self.USER_REFRESH_TOKEN, identifier), "value": self._token_key(self.REFRESH_TOKEN, refresh_token),
+                "expires_at": time.time() + self.REFRESH_TOKEN_EXPIRATION_TIME
+            }]))
+        return access_token, refresh_token
+
+    async def _store_new_token(self, connection, kind: str, identifier: str, expiration: int) -> str:
+        while True:
+            token, now = generate_token(), time.time()
+            row = {"key": self._token_key(kind, token), "value": identifier, "expires_at": now + expiration}
+            # Nothing is written when a live row already holds the key; retry with a fresh token then
+            if (await connection.execute(self._insert_new(row, now))).rowcount == 1:
+                return token
+
+    async def delete_access_token(self, access_token: str):
+        await self._delete(self._token_key(self.ACCESS_TOKEN, access_token))
+
+    async def delete_refresh_token(self, identifier: str):
+        pointer = self._key(self.USER_REFRESH_TOKEN, identifier)
+        async with self.engine.begin() as connection:
+            refresh_token_key = await connection.scalar(select(self.table.c.value).where(self.table.c.key == pointer))
+            keys = [pointer, self._key(self.SOCIAL_REFRESH_TOKEN, identifier)]
+            if refresh_token_key:
+                keys.append(refresh_token_key)
+            await connection.execute(delete(self.table).where(self.table.c.key.in_(keys)))
+
+    async def validate_access_token(self, access_token: str):
+        return await self._get(self._token_key(self.ACCESS_TOKEN, access_token))
+
+    async def validate_refresh_token(self, refresh_token: str):
+        return await self._get(self._token_key(self.REFRESH_TOKEN, refresh_token))
+
+    async def _write_social_tokens(self, identifier: str, access_token: str, refresh_token: str = None, id_token: str = None, access_ttl: int = None, id_ttl: int = None):
+        now = time.time()
+        rows = [{"key": self._key(self.SOCIAL_ACCESS_TOKEN, identifier), "value": access_token, "expires_at": now + access_ttl}]
+        if refresh_token:
+            rows.append({"key": self._key(self.SOCIAL_REFRESH_TOKEN, identifier), "value": refresh_token, "expires_at": now + self.REFRESH_TOKEN_EXPIRATION_TIME})
+        if id_token:
+            rows.append({"key": self._key(self.SOCIAL_ID_TOKEN, identifier), "value": id_token, "expires_at": now + id_ttl})
+        async with self.engine.begin() as connection:
+            await connection.execute(self._upsert(rows))
+
+    async def store_social_token(self, identifier: str, access_token: str, refresh_token: str = None, id_token: str = None, exp: int = None):
+        await self._write_social_tokens(
+            identifier, access_token, refresh_token, id_token,
+            access_ttl=self._ttl(exp, self.TOKEN_EXPIRATION_TIME),
+            id_ttl=self._ttl(exp, self.ID_TOKEN_EXPIRATION_TIME)
+        )
+
+    async def update_social_token(self, identifier: str, new_access_token: str, new_refresh_token: str = None, id_token: str = None, exp: int = None):
+        await self._write_social_tokens(
+            identifier, new_access_token, new_refresh_token, id_token,
+            access_ttl=self._ttl(exp, self.TOKEN_EXPIRATION_TIME),
+            id_ttl=self._ttl(exp, self.ID_TOKEN_EXPIRATION_TIME)
+        )
+
+        return {
+            "access_token": new_access_token,
+            "refresh_token": new_refresh_token,
+            "expires_in": self.TOKEN_EXPIRATION_TIME,
+            "refresh_expires_in": self.REFRESH_TOKEN_EXPIRATION_TIME if new_refresh_token else None
+        }
+
+    async def retrieve_access_token(self, identifier: str):
+        return await self._get(self._key(self.SOCIAL_ACCESS_TOKEN, identifier))
+
+    async def create_refresh_token_for_access_token(self, access_token: str):
+        identifier = await self.validate_access_token(access_token)
+        if not identifier:
+            raise ValueError("Invalid or expired access token.")
+
+        return await self.create_token_pair(identifier)
+
+    async def store_reset_token(self, email: str, reset_token: str, expiration: int = 900):
+        """Store the password reset token for the user."""
+        await self._set(self._key(self.RESET_TOKEN, email), reset_token, expiration)
+
+    async def get_reset_token(self, email: str) -> str:
+        """Retrieve the reset token for the user."""
+        return await self._get(self._key(self.RESET_TOKEN, email))
+
+    async def delete_reset_token(self, email: str):
+        """Delete the reset token after the password has been reset."""
+        await self._delete(self._key(self.RESET_TOKEN, email))
+
+    async def claim_once(self, key: str, ttl: float) -> bool:
+        """Claims a key for `ttl` seconds; returns False if a live row already claims it."""
+        now = time.time()
+        async with self.engine.begin() as connection:
+            result = await connection.execute(self._insert_new({"key": self._key(self.CLAIM, key), "value": "1", "expires_at": now + ttl}, now))
+        return result.rowcount == 1
+
+    async def sweep(self) -> int:
+        """
+        Deletes expired rows in batches of `sweep_batch_size`, each in its own short transaction.
+
+        :return: The number of rows deleted.
+        """
+        removed = 0
+        while True:
+            expired = select(self.table.c.key).where(self.table.c.expires_at <= time.time()).limit(self.sweep_batch_size)
+            async with self.engine.begin() as connection:
+                result = await connection.execute(delete(self.table).where(self.table.c.key.in_(expired.scalar_subquery())))
+            removed += result.rowcount
+            if result.rowcount < self.sweep_batch_size:
+                return removed
+
+    async def _sweep_forever(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sweep()
+            except Exception:
+                # A failed sweep only delays cleanup; reads already ignore expired rows
+                logger.exception("Sweeping expired sessions failed")
+
+    def start_sweeper(self):
+        """Starts sweeping expired rows every `sweep_interval` seconds on the running event loop."""
+        if self._sweeper_task is None:
+            self._sweeper_task = asyncio.create_task(self._sweep_forever())
+
+    async def close(self):
+        """Stops the background sweeper."""
+        if self._sweeper_task is not None:
+            self._sweeper_task.cancel()
+            try:
+                await self._sweeper_task
+            except asyncio.CancelledError:
+                pass
+            self._sweeper_task = None
@@ -1,5 +1,6 @@
 # auth_package/cognito/__init__.py
 
 from .cognito_manager import CognitoManager
+from .profile_mirror import CognitoProfileMirror
 
-__all__ = ["CognitoManager"]
+__all__ = ["CognitoManager", "CognitoProfileMirror"]
@@ -1,14 +1,82 @@
+import asyncio
+import datetime
+import functools
+import gzip
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import boto3
-from botocore.exceptions import ClientError
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+
+from authy_package.utils.resilience import AdaptiveConcurrency, CircuitBreaker, ProviderUnavailableError
+
+# Per-attempt deadlines, and botocore's standard retries: jittered exponential backoff drawing on a
+# client-wide retry quota, so a Cognito outage is not multiplied by retries
+DEFAULT_CONFIG = Config(connect_timeout=2, read_timeout=5, retries={"mode": "standard", "total_max_attempts": 3})
+THROTTLING_ERRORS = frozenset({"TooManyRequestsException", "ThrottlingException", "LimitExceededException"})
+
+# Username prefixes that partition a pool whose usernames are UUIDs (e.g. pools signing in by email alias)
+HEX_PREFIXES = tuple("0123456789abcdef")
+LIST_USERS_PAGE_SIZE = 60
+
+MFA_PREFERRED = {'Enabled': True, 'PreferredMfa': True}
+MFA_DISABLED = {'Enabled': False, 'PreferredMfa': False}
+
 
 class CognitoManager:
-    def __init__(self, region_name, user_pool_id, app_client_id):
+    def __init__(self, region_name, user_pool_id, app_client_id, config: Config = None, failure_rate: float = 0.5, reset_timeout: float = 30.0,
+                 endpoint_url: str = None):
         """
         Initializes the CognitoManager with the necessary configurations.
-        """
-        self.cognito_client = boto3.client('cognito-idp', region_name=region_name)
+
+        Every Cognito operation gets its own circuit breaker: once the share of failures (5xx, throttling,
+        connection errors and timeouts) among its recent calls reaches `failure_rate`, the operation raises
+        ProviderUnavailableError without calling Cognito, until a probe succeeds after `reset_timeout` seconds.
+
+        :param config: The botocore client configuration; defaults to DEFAULT_CONFIG.
+        :param failure_rate: Share of failed recent calls that opens an operation's breaker, or None to disable breakers.
+        :param reset_timeout: Seconds an open breaker refuses calls before letting a probe through.
+        :param endpoint_url: A Cognito endpoint other than AWS's, e.g. a local stub.
+        """
+        self.config = config or DEFAULT_CONFIG
+        self.endpoint_url = endpoint_url
+        self.cognito_client = boto3.client('cognito-idp', region_name=region_name, config=self.config, endpoint_url=endpoint_url)
         self.user_pool_id = user_pool_id
         self.app_client_id = app_client_id
+        self.failure_rate = failure_rate
+        self.reset_timeout = reset_timeout
+        self.breakers = {}
+        if failure_rate is not None:
+            events = self.cognito_client.meta.events
+            events.register_first("before-call.cognito-identity-provider", self._before_call)
+            events.register("after-call.cognito-identity-provider", self._after_call)
+            events.register("after-call-error.cognito-identity-provider", self._after_call_error)
+
+    def _before_call(self, model, context, **kwargs):
+        breaker = self.breakers.get(model.name)
+        if breaker is None:
+            breaker = self.breakers[model.name] = CircuitBreaker(self.failure_rate, reset_timeout=self.reset_timeout)
+        if not breaker.allow():
+            raise ProviderUnavailableError(f"Circuit open for Cognito {model.name}")
+        context["circuit_breaker"] = breaker
+
+    def _after_call(self, http_response, parsed, context, **kwargs):
+        breaker = context.get("circuit_breaker")
+        if breaker is None:
+            return
+        error_code = parsed.get("Error", {}).get("Code")
+        if http_response.status_code >= 500 or error_code in THROTTLING_ERRORS:
+            breaker.record_failure()
+        else:
+            # Client errors (wrong password, unknown user, ...) say nothing about Cognito's health
+            breaker.record_success()
+
+    def _after_call_error(self, context, **kwargs):
+        breaker = context.get("circuit_breaker")
+        if breaker is not None:
+            breaker.record_failure()
 
     def register_user(self, username, password, email, phone_number=None):
         """
@@ -180,10 +248,7 @@ class CognitoManager:
             response = self.cognito_client.admin_set_user_mfa_preference(
                 UserPoolId=self.user_pool_id,
                 Username=username,
-                SoftwareTokenMfaSettings={
-                    'Enabled': True,
-                    'PreferredMfa': True
-                }
+                SoftwareTokenMfaSettings=MFA_PREFERRED
             )
             return response
         except ClientError as e:
@@ -198,10 +263,7 @@ class CognitoManager:
             response = self.cognito_client.admin_set_user_mfa_preference(
                 UserPoolId=self.user_pool_id,
                 Username=username,
-                SMSMfaSettings={
-                    'Enabled': True,
-                    'PreferredMfa': True
-                }
+                SMSMfaSettings=MFA_PREFERRED
             )
             return response
         except ClientError as e:
@@ -215,14 +277,8 @@ class CognitoManager:
             response = self.cognito_client.admin_set_user_mfa_preference(
                 UserPoolId=self.user_pool_id,
                 Username=username,
-                SMSMfaSettings={
-                    'Enabled': False,
-                    'PreferredMfa': False
-                },
-                SoftwareTokenMfaSettings={
-                    'Enabled': False,
-                    'PreferredMfa': False
-                }
+                SMSMfaSettings=MFA_DISABLED,
+                SoftwareTokenMfaSettings=MFA_DISABLED
             )
             return response
         except ClientError as e:
@@ -295,4 +351,244 @@ class CognitoManager:
             )
             return response
         except ClientError as e:
-            return {"Error": str(e)}
\ No newline at end of file
+            return {"Error": str(e)}
+
+    def bulk_enable_totp_mfa(self, usernames, concurrency: AdaptiveConcurrency = None, max_retries: int = 8):
+        """
+        Enables TOTP-based MFA for many users; see `_bulk` for how the calls are paced.
+
+        :param usernames: An iterable of usernames; it is consumed lazily.
+        :return: An async iterator of per-user results.
+        """
+        return self._bulk("admin_set_user_mfa_preference",
+                          ((username, {'SoftwareTokenMfaSettings': MFA_PREFERRED}) for username in usernames), concurrency, max_retries)
+
+    def bulk_enable_sms_mfa(self, usernames, concurrency: AdaptiveConcurrency = None, max_retries: int = 8):
+        """
+        Enables SMS-based MFA for many users (each needs a verified phone number); see `_bulk`.
+
+        :param usernames: An iterable of usernames; it is consumed lazily.
+        :return: An async iterator of per-user results.
+        """
+        return self._bulk("admin_set_user_mfa_preference",
+                          ((username, {'SMSMfaSettings': MFA_PREFERRED}) for username in usernames), concurrency, max_retries)
+
+    def bulk_disable_mfa(self, usernames, concurrency: AdaptiveConcurrency = None, max_retries: int = 8):
+        """
+        Disables all MFA options for many users; see `_bulk`.
+
+        :param usernames: An iterable of usernames; it is consumed lazily.
+        :return: An async iterator of per-user results.
+        """
+        settings = {'SMSMfaSettings': MFA_DISABLED, 'SoftwareTokenMfaSettings': MFA_DISABLED}
+        return self._bulk("admin_set_user_mfa_preference", ((username, settings) for username in usernames), concurrency, max_retries)
+
+    def bulk_update_user_attributes(self, updates, concurrency: AdaptiveConcurrency = None, max_retries: int = 8):
+        """
+        Updates the attributes of many users; see `_bulk`.
+
+        :param updates: An iterable of `(username, attributes)` pairs, with attributes as for `update_user_attributes`.
+        :return: An async iterator of per-user results.
+        """
+        return self._bulk("admin_update_user_attributes",
+                          ((username, {'UserAttributes': attributes}) for username, attributes in updates), concurrency, max_retries)
+
+    def _admin_client(self, max_connections: int):
+        """
+        Creates the client and thread pool of a bulk run: without botocore's own retries and without the
+        circuit breakers, so throttling reaches the run's AdaptiveConcurrency limiter at once and a bulk
+        run cannot open the breakers that interactive calls depend on.
+        """
+        config = self.config.merge(Config(retries={"mode": "standard", "total_max_attempts": 1}, max_pool_connections=max_connections))
+        client = boto3.client('cognito-idp', region_name=self.cognito_client.meta.region_name, config=config, endpoint_url=self.endpoint_url)
+        return client, ThreadPoolExecutor(max_workers=max_connections)
+
+    @staticmethod
+    async def _paced_call(executor, call, concurrency: AdaptiveConcurrency, max_retries: int, **params):
+        """
+        Makes a call under the limiter and retries it while Cognito throttles, up to `max_retries` times.
+
+        :return: `(response, error, attempts)`, with either the response or the final error set.
+        """
+        loop = asyncio.get_running_loop()
+        for attempt in range(max_retries + 1):
+            epoch = await concurrency.acquire()
+            try:
+                response = await loop.run_in_executor(executor, functools.partial(call, **params))
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") not in THROTTLING_ERRORS:
+                    # Cognito answered (unknown user, invalid attribute, ...), so the pace is fine
+                    concurrency.record_success()
+                    return None, e, attempt + 1
+                concurrency.record_throttle(epoch)
+                error = e
+            except BotoCoreError as e:
+                return None, e, attempt + 1
+            else:
+                concurrency.record_success()
+                response.pop("ResponseMetadata", None)
+                return response, None, attempt + 1
+            finally:
+                concurrency.release()
+        return None, error, max_retries + 1
+
+    async def _bulk(self, operation: str, requests, concurrency: AdaptiveConcurrency = None, max_retries: int = 8):
+        """
+        Runs an admin operation for many users and yields each user's result as soon as it is known.
+
+        The calls run in parallel under an AdaptiveConcurrency limit: it grows while Cognito accepts
+        them, and when Cognito throttles (TooManyRequestsException and friends) it is halved and new
+        calls back off for a jittered, exponentially growing pause. A throttled call is retried once
+        the limiter admits it again, up to `max_retries` times. The calls go through the client of
+        `_admin_client`. At most `concurrency.maximum` users are read ahead from `requests`.
+
+        Each result is `{"username": ..., "response": ..., "attempts": ...}` or, if the call failed for
+        good, `{"username": ..., "Error": ..., "attempts": ...}`, in completion order.
+
+        :param operation: The boto3 client method, e.g. "admin_set_user_mfa_preference".
+        :param requests: An iterable of `(username, parameters)` pairs.
+        :param concurrency: The limiter to run under; defaults to `AdaptiveConcurrency()`.
+        :param max_retries: Retries of a throttled call before its user is reported as failed.
+        """
+        concurrency = concurrency or AdaptiveConcurrency()
+        client, executor = self._admin_client(concurrency.maximum)
+        call = getattr(client, operation)
+
+        async def run(username, params):
+            response, error, attempts = await self._paced_call(
+                executor, call, concurrency, max_retries, UserPoolId=self.user_pool_id, Username=username, **params
+            )
+            if error is not None:
+                return {"username": username, "Error": str(error), "attempts": attempts}
+            return {"username": username, "response": response, "attempts": attempts}
+
+        requests = iter(requests)
+        pending = set()
+        try:
+            while True:
+                while len(pending) < concurrency.maximum:
+                    request = next(requests, None)
+                    if request is None:
+                        break
+                    pending.add(asyncio.ensure_future(run(*request)))
+                if not pending:
+                    return
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+            executor.shutdown(wait=False)
+
+    async def list_users(self, filter: str = None, attributes: list = None, segments=None, segment_attribute: str = "username",
+                         concurrency: AdaptiveConcurrency = None, page_size: int = LIST_USERS_PAGE_SIZE, max_retries: int = 8):
+        """
+        Lists the users of the pool lazily, page by page through `ListUsers`.
+
+        Without `segments`, the pool is read as one paginated scan. With `segments`, it is split into one
+        scan per prefix (`<segment_attribute> ^= "<prefix>"`), run in parallel under `concurrency`; the
+        prefixes must together cover every user, e.g. HEX_PREFIXES for UUID usernames. Memory stays
+        constant: each scan holds at most one page ahead of the consumer. Throttled pages are retried as
+        in the bulk operations (see `_bulk`).
+
+        :param filter: A ListUsers filter, e.g. 'status = "Enabled"'; cannot be combined with `segments`,
+            since ListUsers accepts only one filter.
+        :param attributes: The user attributes to return (AttributesToGet); all of them by default.
+        :param segments: Prefixes to scan in parallel.
+        :param segment_attribute: The attribute the prefixes apply to, e.g. "username" or "email".
+        :param concurrency: The limiter the page requests run under; defaults to one page in flight per
+            segment, adapting to throttling.
+        :param page_size: Users per page, at most 60.
+        :param max_retries: Retries of a throttled page before the listing fails.
+        :return: An async iterator of users as returned by ListUsers (Username, Attributes, UserStatus, ...).
+        :raises ClientError: If a page cannot be read.
+        """
+        if filter and segments:
+            raise ValueError("ListUsers accepts a single filter; use either filter or segments.")
+        if segments:
+            escaped = (prefix.replace('"', '\\"') for prefix in segments)
+            filters = [f'{segment_attribute} ^= "{prefix}"' for prefix in escaped]
+        else:
+            filters = [filter]
+        concurrency = concurrency or AdaptiveConcurrency(initial=len(filters), maximum=len(filters))
+        client, executor = self._admin_client(concurrency.maximum)
+        pages = asyncio.Queue(maxsize=len(filters))
+
+        async def scan(scan_filter):
+            params = {'UserPoolId': self.user_pool_id, 'Limit': min(page_size, LIST_USERS_PAGE_SIZE)}
+            if scan_filter:
+                params['Filter'] = scan_filter
+            if attributes is not None:
+                params['AttributesToGet'] = attributes
+            try:
+                while True:
+                    response, error, _ = await self._paced_call(executor, client.list_users, concurrency, max_retries, **params)
+                    if error is not None:
+                        raise error
+                    await pages.put(response.get('Users', []))
+                    if not response.get('PaginationToken'):
+                        break
+                    params['PaginationToken'] = response['PaginationToken']
+            except Exception as e:
+                await pages.put(e)
+            else:
+                # Marks the end of this scan
+                await pages.put(None)
+
+        scans = [asyncio.ensure_future(scan(scan_filter)) for scan_filter in filters]
+        try:
+            remaining = len(scans)
+            while remaining:
+                page = await pages.get()
+                if page is None:
+                    remaining -= 1
+                elif isinstance(page, Exception):
+                    raise page
+                else:
+                    for user in page:
+                        yield user
+        finally:
+            for task in scans:
+                task.cancel()
+            executor.shutdown(wait=False)
+
+    async def export_users(self, path: str, chunk_size: int = 1000, **options) -> int:
+        """
+        Writes the users of the pool to a JSON Lines file, one user per line, in chunks of `chunk_size`.
+
+        At most one chunk is held in memory, so exports of millions of users run in constant memory. The
+        file is written under `<path>.part` and moved into place once complete, so a failed export never
+        leaves a truncated file behind. Paths ending in ".gz" are gzip-compressed.
+
+        :param path: The file to write.
+        :param chunk_size: Users written at once.
+        :param options: Passed to `list_users` (filter, attributes, segments, ...).
+        :return: The number of users exported.
+        """
+        def encode(value):
+            if isinstance(value, datetime.datetime):
+                return value.isoformat()
+            raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+        partial_path = f"{path}.part"
+        opener = gzip.open if path.endswith(".gz") else open
+        count = 0
+        file = opener(partial_path, "wt", encoding="utf-8")
+        try:
+            chunk = []
+            async for user in self.list_users(**options):
+                chunk.append(json.dumps(user, default=encode) + "\n")
+                if len(chunk) >= chunk_size:
+                    await asyncio.to_thread(file.writelines, chunk)
+                    count += len(chunk)
+                    chunk = []
+            await asyncio.to_thread(file.writelines, chunk)
+            count += len(chunk)
+            file.close()
+            os.replace(partial_path, path)
+        except BaseException:
+            file.close()
+            os.remove(partial_path)
+            raise
+        return count
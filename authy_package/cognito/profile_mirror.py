@@ -0,0 +1,243 @@
+import asyncio
+import logging
+import time
+
+import jwt
+from botocore.exceptions import BotoCoreError, ClientError
+
+from authy_package.cognito.cognito_manager import THROTTLING_ERRORS, CognitoManager
+from authy_package.db.abstract_db import AbstractDatabase
+from authy_package.social.http import resilient_http_client
+from authy_package.social.oidc import fetch_document
+from authy_package.utils.resilience import AdaptiveConcurrency, ProviderUnavailableError
+from authy_package.utils.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# The source the profiles are stored under in the database's profile mirror
+SOURCE = "cognito"
+
+
+def _profile(user: dict) -> dict:
+    # GetUser answers with UserAttributes, ListUsers with Attributes
+    return {"Username": user["Username"], "UserAttributes": user.get("UserAttributes", user.get("Attributes", []))}
+
+
+class CognitoProfileMirror:
+    """
+    Serves Cognito user profiles from a local mirror in an AbstractDatabase backend, so most profile
+    reads cost no call against the user pool's request quotas.
+
+    A read verifies the access token locally against the pool's signing keys (cached process-wide), takes
+    the username from it and answers from the mirror while the mirrored profile is younger than `ttl`.
+    Otherwise it calls GetUser, stores the result and returns it; concurrent reads of one user share that
+    call. While Cognito throttles or cannot be reached, an expired profile is served instead of failing.
+
+    Attribute updates made through CognitoAuthManager invalidate the profiles they change; updates made
+    elsewhere must call `invalidate()` with the username (see `canonical_username()` for aliases).
+
+    `sync()` streams the whole pool through ListUsers into the mirror, refreshing every profile and
+    deleting those of removed users; `start()` runs it every `sync_interval` seconds, which is best done
+    on a single worker (or from a scheduled job).
+
+    Profiles are `{"Username", "UserAttributes"}`, the part of the GetUser response ListUsers also
+    returns; MFA settings are not mirrored. `invalidate()` marks a profile as changed, and entries are
+    stamped with the time their read started, so a profile read before an invalidation never replaces
+    it. The stamps are compared across workers, which therefore need synchronized clocks.
+
+    Since tokens are checked locally, a token revoked by a global sign-out keeps reading its profile
+    until it expires.
+    """
+
+    def __init__(self, db: AbstractDatabase, cognito_manager: CognitoManager, ttl: float = 3600, sync_interval: float = 900,
+                 batch_size: int = 250, segments=None, issuer: str = None, http_client=None, jwks_ttl: float = 3600,
+                 jwks_refresh_interval: float = 60, leeway: float = 60):
+        """
+        :param db: The database holding the mirror; it must implement the mirrored profile methods.
+        :param cognito_manager: The CognitoManager of the user pool.
+        :param ttl: Seconds a mirrored profile is served before a read refreshes it from Cognito.
+        :param sync_interval: Seconds between two syncs of the background job started by `start()`.
+        :param batch_size: Profiles written to the database at once during a sync.
+        :param segments: Prefixes the syncs scan in parallel, see `CognitoManager.list_users`.
+        :param issuer: The token issuer; defaults to the user pool's. Its JWKS is read from
+            `<issuer>/.well-known/jwks.json`.
+        :param http_client: An httpx.AsyncClient or ResilientHTTPClient to fetch the JWKS with.
+        :param jwks_ttl: Seconds a JWKS without caching headers is kept.
+        :param jwks_refresh_interval: Minimum seconds between two refetches of the JWKS caused by an unknown key.
+        :param leeway: Seconds of clock skew tolerated when checking token timestamps.
+        """
+        self.db = db
+        self.cognito_manager = cognito_manager
+        self.ttl = ttl
+        self.sync_interval = sync_interval
+        self.batch_size = batch_size
+        self.segments = segments
+        region = cognito_manager.cognito_client.meta.region_name
+        self.issuer = issuer or f"https://cognito-idp.{region}.amazonaws.com/{cognito_manager.user_pool_id}"
+        self.jwks_url = f"{self.issuer}/.well-known/jwks.json"
+        self._http = resilient_http_client(http_client)
+        self.jwks_ttl = jwks_ttl
+        self.jwks_refresh_interval = jwks_refresh_interval
+        self.leeway = leeway
+        self._jwks_refetched_at = float("-inf")
+        self._reads = SingleFlight()
+        self._task = None
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    async def _signing_key(self, kid: str):
+        keys = (await fetch_document(self._http, self.jwks_url, self.jwks_ttl)).get("keys", [])
+        key = next((key for key in keys if key.get("kid") == kid), None)
+        if key is None and time.monotonic() - self._jwks_refetched_at >= self.jwks_refresh_interval:
+            # Cognito may have rotated the pool's keys since the JWKS was cached
+            self._jwks_refetched_at = time.monotonic()
+            keys = (await fetch_document(self._http, self.jwks_url, self.jwks_ttl, force=True)).get("keys", [])
+            key = next((key for key in keys if key.get("kid") == kid), None)
+        return key
+
+    async def verify_access_token(self, access_token: str) -> dict:
+        """
+        Verifies an access token of the user pool locally: its signature, issuer, expiry, token use and app client.
+
+        :param access_token: The access token.
+        :return: The verified claims, including the "username".
+        :raises ValueError: If the token is invalid.
+        """
+        try:
+            header = jwt.get_unverified_header(access_token)
+        except jwt.PyJWTError as e:
+            raise ValueError(f"Invalid access token: {e}") from e
+        if header.get("alg") != "RS256":
+            raise ValueError(f"Invalid access token: unsupported algorithm {header.get('alg')}.")
+
+        key = await self._signing_key(header.get("kid"))
+        if key is None:
+            raise ValueError("Invalid access token: unknown signing key.")
+        try:
+            claims = jwt.decode(
+                access_token, jwt.PyJWK(key, algorithm="RS256").key, algorithms=["RS256"], issuer=self.issuer,
+                leeway=self.leeway, options={"require": ["exp", "iat", "username"]}
+            )
+        except jwt.PyJWTError as e:
+            raise ValueError(f"Invalid access token: {e}") from e
+        if claims.get("token_use") != "access" or claims.get("client_id") != self.cognito_manager.app_client_id:
+            raise ValueError("Invalid access token: not an access token of this app client.")
+        return claims
+
+    async def get_user_info(self, access_token: str) -> dict:
+        """
+        Retrieves the profile of the user an access token belongs to, from the mirror when it is fresh.
+
+        :param access_token: The access token of the user.
+        :return: The profile ({"Username", "UserAttributes"}), or {"Error": ...} like CognitoManager.get_user_info.
+        """
+        try:
+            username = (await self.verify_access_token(access_token))["username"]
+        except ValueError as e:
+            return {"Error": str(e)}
+
+        entry = await self.db.get_mirrored_profile(SOURCE, username)
+        if entry and entry["profile"] is not None and time.time() - entry["synced_at"] < self.ttl:
+            self.hits += 1
+            return entry["profile"]
+        return await self._reads.do(username, lambda: self._read_through(access_token, username, entry))
+
+    async def _read_through(self, access_token: str, username: str, entry) -> dict:
+        synced_at = time.time()
+        try:
+            user = await asyncio.to_thread(self.cognito_manager.cognito_client.get_user, AccessToken=access_token)
+        except (ClientError, BotoCoreError, ProviderUnavailableError) as e:
+            throttled = isinstance(e, ClientError) and e.response.get("Error", {}).get("Code") in THROTTLING_ERRORS
+            if entry and entry["profile"] is not None and (throttled or not isinstance(e, ClientError)):
+                self.stale_hits += 1
+                return entry["profile"]
+            if isinstance(e, ClientError):
+                return {"Error": str(e)}
+            raise
+
+        self.misses += 1
+        profile = _profile(user)
+        await self.db.store_mirrored_profiles(SOURCE, [{"key": username, "profile": profile, "synced_at": synced_at}])
+        return profile
+
+    async def invalidate(self, username: str):
+        """
+        Marks the mirrored profile of a user as changed, so the next read fetches it from Cognito. Call it
+        after every change made to the user's attributes.
+
+        :param username: The username of the user.
+        """
+        await self.db.store_mirrored_profiles(SOURCE, [{"key": username, "profile": None, "synced_at": time.time()}])
+
+    async def canonical_username(self, username: str) -> str:
+        """
+        Returns the username a profile is mirrored under, for a username or an alias the pool accepts
+        (e.g. an email), as the admin calls do. Falls back to `username` when Cognito cannot be asked.
+
+        :param username: A username or alias.
+        """
+        try:
+            user = await asyncio.to_thread(
+                self.cognito_manager.cognito_client.admin_get_user, UserPoolId=self.cognito_manager.user_pool_id, Username=username
+            )
+        except (ClientError, BotoCoreError, ProviderUnavailableError) as e:
+            logger.warning("Could not resolve the Cognito username of %r: %s", username, e)
+            return username
+        return user["Username"]
+
+    async def sync(self, concurrency: AdaptiveConcurrency = None) -> int:
+        """
+        Copies every user of the pool into the mirror and deletes the profiles of users no longer in it.
+
+        Users are streamed from ListUsers and written in batches of `batch_size`, so a sync runs in constant
+        memory. All entries are stamped with the start of the sync: a profile invalidated while the sync
+        runs keeps its invalidation, and what the sync did not rewrite is pruned.
+
+        :param concurrency: The limiter the ListUsers pages run under, see `CognitoManager.list_users`.
+        :return: The number of users synced.
+        """
+        started = time.time()
+        synced = 0
+        batch = []
+        async for user in self.cognito_manager.list_users(segments=self.segments, concurrency=concurrency):
+            batch.append({"key": user["Username"], "profile": _profile(user), "synced_at": started})
+            if len(batch) >= self.batch_size:
+                await self.db.store_mirrored_profiles(SOURCE, batch)
+                synced += len(batch)
+                batch = []
+        if batch:
+            await self.db.store_mirrored_profiles(SOURCE, batch)
+            synced += len(batch)
+        # Only reached after a complete listing; a failed sync prunes nothing
+        await self.db.prune_mirrored_profiles(SOURCE, started)
+        return synced
+
+    async def _sync_forever(self):
+        while True:
+            try:
+                await self.sync()
+            except Exception:
+                # A failed sync only delays refreshes; reads still refresh expired profiles from Cognito
+                logger.exception("Syncing the Cognito profile mirror failed")
+            await asyncio.sleep(self.sync_interval)
+
+    def start(self):
+        """Starts syncing the mirror every `sync_interval` seconds on the running event loop."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._sync_forever())
+
+    async def close(self):
+        """Stops the background sync."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def hit_ratio(self) -> float:
+        """Share of profile reads answered from the mirror, including expired profiles served during outages."""
+        reads = self.hits + self.stale_hits + self.misses
+        return (self.hits + self.stale_hits) / reads if reads else 0.0
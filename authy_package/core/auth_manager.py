@@ -1,18 +1,44 @@
-from authy_package.utils.security import hash_password, verify_password
+import asyncio
+import datetime
+import logging
+
+from authy_package.utils.security import hash_password, password_needs_update, verify_password
 from authy_package.db.abstract_db import AbstractDatabase
-from authy_package.db.sql import SQLDatabase 
 from authy_package.cache.abstract_cache import AbstractCache
 from authy_package.cognito.cognito_manager import CognitoManager
+from authy_package.cognito.profile_mirror import CognitoProfileMirror
 from authy_package.social.apple import AppleManager
 from authy_package.social.github import GitHubManager
 from authy_package.social.facebook import FacebookManager
 from authy_package.social.google import GoogleManager
+from authy_package.social.oauth_state import OAuthStateManager
+from authy_package.social.oidc import OIDCProvider
+from authy_package.social.refresh_scheduler import RefreshScheduler
 from authy_package.mfa.mfa_setup import MFAAuthManager
 from authy_package.utils.security import SecurityManager
+from authy_package.utils.resilience import AdaptiveConcurrency
+from authy_package.utils.single_flight import SingleFlight
+from authy_package.telemetry.instrumentation import Instrumentation, instrument, instrument_flows, instrument_function
+
+logger = logging.getLogger(__name__)
+
+
+def _user_field(user, name: str):
+    """Reads a field of a user as returned by the database: a document (dict) or an ORM object."""
+    return user.get(name) if isinstance(user, dict) else getattr(user, name, None)
+
+
+def _email_verified(user_info: dict) -> bool:
+    """Whether the provider vouches for the profile's email ("email_verified" may be the string "true", e.g. at Apple)."""
+    verified = user_info.get("email_verified", user_info.get("verified_email"))
+    return verified is True or verified == "true"
 
 ## for Traditional Auth Flow
 class TraditionalAuthManager:
-    def __init__(self, db: AbstractDatabase, cache: AbstractCache = None, mfa_manager: MFAAuthManager = None, security_manager: SecurityManager = None):
+    FLOWS = ("register_user", "login_user", "logout_user", "refresh_token", "enable_mfa", "reconfigure_mfa", "request_password_reset", "reset_password")
+
+    def __init__(self, db: AbstractDatabase, cache: AbstractCache = None, mfa_manager: MFAAuthManager = None, security_manager: SecurityManager = None,
+                 instrumentation: Instrumentation = None, debug_timings: bool = False):
         """
         Initializes the TraditionalAuthManager with database, cache, MFA manager, and Security manager.
 
@@ -20,11 +46,22 @@ class TraditionalAuthManager:
         :param cache: The cache instance for storing temporary data.
         :param mfa_manager: An instance of MFAAuthManager for managing multi-factor authentication.
         :param security_manager: An instance of SecurityManager for managing password resets.
+        :param instrumentation: Receives a span and duration for every flow and every call to the components above,
+            including password hashing. Nothing is wrapped when omitted.
+        :param debug_timings: Attach a per-phase timing breakdown ("timings") to each flow result. Requires instrumentation.
         """
-        self.db = db
-        self.cache = cache
-        self.mfa_manager = mfa_manager 
-        self.security_manager = security_manager
+        self.db = instrument(db, instrumentation, "db")
+        self.cache = instrument(cache, instrumentation, "cache")
+        self.mfa_manager = instrument(mfa_manager, instrumentation, "mfa")
+        self.security_manager = instrument(security_manager, instrumentation, "security")
+        self.hash_password = hash_password
+        self.verify_password = verify_password
+        if instrumentation:
+            self.hash_password = instrument_function(hash_password, "password.hash", instrumentation)
+            self.verify_password = instrument_function(verify_password, "password.verify", instrumentation)
+        # Rehashes scheduled by login_user; kept referenced so they are not garbage collected mid-flight
+        self._rehash_tasks = set()
+        instrument_flows(self, instrumentation, "traditional", self.FLOWS, debug_timings)
 
     async def register_user(self, username=None, email=None, phone=None, password=None):
         """
@@ -40,7 +77,7 @@ class TraditionalAuthManager:
         if existing_user:
             raise ValueError("User already exists.")
         
-        hashed_password = hash_password(password)
+        hashed_password = self.hash_password(password)
         user_data = {
             "username": username,
             "email": email,
@@ -68,19 +105,44 @@ class TraditionalAuthManager:
         :return: A message indicating the result of the login operation, along with tokens if successful.
         """
         user = await self.db.get_user_by_identifier(username=username, email=email, phone=phone)
-        if not user or not verify_password(password, user['hashed_password']):
+        if not user or not self.verify_password(password, user['hashed_password']):
             raise ValueError("Invalid credentials.")
         
         if user.get('mfa_enabled'):
             if not mfa_code or not await self.mfa_manager.verify_mfa_code(mfa_code, username, email, phone):
                 raise ValueError("Invalid MFA code.")
+
+        if password_needs_update(user['hashed_password']):
+            self._schedule_rehash(user['username'] or user['email'] or user['phone'], password, user['hashed_password'])
         
         if self.cache:
-            access_token, refresh_token = self.cache.create_token_pair(user['username'] or user['email'] or user['phone'])
+            access_token, refresh_token = await self.cache.create_token_pair(user['username'] or user['email'] or user['phone'])
             return {"access_token": access_token, "refresh_token": refresh_token}
         
         return {"message": "Login successful.", "user": user}
 
+    def _schedule_rehash(self, identifier: str, password: str, verified_hash: str):
+        """Rehashes a password with the current scheme and cost in the background, without delaying the login."""
+        task = asyncio.create_task(self._rehash_password(identifier, password, verified_hash))
+        self._rehash_tasks.add(task)
+        task.add_done_callback(self._rehash_tasks.discard)
+
+    async def _rehash_password(self, identifier: str, password: str, verified_hash: str):
+        try:
+            # Hashing is CPU-bound; keep it off the event loop
+            hashed_password = await asyncio.to_thread(self.hash_password, password)
+            # Only replace the hash that was verified; a password reset in the meantime must not be undone
+            if not await self.db.update_user_password_if_unchanged(identifier, verified_hash, hashed_password):
+                logger.info("Skipped rehashing the password of %s: it changed during the rehash", identifier)
+        except Exception:
+            # The old hash still verifies, so the next login simply retries
+            logger.exception("Rehashing the password of %s failed", identifier)
+
+    async def wait_for_rehashes(self):
+        """Waits for the background rehashes scheduled by login_user (e.g. before shutdown)."""
+        if self._rehash_tasks:
+            await asyncio.gather(*self._rehash_tasks, return_exceptions=True)
+
     async def logout_user(self, access_token, username=None, pk=None):
         """
         Logs a user out of the application.
@@ -91,9 +153,9 @@ class TraditionalAuthManager:
         :return: A message indicating the result of the logout operation.
         """
         if self.cache:
-            self.cache.delete_access_token(access_token)
+            await self.cache.delete_access_token(access_token)
             if username or pk:
-                self.cache.delete_refresh_token(username or pk)
+                await self.cache.delete_refresh_token(username or pk)
 
         return {"message": "User logged out successfully."}
 
@@ -105,11 +167,11 @@ class TraditionalAuthManager:
         :return: A new access token and refresh token.
         """
         if self.cache:
-            user_identifier = self.cache.validate_refresh_token(refresh_token)
+            user_identifier = await self.cache.validate_refresh_token(refresh_token)
             if not user_identifier:
                 raise ValueError("Invalid refresh token.")
 
-            new_access_token, new_refresh_token = self.cache.create_token_pair(refresh_token)
+            new_access_token, new_refresh_token = await self.cache.create_token_pair(user_identifier)
             return {"access_token": new_access_token, "refresh_token": new_refresh_token}
         
         raise ValueError("Caching not enabled.")
@@ -191,13 +253,24 @@ class TraditionalAuthManager:
 
 ## For Cognito Related Auth Flow
 class CognitoAuthManager:
-    def __init__(self, cognito_manager: CognitoManager):
+    FLOWS = ("register_user", "login_user", "logout_user", "refresh_token", "exchange_code_for_tokens", "reset_password", "confirm_password",
+             "confirm_user_account", "update_user_attributes", "update_user_phone_number", "update_user_email", "get_user_info",
+             "enable_TOTP_mfa", "enable_sms_mfa", "disable_mfa", "verify_mfa", "associate_software_token")
+
+    def __init__(self, cognito_manager: CognitoManager, instrumentation: Instrumentation = None, debug_timings: bool = False,
+                 profile_mirror: CognitoProfileMirror = None):
         """
         Initializes the CognitoAuthManager with a CognitoManager instance.
 
         :param cognito_manager: An instance of the CognitoManager for interacting with AWS Cognito.
+        :param instrumentation: Receives a span and duration for every flow and every Cognito call. Nothing is wrapped when omitted.
+        :param debug_timings: Attach a per-phase timing breakdown ("timings") to each dict result. Requires instrumentation.
+        :param profile_mirror: Serves get_user_info from a local mirror of the user profiles; the attribute
+            updates below invalidate it. Every read goes to Cognito when omitted.
         """
-        self.cognito_manager = cognito_manager
+        self.cognito_manager = instrument(cognito_manager, instrumentation, "cognito")
+        self.profile_mirror = profile_mirror
+        instrument_flows(self, instrumentation, "cognito_auth", self.FLOWS, debug_timings)
 
     async def register_user(self, username:str, password:str, email:str, phone_number=None):
         """Registers a new user asynchronously.
@@ -282,18 +355,18 @@ class CognitoAuthManager:
         """
         return await self.cognito_manager.confirm_user_account(username, confirmation_code)
 
-    async def update_user_attributes(self, access_token: str, attributes: list):
+    async def update_user_attributes(self, username: str, attributes: list):
         """Updates user attributes asynchronously.
 
-        :param access_token: The access token of the user whose attributes are to be updated.
+        :param username: The username of the user whose attributes are to be updated, or an alias the pool accepts (e.g. the email).
         :param attributes: A list of attributes to update.
         :return: The response from the Cognito update attributes process.
         """
-        return await self.cognito_manager.update_user_attributes(access_token, attributes)
+        return await self._update_profile(self.cognito_manager.update_user_attributes, username, attributes)
 
-    async def update_user_phone_number(self, access_token: str, phone_number: str):
+    async def update_user_phone_number(self, username: str, phone_number: str):
         """
-        Updates the phone number of the user associated with the provided access token.
+        Updates the phone number of a user.
 
         This method allows the user to change their phone number. The new phone number
         must be in a valid format as per the user pool settings. After successfully
@@ -301,20 +374,20 @@ class CognitoAuthManager:
         user pool configuration.
 
         Args:
-            access_token (str): The access token of the authenticated user.
+            username (str): The username of the user, or an alias the pool accepts (e.g. the email).
             phone_number (str): The new phone number to be associated with the user's account.
 
         Returns:
             dict: The response from AWS Cognito after attempting to update the phone number.
 
         Raises:
-            ClientError: If there is an issue communicating with AWS Cognito or if the access token is invalid.
+            ClientError: If there is an issue communicating with AWS Cognito.
         """
-        return await self.cognito_manager.update_user_phone_number(access_token, phone_number)
+        return await self._update_profile(self.cognito_manager.update_user_phone_number, username, phone_number)
 
-    async def update_user_email(self, access_token: str, email: str):
+    async def update_user_email(self, username: str, email: str):
         """
-        Updates the email address of the user associated with the provided access token.
+        Updates the email address of a user.
 
         This method allows the user to change their email address. The new email must
         be unique within the user pool and follow standard email format. After successfully
@@ -322,24 +395,52 @@ class CognitoAuthManager:
         pool configuration.
 
         Args:
-            access_token (str): The access token of the authenticated user.
+            username (str): The username of the user, or an alias the pool accepts (e.g. the email).
             email (str): The new email address to be associated with the user's account.
 
         Returns:
             dict: The response from AWS Cognito after attempting to update the email address.
 
         Raises:
-            ClientError: If there is an issue communicating with AWS Cognito or if the access token is invalid.
+            ClientError: If there is an issue communicating with AWS Cognito.
+        """
+        return await self._update_profile(self.cognito_manager.update_user_email, username, email)
+
+    async def _update_profile(self, update, username: str, *args) -> dict:
+        # Profiles are mirrored under the username; resolve an alias before the update can change it
+        key = await self.profile_mirror.canonical_username(username) if self.profile_mirror is not None else None
+        response = await asyncio.to_thread(update, username, *args)
+        if key is not None and "Error" not in response:
+            await self.profile_mirror.invalidate(key)
+        return response
+
+    async def bulk_update_user_attributes(self, updates, concurrency: AdaptiveConcurrency = None, max_retries: int = 8):
+        """
+        Updates the attributes of many users, see `CognitoManager.bulk_update_user_attributes`, and
+        invalidates the mirrored profile of every user updated before yielding its result.
+
+        Profiles are invalidated under the usernames given, so pass usernames as ListUsers returns
+        them rather than aliases; resolving each alias would cost a Cognito call per user.
+
+        :param updates: An iterable of `(username, attributes)` pairs.
+        :param concurrency: The limiter the calls run under.
+        :param max_retries: Retries of a throttled call before its user is reported as failed.
+        :return: An async iterator of per-user results.
         """
-        return await self.cognito_manager.update_user_email(access_token, email)
+        async for result in self.cognito_manager.bulk_update_user_attributes(updates, concurrency, max_retries):
+            if self.profile_mirror is not None and "Error" not in result:
+                await self.profile_mirror.invalidate(result["username"])
+            yield result
 
     async def get_user_info(self, access_token: str):
         """Retrieves the information of a user using their access token asynchronously.
 
         :param access_token: The access token of the user.
-        :return: The user's information from Cognito.
+        :return: The user's information from Cognito, or from the profile mirror when one is configured.
         """
-        return await self.cognito_manager.get_user_info(access_token)
+        if self.profile_mirror is not None:
+            return await self.profile_mirror.get_user_info(access_token)
+        return await asyncio.to_thread(self.cognito_manager.get_user_info, access_token)
 
     async def enable_TOTP_mfa(self, username: str):
         """Enables TOTP MFA for a user.
@@ -396,6 +497,10 @@ class CognitoAuthManager:
 
 ## for manual Social Auth Flow
 class SocialAuthManager:
+    FLOWS = ("start_social_login", "complete_social_login", "facebook_social_login", "github_social_login", "apple_social_login",
+             "google_social_login", "oidc_authorization_url", "oidc_social_login", "refresh_access_token", "logout", "enable_mfa",
+             "reconfigure_mfa")
+
     def __init__(self, 
     db: AbstractDatabase, 
     cache: AbstractCache = None, 
@@ -403,7 +508,13 @@ class SocialAuthManager:
     apple_manager: AppleManager = None, 
     facebook_manager: FacebookManager = None, 
     google_manager: GoogleManager = None,
-    mfa_manager: MFAAuthManager = None
+    mfa_manager: MFAAuthManager = None,
+    instrumentation: Instrumentation = None,
+    debug_timings: bool = False,
+    refresh_coalescer: SingleFlight = None,
+    refresh_scheduler: RefreshScheduler = None,
+    oidc_providers: list = None,
+    state_manager: OAuthStateManager = None
     ):
         
         """
@@ -417,6 +528,18 @@ class SocialAuthManager:
             facebook_manager (FacebookManager, optional): Manager for Facebook authentication and API interactions.
             google_manager (GoogleManager, optional): Manager for Google authentication and API interactions.
             mfa_manager (MFAAuthManager, optional): Manager for multi-factor authentication processes.
+            instrumentation (Instrumentation, optional): Receives a span and duration for every flow and every call
+                to the components above. Nothing is wrapped when omitted.
+            debug_timings (bool, optional): Attach a per-phase timing breakdown ("timings") to each flow result.
+                Requires instrumentation.
+            refresh_coalescer (SingleFlight, optional): Coalesces concurrent token refreshes per provider and user.
+                Defaults to in-process coalescing; pass `SingleFlight(redis=...)` to coalesce across workers.
+            refresh_scheduler (RefreshScheduler, optional): Refreshes stored Google, Apple and OIDC provider tokens
+                in the background before they expire. Requires a RedisCaching cache.
+            oidc_providers (list, optional): Further OpenID Connect providers (OIDCProvider instances), signed in
+                with `oidc_social_login` under their `name`.
+            state_manager (OAuthStateManager, optional): Issues and validates the signed `state` (and PKCE
+                verifier) of `start_social_login` and `complete_social_login`.
 
         Attributes:
             db: The database interface for user operations.
@@ -426,73 +549,164 @@ class SocialAuthManager:
             facebook_manager: The manager for Facebook-related operations.
             google_manager: The manager for Google-related operations.
             mfa_manager: The manager for handling multi-factor authentication.
+            refresh_coalescer: Coalesces concurrent token refreshes.
+            refresh_scheduler: Refreshes stored social tokens ahead of expiry, if configured.
+            oidc_providers: The OIDC providers by name.
+            state_manager: Issues and validates OAuth states, if configured.
         """
         
-        self.db = db
-        self.cache = cache
-        self.github_manager = github_manager
-        self.apple_manager = apple_manager
-        self.facebook_manager = facebook_manager
-        self.google_manager = google_manager
-        self.mfa_manager = mfa_manager
+        self.db = instrument(db, instrumentation, "db")
+        self.cache = instrument(cache, instrumentation, "cache")
+        self.github_manager = instrument(github_manager, instrumentation, "social.github")
+        self.apple_manager = instrument(apple_manager, instrumentation, "social.apple")
+        self.facebook_manager = instrument(facebook_manager, instrumentation, "social.facebook")
+        self.google_manager = instrument(google_manager, instrumentation, "social.google")
+        self.mfa_manager = instrument(mfa_manager, instrumentation, "mfa")
+        self.oidc_providers = {
+            provider.name: instrument(provider, instrumentation, f"social.{provider.name}") for provider in oidc_providers or []
+        }
+        self.state_manager = state_manager
+        self.refresh_coalescer = refresh_coalescer or SingleFlight()
+        self.refresh_scheduler = refresh_scheduler
+        if refresh_scheduler:
+            refresh_scheduler.social_manager = self
+        instrument_flows(self, instrumentation, "social", self.FLOWS, debug_timings)
+
+    async def start_social_login(self, provider: str, redirect_to: str = None, binding: str = None, redirect_uri: str = None):
+        """
+        Starts a social login: issues a signed state for the provider and builds its authorization URL.
 
-    async def facebook_social_login(self, code: str):
+        The state carries the flow's PKCE code challenge (all providers but Apple) and OIDC nonce, so
+        `complete_social_login` can check them without anything being stored in between.
+
+        Args:
+            provider (str): "github", "facebook", "google", "apple" or the name of an OIDC provider.
+            redirect_to (str, optional): Where to send the user after the login; returned by `complete_social_login`.
+            binding (str, optional): A value the callback must present again, e.g. the session ID.
+            redirect_uri (str, optional): The redirect URI, for Apple and OIDC providers.
+
+        Returns:
+            dict: The "authorization_url" to send the user to and its "state".
+        """
+        if self.state_manager is None:
+            raise ValueError("A state manager is required to start social logins.")
+        grant = self.state_manager.issue(provider, redirect_to=redirect_to, binding=binding, pkce=provider != "apple")
+        state, nonce = grant["state"], grant["nonce"]
+        pkce = {key: grant[key] for key in ("code_challenge", "code_challenge_method") if key in grant}
+
+        if provider == "github" and self.github_manager:
+            authorization_url = self.github_manager.get_authorization_url(state=state, **pkce)
+        elif provider == "facebook" and self.facebook_manager:
+            authorization_url = self.facebook_manager.get_authorization_url(state=state, **pkce)
+        elif provider == "google" and self.google_manager:
+            authorization_url = await self.google_manager.get_authorization_url(state=state, nonce=nonce, **pkce)
+        elif provider == "apple" and self.apple_manager:
+            authorization_url = await self.apple_manager.get_authorization_url(redirect_uri, state=state, nonce=nonce)
+        elif provider in self.oidc_providers:
+            authorization_url = await self.oidc_providers[provider].get_authorization_url(state=state, nonce=nonce, redirect_uri=redirect_uri, **pkce)
+        else:
+            raise ValueError(f"Social login is not configured for provider: {provider}")
+        return {"authorization_url": authorization_url, "state": state}
+
+    async def complete_social_login(self, provider: str, code: str, state: str, binding: str = None, redirect_uri: str = None):
+        """
+        Completes a social login started with `start_social_login`: validates the state and signs the
+        user in with the code, the PKCE verifier and the nonce derived from it.
+
+        Args:
+            provider (str): The provider the callback is for.
+            code (str): The authorization code of the callback.
+            state (str): The state of the callback.
+            binding (str, optional): The value passed to `start_social_login`, if any.
+            redirect_uri (str, optional): The redirect URI, for Apple and OIDC providers.
+
+        Returns:
+            dict: The login response, with the "redirect_to" target of the flow.
+
+        Raises:
+            ValueError: If the state is invalid, expired, meant for another provider or already used.
+        """
+        if self.state_manager is None:
+            raise ValueError("A state manager is required to complete social logins.")
+        flow = await self.state_manager.validate(state, provider=provider, binding=binding)
+        code_verifier, nonce = flow["code_verifier"], flow["nonce"]
+
+        if provider == "github":
+            response = await self.github_social_login(code, code_verifier=code_verifier)
+        elif provider == "facebook":
+            response = await self.facebook_social_login(code, code_verifier=code_verifier)
+        elif provider == "google":
+            response = await self.google_social_login(code, code_verifier=code_verifier, nonce=nonce)
+        elif provider == "apple":
+            response = await self.apple_social_login(redirect_uri, code, nonce=nonce)
+        else:
+            response = await self.oidc_social_login(provider, code, redirect_uri=redirect_uri, nonce=nonce, code_verifier=code_verifier)
+        return {**response, "redirect_to": flow["redirect_to"]}
+
+    async def facebook_social_login(self, code: str, code_verifier: str = None):
         """
         Handles Facebook social login by exchanging the code for a short-lived access token, then exchanges
         it for a long-lived token, retrieves user info, and stores tokens in the cache.
+
+        The long-lived exchange and the user info request both only need the short-lived token, so they
+        run concurrently.
         
         Args:
             code (str): The authorization code obtained from Facebook's login redirect.
+            code_verifier (str, optional): The PKCE code verifier, if the authorization request sent a code challenge.
         
         Returns:
             dict: User information and token details.
         """
         
-        short_lived_token_info = self.facebook_manager.get_access_token(code)
+        short_lived_token_info = await self.facebook_manager.get_access_token(code, code_verifier=code_verifier)
         short_lived_token = short_lived_token_info['access_token']
 
-        long_lived_token_info = self.facebook_manager.get_long_lived_access_token(short_lived_token)
+        long_lived_token_info, user_info = await asyncio.gather(
+            self.facebook_manager.get_long_lived_access_token(short_lived_token),
+            self.facebook_manager.get_user_info(short_lived_token)
+        )
         access_token = long_lived_token_info['access_token']
         
         expires_at = long_lived_token_info.get('expires_at', None)
-
-        user_info = self.facebook_manager.get_user_info(access_token)
             
+        # Facebook does not issue refresh tokens; long-lived tokens are exchanged again instead
         token_info = {
             'access_token': access_token,
-            'refresh_token': self.cache.generate_refresh_token_for_access_token(access_token),
             'expires_at': expires_at
         }
         
-        return await self._handle_social_login(self, "facebook", user_info, token_info)
+        return await self._handle_social_login("facebook", user_info, token_info)
 
-    async def github_social_login(self, code: str):
+    async def github_social_login(self, code: str, code_verifier: str = None):
         
         """
         Handles GitHub social login by exchanging the authorization code for an access token 
         and retrieving user information.
 
         :param code: The authorization code received from the GitHub OAuth 2.0 flow.
+        :param code_verifier: The PKCE code verifier, if the authorization request sent a code challenge.
         
         :return: A dictionary containing a message about the login status, 
                 user information, and access token information.
         """
         
-        access_token_info = self.github_manager.get_access_token(code)
+        access_token_info = await self.github_manager.get_access_token(code, code_verifier=code_verifier)
         token_info = {
             'access_token': access_token_info['access_token'],
-            'refresh_token': self.cache.generate_refresh_token_for_access_token(access_token_info['access_token']),
+            'refresh_token': access_token_info.get('refresh_token'),
         }
-        user_info = self.github_manager.get_user_info(access_token_info['access_token'])
-        return await self._handle_social_login(self, "github", user_info, token_info)
+        user_info = await self.github_manager.get_user_info(access_token_info['access_token'])
+        return await self._handle_social_login("github", user_info, token_info)
 
-    async def apple_social_login(self, redirect_uri: str, code: str = None):
+    async def apple_social_login(self, redirect_uri: str, code: str = None, nonce: str = None):
         """
         Handles Apple social login.
 
         Args:
             redirect_uri (str): The redirect URI for the application.
             code (str, optional): The authorization code from Apple.
+            nonce (str, optional): The nonce sent with the authorization request, checked against the ID token.
 
         Returns:
             dict: A dictionary containing the authorization URL if no code is provided, or the login response.
@@ -504,54 +718,140 @@ class SocialAuthManager:
             return {"authorization_url": authorization_url}
 
         # Exchange code for access token and user information
-        access_token_info = await self.apple_manager.get_access_token(code)
-        user_info = await self.apple_manager.get_user_info(access_token_info['id_token'])
+        access_token_info = await self.apple_manager.get_access_token(code, redirect_uri)
+        user_info = await self.apple_manager.get_user_info(access_token_info['id_token'], nonce=nonce)
 
         # Handle user login or registration
         return await self._handle_social_login("apple", user_info, access_token_info)
 
-    async def google_social_login(self, code: str):
+    async def google_social_login(self, code: str, code_verifier: str = None, nonce: str = None):
         """
         Handles Google social login by exchanging the authorization code for access tokens 
         and retrieving user information.
 
         :param code: The authorization code received from the Google OAuth 2.0 flow.
+        :param code_verifier: The PKCE code verifier, if the authorization request sent a code challenge.
+        :param nonce: The nonce sent with the authorization request; the ID token is then verified and must carry it.
         
         :return: A dictionary containing a message about the login status, 
                 user information, and access token information.
         """
         
-        credentials = self.google_manager.exchange_code_for_tokens(code)
+        credentials = await self.google_manager.exchange_code_for_tokens(code, code_verifier=code_verifier)
+        if nonce is not None:
+            if not credentials.id_token:
+                raise ValueError("Google returned no ID token to check the nonce against.")
+            await self.google_manager.verify_id_token(credentials.id_token, nonce=nonce)
         
-        user_info = self.google_manager.get_user_info(credentials)
+        user_info = await self.google_manager.get_user_info(credentials)
         
         access_token_info = {
             'access_token': credentials.token,
-            'refresh_token': credentials.refresh_token
+            'refresh_token': credentials.refresh_token,
+            'id_token': credentials.id_token,
+            'expires_at': credentials.expiry.replace(tzinfo=datetime.timezone.utc).timestamp() if credentials.expiry else None
         }
 
-        return await self._handle_social_login(self, "google", user_info, access_token_info)
+        return await self._handle_social_login("google", user_info, access_token_info)
+
+    def _oidc_provider(self, provider: str) -> OIDCProvider:
+        oidc_provider = self.oidc_providers.get(provider)
+        if oidc_provider is None:
+            raise ValueError(f"Unknown OIDC provider: {provider}")
+        return oidc_provider
+
+    async def oidc_authorization_url(self, provider: str, state: str = None, nonce: str = None, redirect_uri: str = None, **params):
+        """
+        Builds the authorization URL of a configured OIDC provider.
+
+        Args:
+            provider (str): The provider name, e.g. "okta".
+            state (str, optional): An opaque value echoed back to the redirect URI (CSRF protection).
+            nonce (str, optional): A value the provider embeds in the ID token; pass it to `oidc_social_login`.
+            redirect_uri (str, optional): The redirect URI; defaults to the provider's.
+            **params: Further query parameters, e.g. `prompt`.
+
+        Returns:
+            dict: A dictionary containing the authorization URL.
+        """
+        oidc_provider = self._oidc_provider(provider)
+        return {"authorization_url": await oidc_provider.get_authorization_url(state=state, nonce=nonce, redirect_uri=redirect_uri, **params)}
+
+    async def oidc_social_login(self, provider: str, code: str, redirect_uri: str = None, nonce: str = None, code_verifier: str = None):
+        """
+        Handles social login with a configured OIDC provider: exchanges the authorization code for
+        tokens, verifies the ID token and reads the user's claims.
+
+        The claims come from the verified ID token, completed by the userinfo endpoint when the
+        provider has one.
+
+        Args:
+            provider (str): The provider name, e.g. "okta".
+            code (str): The authorization code received at the redirect URI.
+            redirect_uri (str, optional): The redirect URI of the authorization request.
+            nonce (str, optional): The nonce sent with the authorization request.
+            code_verifier (str, optional): The PKCE code verifier, if a code challenge was sent.
+
+        Returns:
+            dict: User information and token details.
+        """
+        oidc_provider = self._oidc_provider(provider)
+        token_info = await oidc_provider.exchange_code(code, redirect_uri=redirect_uri, code_verifier=code_verifier)
+
+        claims = {}
+        if token_info.get('id_token'):
+            claims = await oidc_provider.verify_id_token(token_info['id_token'], nonce=nonce)
+        elif nonce is not None:
+            raise ValueError("The provider returned no ID token to check the nonce against.")
+        if 'userinfo_endpoint' in await oidc_provider.metadata():
+            user_info = await oidc_provider.get_user_info(token_info['access_token'])
+            if claims and user_info.get('sub') != claims['sub']:
+                raise ValueError("The userinfo subject does not match the ID token.")
+            claims = {**claims, **user_info}
+        if not claims:
+            raise ValueError(f"The {provider} provider returned neither an ID token nor a userinfo endpoint.")
+
+        return await self._handle_social_login(provider, claims, token_info)
 
     async def _handle_social_login(self, provider: str, user_info: dict, access_token_info: dict):
         
         """
         Handles social login for a user by checking for an existing account or creating a new one.
 
+        Users are resolved through their linked provider identity `(provider, user_info["id"] or
+        user_info["sub"])` with one point lookup. On a first login the identity is linked to the
+        account with the same email only if the provider reports the email as verified
+        ("email_verified" or Google's "verified_email"); display names are never used to match
+        accounts. Otherwise a new user named `<provider>:<subject>` is provisioned and linked.
+
         :param provider: The social provider (e.g., 'google', 'facebook') used for authentication.
         :param user_info: A dictionary containing user information retrieved from the social provider.
-            Expected keys include 'name' and 'email'.
+            Expected keys include 'id' (or 'sub'), 'name', 'email' and 'email_verified'.
         :param access_token_info: A dictionary containing access token information.
             Expected keys may include 'access_token', 'refresh_token', 'id_token', 'expires_at', and 'expires_in'.
         
         :return: A dictionary containing a success message, the user data, and access token information.
+        :raises ValueError: If the provider returned no user ID, or the identity cannot be linked.
         """
-        
-        username = user_info.get("name") or user_info.get("email")
-        email = user_info.get("email")
+        subject = user_info.get("id") or user_info.get("sub")
+        if subject is None:
+            raise ValueError(f"The {provider} profile has no user ID.")
+        subject = str(subject)
 
-        existing_user = await self.db.get_user_by_identifier(username=username, email=email)
-        
-        if not existing_user:
+        user = await self.db.get_user_by_identity(provider, subject)
+        if not user:
+            user = await self._provision_social_user(provider, subject, user_info)
+
+        if self.cache:
+            await self._store_social_tokens(provider, _user_field(user, "username") or _user_field(user, "email"), access_token_info)
+        return {"message": "Login successful.", "user": user, "access_token": access_token_info}
+
+    async def _provision_social_user(self, provider: str, subject: str, user_info: dict):
+        """Finds or creates the user for a first login with a provider identity and links the identity to it."""
+        email = user_info.get("email") if _email_verified(user_info) else None
+        user = await self.db.get_user_by_identifier(email=email) if email else None
+        if not user:
+            username = f"{provider}:{subject}"
             user_data = {
                 "username": username,
                 "email": email,
@@ -559,31 +859,44 @@ class SocialAuthManager:
                 'mfa_enabled': False,
                 'mfa_secret': ''
             }
-
-            if isinstance(self.db, SQLDatabase) and self.db.orm_model:
-                user_instance = self.db.orm_model(**user_data)
-                await self.db.create_user(user_instance)  
-            else:
-                await self.db.create_user(user_data)
-
-            user = user_data 
-        else:
-            user = existing_user
-
-        if self.cache:
-            access_token = access_token_info.get('access_token')
-            refresh_token = access_token_info.get('refresh_token')
-            id_token = access_token_info.get('id_token') or None
-            exp = access_token_info.get('expires_at') or access_token_info.get('expires_in')
-            self.cache.store_social_token(user["username"] or user["email"], access_token, refresh_token, id_token , exp or None)
-
-        return {"message": "Login successful.", "user": user, "access_token": access_token_info}
+            # Atomic on the provider-scoped username, so two tabs completing a first login at once
+            # still provision a single user
+            user = await self.db.upsert_user(user_data, key="username")
+            if _user_field(user, "provider") != provider:
+                raise ValueError(f"The username {username} belongs to another account.")
+
+        try:
+            await self.db.link_identity(provider, subject, user)
+        except ValueError:
+            # A concurrent first login linked the identity first (backends without an atomic upsert)
+            linked = await self.db.get_user_by_identity(provider, subject)
+            if linked is None:
+                raise
+            user = linked
+        return user
+
+    async def _store_social_tokens(self, provider: str, identifier: str, access_token_info: dict):
+        access_token = access_token_info.get('access_token')
+        refresh_token = access_token_info.get('refresh_token')
+        id_token = access_token_info.get('id_token') or None
+        exp = access_token_info.get('expires_at') or access_token_info.get('expires_in')
+        await self.cache.store_social_token(identifier, access_token, refresh_token, id_token, exp or None)
+        await self._schedule_refresh(provider, identifier, refresh_token, exp or None)
+
+    async def _schedule_refresh(self, provider: str, identifier: str, refresh_token: str, exp=None):
+        # GitHub and Facebook tokens are not refreshed at the provider
+        if self.refresh_scheduler and refresh_token and (provider in ("google", "apple") or provider in self.oidc_providers):
+            await self.refresh_scheduler.track(provider, identifier, exp)
     
     # refreshing tokens and storing it in redis
     async def refresh_access_token(self, provider: str, refresh_token: str, user: dict):
         """
         Refreshes the access token using the refresh token for a specific provider and stores it in the cache.
 
+        Concurrent refreshes for the same provider and user are coalesced (see `refresh_coalescer`):
+        one refresh runs and every caller gets its result, so parallel requests with an expiring token
+        do not each call the provider and race each other's cache writes.
+
         Args:
             provider (str): The social provider name (e.g., "google", "facebook", "apple", "github").
             refresh_token (str): The refresh token for the user.
@@ -592,15 +905,26 @@ class SocialAuthManager:
         Returns:
             dict: A dictionary containing the updated access token and refresh token.
         """
-        
         user_identifier = user.get("username") or user.get("email")
+        dump = load = None
+        if provider == "google" and self.google_manager:
+            dump, load = self.google_manager.dump_credentials, self.google_manager.load_credentials
+        return await self.refresh_coalescer.do(
+            f"{provider}:{user_identifier}",
+            lambda: self._refresh_access_token(provider, refresh_token, user_identifier),
+            dump=dump, load=load
+        )
+
+    async def _refresh_access_token(self, provider: str, refresh_token: str, user_identifier: str):
 
         if provider == "google" and self.google_manager:
             # Refresh access token using GoogleManager
             updated_credentials = await self.google_manager.refresh_access_token(refresh_token)
             updated_access_token = updated_credentials.token
             updated_refresh_token = updated_credentials.refresh_token
-            await self.cache.update_social_token(user_identifier, updated_access_token, updated_refresh_token)
+            await self.cache.update_social_token(user_identifier, updated_access_token, updated_refresh_token, updated_credentials.id_token)
+            expiry = updated_credentials.expiry
+            await self._schedule_refresh(provider, user_identifier, updated_refresh_token, expiry.replace(tzinfo=datetime.timezone.utc).timestamp() if expiry else None)
             return updated_credentials
 
         elif provider == "apple" and self.apple_manager:
@@ -608,10 +932,11 @@ class SocialAuthManager:
             updated_access_token_info = await self.apple_manager.refresh_access_token(refresh_token)
             access_token = updated_access_token_info.get("access_token")
             expires_in = updated_access_token_info.get("expires_in")
-            refresh_token = updated_access_token_info.get("refresh_token")
+            refresh_token = updated_access_token_info.get("refresh_token") or refresh_token
             id_token = updated_access_token_info.get("id_token")
 
             await self.cache.update_social_token(user_identifier, access_token, refresh_token, id_token, expires_in)
+            await self._schedule_refresh(provider, user_identifier, refresh_token, expires_in)
             return updated_access_token_info
 
         elif provider == "github" and self.github_manager:
@@ -650,6 +975,16 @@ class SocialAuthManager:
                 return updated_access_token_info
 
 
+        elif provider in self.oidc_providers:
+            updated_access_token_info = await self.oidc_providers[provider].refresh_access_token(refresh_token)
+            refresh_token = updated_access_token_info.get("refresh_token") or refresh_token
+            expires_in = updated_access_token_info.get("expires_in")
+            await self.cache.update_social_token(
+                user_identifier, updated_access_token_info["access_token"], refresh_token, updated_access_token_info.get("id_token"), expires_in
+            )
+            await self._schedule_refresh(provider, user_identifier, refresh_token, expires_in)
+            return updated_access_token_info
+
         else:
             raise ValueError(f"Refresh token functionality is not implemented for provider: {provider}")
 
@@ -668,15 +1003,22 @@ class SocialAuthManager:
         access_token = await self.cache.retrieve_access_token(user_identifier)
         
         if provider == "facebook" and self.facebook_manager:
-            self.facebook_manager.logout(access_token)
+            await self.facebook_manager.logout(access_token)
 
         elif provider == "apple" and self.apple_manager:
-            self.apple_manager.logout(access_token)
+            await self.apple_manager.logout(access_token)
+
+        elif provider in self.oidc_providers and access_token:
+            oidc_provider = self.oidc_providers[provider]
+            if 'revocation_endpoint' in await oidc_provider.metadata():
+                await oidc_provider.revoke(access_token, token_type_hint="access_token")
 
         # Delete tokens from cache
         if self.cache:
             await self.cache.delete_access_token(user_identifier)
             await self.cache.delete_refresh_token(user_identifier)
+        if self.refresh_scheduler:
+            await self.refresh_scheduler.untrack(provider, user_identifier)
 
         return {"message": "Logout successful."}
     
@@ -45,3 +45,104 @@ class AbstractDatabase(ABC):
         :return: A dict with a message indicating success
         """
         pass
+
+    async def update_user_password_if_unchanged(self, identifier: str, expected_password: str, new_password: str) -> bool:
+        """
+        Replaces the user's password hash only if it still equals `expected_password`, e.g. when
+        rehashing a password that was verified a moment ago, so a concurrent password reset wins.
+
+        This default reads the user and then updates the password, which leaves a small race window;
+        the bundled backends override it with one conditional update.
+
+        :param identifier: The email, username, or phone of the user.
+        :param expected_password: The hash the stored password must still equal.
+        :param new_password: The new hashed password to set.
+        :return: True if the password was replaced, False if it had changed or the user is gone.
+        """
+        field = "email" if "@" in identifier else "phone" if identifier.isdigit() else "username"
+        user = await self.get_user_by_identifier(**{field: identifier})
+        if not user or user["hashed_password"] != expected_password:
+            return False
+        await self.update_user_password(identifier, new_password)
+        return True
+
+    async def upsert_user(self, user_data: dict, key: str = "username"):
+        """
+        Returns the user whose `key` field equals `user_data[key]`, creating it from `user_data` first
+        if there is none. An existing user is returned unchanged.
+
+        This default looks the user up and then creates it, which is neither atomic nor a single round
+        trip; the bundled backends override it with one atomic statement. Those rely on a unique index
+        on the `key` field to stay race-free.
+
+        :param user_data: The user to create when none matches.
+        :param key: The field identifying the user ("username" or "email").
+        :return: The existing or newly created user.
+        :raises ValueError: If `user_data` has no value for `key`.
+        """
+        if user_data.get(key) is None:
+            raise ValueError(f"upsert_user requires a value for {key}.")
+        user = await self.get_user_by_identifier(**{key: user_data[key]})
+        if user:
+            return user
+        await self.create_user(user_data)
+        return user_data
+
+    async def get_user_by_identity(self, provider: str, subject: str):
+        """
+        Retrieves the user linked to a provider identity (see link_identity).
+
+        Backends without an identity store return None, so social logins only find existing users
+        through a verified email.
+
+        :param provider: The identity provider (e.g. "google", "github").
+        :param subject: The provider's stable user ID.
+        :return: The linked user if any, otherwise None.
+        """
+        return None
+
+    async def link_identity(self, provider: str, subject: str, user):
+        """
+        Links a provider identity to a user. A user can have one identity per provider and several
+        providers; linking an identity that already belongs to the same user is a no-op.
+
+        :param provider: The identity provider (e.g. "google", "github").
+        :param subject: The provider's stable user ID.
+        :param user: The user object, as returned by the other methods of the backend.
+        """
+        pass
+
+    async def get_mirrored_profile(self, source: str, key: str):
+        """
+        Retrieves a profile mirrored from an external user directory (see store_mirrored_profiles).
+
+        Backends without a profile mirror return None, so every profile read goes to the directory.
+
+        :param source: The directory the profile is mirrored from (e.g. "cognito").
+        :param key: The user's key in the directory, e.g. the username.
+        :return: A dictionary with the "key", the "profile" (None for an invalidated entry) and
+            "synced_at", the time.time() at which the profile was read; None if nothing is mirrored.
+        """
+        return None
+
+    async def store_mirrored_profiles(self, source: str, entries: list):
+        """
+        Inserts or replaces mirrored profiles. An entry only replaces one that was synced earlier, so a
+        profile read before an invalidation never overwrites it.
+
+        :param source: The directory the profiles are mirrored from (e.g. "cognito").
+        :param entries: Dictionaries with the "key", the "profile" (None to invalidate the entry) and
+            "synced_at", the time.time() at which the profile was read.
+        """
+        pass
+
+    async def prune_mirrored_profiles(self, source: str, synced_before: float) -> int:
+        """
+        Deletes the mirrored profiles synced before a given time, e.g. those of users a full sync no
+        longer found in the directory.
+
+        :param source: The directory the profiles are mirrored from (e.g. "cognito").
+        :param synced_before: A time.time() value; entries synced earlier are deleted.
+        :return: The number of deleted entries.
+        """
+        return 0
@@ -1,18 +1,23 @@
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from authy_package.db.abstract_db import AbstractDatabase
 
 class MongoDB(AbstractDatabase):
-    def __init__(self, db_url: str, db_name: str, collection_name: str):
+    def __init__(self, db_url: str, db_name: str, collection_name: str, profiles_collection: str = "mirrored_profiles", **client_kwargs):
         """
         Initializes the MongoDB client and sets up the database and collection.
 
         :param db_url: The URL of the MongoDB database.
         :param db_name: The name of the database to use.
         :param collection_name: The name of the collection to use.
+        :param profiles_collection: The name of the collection holding profiles mirrored from external user directories.
+        :param client_kwargs: Extra options for AsyncIOMotorClient (e.g. maxPoolSize, event_listeners).
         """
-        self.client = AsyncIOMotorClient(db_url)
+        self.client = AsyncIOMotorClient(db_url, **client_kwargs)
         self.db = self.client[db_name]
         self.collection = self.db[collection_name]
+        self.profiles = self.db[profiles_collection]
 
     async def create_user(self, user_data: dict):
         """
@@ -23,6 +28,125 @@ class MongoDB(AbstractDatabase):
         """
         await self.collection.insert_one(user_data)
 
+    async def create_indexes(self):
+        """
+        Creates the unique index of the linked identities and the index of the mirrored profiles.
+
+        Identities are embedded in the user documents as `identities: [{provider, subject}]`. The
+        unique compound multikey index makes `(provider, subject)` point to at most one user and
+        answers get_user_by_identity with a single index lookup; it is sparse, so users without
+        linked identities are not indexed.
+        """
+        await self.collection.create_index(
+            [("identities.provider", 1), ("identities.subject", 1)],
+            unique=True, sparse=True, name="identities"
+        )
+        # Mirrored profiles are looked up by _id; this index serves the prune after a full sync
+        await self.profiles.create_index([("source", 1), ("synced_at", 1)], name="source_synced_at")
+
+    async def get_mirrored_profile(self, source: str, key: str):
+        """
+        Retrieves a mirrored profile by its _id.
+
+        :param source: The directory the profile is mirrored from (e.g. "cognito").
+        :param key: The user's key in the directory.
+        :return: A dictionary with the "key", "profile" and "synced_at", or None if nothing is mirrored.
+        """
+        return await self.profiles.find_one({"_id": f"{source}:{key}"}, {"_id": 0, "key": 1, "profile": 1, "synced_at": 1})
+
+    async def store_mirrored_profiles(self, source: str, entries: list):
+        """
+        Inserts or replaces mirrored profiles in one unordered bulk write, keeping any entry synced
+        later than the new one.
+
+        Each entry is an upsert matching only an older entry; where a newer one exists, the upsert's
+        insert fails with a duplicate key error, which is ignored.
+
+        :param source: The directory the profiles are mirrored from (e.g. "cognito").
+        :param entries: Dictionaries with the "key", "profile" and "synced_at".
+        """
+        operations = [
+            UpdateOne(
+                {"_id": f"{source}:{entry['key']}", "synced_at": {"$lt": entry["synced_at"]}},
+                {"$set": {"source": source, "key": entry["key"], "profile": entry["profile"], "synced_at": entry["synced_at"]}},
+                upsert=True
+            )
+            for entry in entries
+        ]
+        if not operations:
+            return
+        try:
+            await self.profiles.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            if any(error["code"] != 11000 for error in e.details.get("writeErrors", [])) or e.details.get("writeConcernErrors"):
+                raise
+
+    async def prune_mirrored_profiles(self, source: str, synced_before: float) -> int:
+        """
+        Deletes the mirrored profiles synced before a given time.
+
+        :param source: The directory the profiles are mirrored from (e.g. "cognito").
+        :param synced_before: A time.time() value; entries synced earlier are deleted.
+        :return: The number of deleted entries.
+        """
+        result = await self.profiles.delete_many({"source": source, "synced_at": {"$lt": synced_before}})
+        return result.deleted_count
+
+    async def get_user_by_identity(self, provider: str, subject: str):
+        """
+        Retrieves the user linked to a provider identity.
+
+        :param provider: The identity provider (e.g. "google", "github").
+        :param subject: The provider's stable user ID.
+        :return: The user document if found, otherwise None.
+        """
+        return await self.collection.find_one({"identities": {"$elemMatch": {"provider": provider, "subject": subject}}})
+
+    async def link_identity(self, provider: str, subject: str, user):
+        """
+        Links a provider identity to a user.
+
+        :param provider: The identity provider (e.g. "google", "github").
+        :param subject: The provider's stable user ID.
+        :param user: The user document.
+        :raises ValueError: If the identity is already linked to another user.
+        """
+        try:
+            await self.collection.update_one(
+                {"_id": user["_id"]},
+                {"$addToSet": {"identities": {"provider": provider, "subject": subject}}}
+            )
+        except DuplicateKeyError:
+            raise ValueError(f"The {provider} identity is already linked to another user.")
+
+    async def upsert_user(self, user_data: dict, key: str = "username"):
+        """
+        Returns the user matching `user_data[key]`, inserting `user_data` if there is none, in one
+        `find_one_and_update(upsert=True)` round trip.
+
+        With a unique index on `key`, two concurrent upserts of the same user cannot both insert: the
+        loser gets a duplicate key error and reads the winner's document instead.
+
+        :param user_data: The user to insert when none matches.
+        :param key: The field identifying the user ("username" or "email").
+        :return: The existing or newly inserted user document.
+        :raises ValueError: If `user_data` has no value for `key`; `{key: None}` would match every
+            document without the field.
+        """
+        if user_data.get(key) is None:
+            raise ValueError(f"upsert_user requires a value for {key}.")
+        query = {key: user_data[key]}
+        on_insert = {field: value for field, value in user_data.items() if field != key}
+        try:
+            return await self.collection.find_one_and_update(
+                query,
+                {"$setOnInsert": on_insert},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            return await self.collection.find_one(query)
+
     async def get_user_by_identifier(self, username=None, email=None, phone=None):
         """
         Retrieves a user from the collection based on their identifier.
@@ -90,10 +214,27 @@ class MongoDB(AbstractDatabase):
 
         result = await self.collection.update_one(
             query,
-            {"$set": {"password": new_password}}
+            {"$set": {"hashed_password": new_password}}
         )
 
         if result.matched_count == 0:
             raise ValueError("User not found.")
 
         return {"message": "Password updated successfully."}
+
+    async def update_user_password_if_unchanged(self, identifier: str, expected_password: str, new_password: str) -> bool:
+        """
+        Replaces the user's password hash only if it still equals `expected_password`, with one
+        conditional update.
+
+        :param identifier: The email, username, or phone of the user.
+        :param expected_password: The hash the stored password must still equal.
+        :param new_password: The new hashed password to set.
+        :return: True if the password was replaced, False if it had changed or the user is gone.
+        """
+        field = "email" if "@" in identifier else "phone" if identifier.isdigit() else "username"
+        result = await self.collection.update_one(
+            {field: identifier, "hashed_password": expected_password},
+            {"$set": {"hashed_password": new_password}}
+        )
+        return result.modified_count > 0
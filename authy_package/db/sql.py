@@ -1,20 +1,212 @@
+import asyncio
+
+from sqlalchemy import JSON, Column, Float, ForeignKey, Index, MetaData, String, Table, UniqueConstraint, delete, inspect, update
+from sqlalchemy.exc import DBAPIError, IntegrityError
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.future import select
 from authy_package.db.abstract_db import AbstractDatabase
 
 class SQLDatabase(AbstractDatabase):
-    def __init__(self, db_url: str, orm_model):
+    def __init__(self, db_url: str, orm_model, echo: bool = True, identities_table: str = "user_identities",
+                 profiles_table: str = "mirrored_profiles"):
         """
         Initializes the SQLDatabase instance.
 
         :param db_url: The database URL for connecting to the SQL database.
         :param orm_model: The ORM model class used for interacting with the database.
+        :param echo: Log every SQL statement.
+        :param identities_table: The name of the table linking provider identities to users.
+        :param profiles_table: The name of the table holding profiles mirrored from external user directories.
+
+        The identities and profiles tables are created on first use if they do not exist yet, which
+        requires the database user to have CREATE privileges; otherwise create them during migrations
+        with `create_identity_table()` and `create_profile_table()`.
         """
         self.orm_model = orm_model
-        self.engine = create_async_engine(db_url, echo=True)
+        self.engine = create_async_engine(db_url, echo=echo)
         self.session_factory = sessionmaker(bind=self.engine, class_=AsyncSession, expire_on_commit=False)
 
+        # (provider, subject) -> user primary key; the composite primary key is the unique lookup index
+        self._user_pk = inspect(orm_model).primary_key[0]
+        self.identity_metadata = MetaData()
+        self.identities = Table(
+            identities_table, self.identity_metadata,
+            Column("provider", String(32), primary_key=True),
+            Column("subject", String(255), primary_key=True),
+            Column("user_id", self._user_pk.type, ForeignKey(self._user_pk, ondelete="CASCADE"), nullable=False),
+            Index(f"ix_{identities_table}_user_id", "user_id"),
+        )
+        # Metadata whose tables are known to exist, and the lock serializing their creation
+        self._created = set()
+        self._create_lock = asyncio.Lock()
+
+        # (source, key) -> profile; the synced_at index serves the prune after a full sync
+        self.profile_metadata = MetaData()
+        self.profiles = Table(
+            profiles_table, self.profile_metadata,
+            Column("source", String(32), primary_key=True),
+            Column("key", String(255), primary_key=True),
+            Column("profile", JSON, nullable=True),
+            Column("synced_at", Float, nullable=False),
+            Index(f"ix_{profiles_table}_synced_at", "source", "synced_at"),
+        )
+
+    async def create_identity_table(self):
+        """Creates the linked identities table if it does not exist."""
+        await self._ensure_tables(self.identity_metadata)
+
+    async def _ensure_tables(self, metadata: MetaData):
+        """Creates the tables of `metadata` once per process, tolerating another process creating them concurrently."""
+        if metadata in self._created:
+            return
+        async with self._create_lock:
+            if metadata in self._created:
+                return
+            try:
+                async with self.engine.begin() as connection:
+                    await connection.run_sync(metadata.create_all)
+            except DBAPIError:
+                # Another process may have created a table between the existence check and CREATE TABLE
+                async with self.engine.connect() as connection:
+                    missing = await connection.run_sync(
+                        lambda sync_connection: [name for name in metadata.tables if not inspect(sync_connection).has_table(name)]
+                    )
+                if missing:
+                    raise
+            self._created.add(metadata)
+
+    async def create_profile_table(self):
+        """Creates the mirrored profiles table if it does not exist."""
+        await self._ensure_tables(self.profile_metadata)
+
+    async def get_mirrored_profile(self, source: str, key: str):
+        """
+        Retrieves a mirrored profile with one primary-key lookup.
+
+        :param source: The directory the profile is mirrored from (e.g. "cognito").
+        :param key: The user's key in the directory.
+        :return: A dictionary with the "key", "profile" and "synced_at", or None if nothing is mirrored.
+        """
+        await self._ensure_tables(self.profile_metadata)
+        async with self.engine.connect() as connection:
+            result = await connection.execute(
+                select(self.profiles.c.key, self.profiles.c.profile, self.profiles.c.synced_at)
+                .where(self.profiles.c.source == source, self.profiles.c.key == key)
+            )
+            row = result.first()
+        return dict(row._mapping) if row else None
+
+    async def store_mirrored_profiles(self, source: str, entries: list):
+        """
+        Inserts or replaces mirrored profiles, keeping any entry synced later than the new one.
+
+        On PostgreSQL and SQLite a batch is a single `INSERT ... ON CONFLICT DO UPDATE ... WHERE`
+        statement. Other databases fall back to a conditional update and an insert per entry.
+
+        :param source: The directory the profiles are mirrored from (e.g. "cognito").
+        :param entries: Dictionaries with the "key", "profile" and "synced_at".
+        """
+        # ON CONFLICT cannot touch a row twice in one statement, so keep the latest entry per key
+        rows = {}
+        for entry in entries:
+            if entry["key"] not in rows or rows[entry["key"]]["synced_at"] < entry["synced_at"]:
+                rows[entry["key"]] = {"source": source, "key": entry["key"], "profile": entry["profile"], "synced_at": entry["synced_at"]}
+        if not rows:
+            return
+
+        await self._ensure_tables(self.profile_metadata)
+        dialect = self.engine.dialect.name
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            for row in rows.values():
+                await self._store_mirrored_profile(row)
+            return
+
+        statement = insert(self.profiles).values(list(rows.values()))
+        statement = statement.on_conflict_do_update(
+            index_elements=[self.profiles.c.source, self.profiles.c.key],
+            set_={"profile": statement.excluded.profile, "synced_at": statement.excluded.synced_at},
+            where=self.profiles.c.synced_at < statement.excluded.synced_at
+        )
+        async with self.engine.begin() as connection:
+            await connection.execute(statement)
+
+    async def _store_mirrored_profile(self, row: dict):
+        newer = update(self.profiles).where(
+            self.profiles.c.source == row["source"], self.profiles.c.key == row["key"], self.profiles.c.synced_at < row["synced_at"]
+        ).values(profile=row["profile"], synced_at=row["synced_at"])
+        async with self.engine.begin() as connection:
+            if (await connection.execute(newer)).rowcount:
+                return
+        try:
+            async with self.engine.begin() as connection:
+                await connection.execute(self.profiles.insert().values(**row))
+        except IntegrityError:
+            # An entry exists: either it is newer, or it was inserted concurrently and may be replaced
+            async with self.engine.begin() as connection:
+                await connection.execute(newer)
+
+    async def prune_mirrored_profiles(self, source: str, synced_before: float) -> int:
+        """
+        Deletes the mirrored profiles synced before a given time.
+
+        :param source: The directory the profiles are mirrored from (e.g. "cognito").
+        :param synced_before: A time.time() value; entries synced earlier are deleted.
+        :return: The number of deleted entries.
+        """
+        await self._ensure_tables(self.profile_metadata)
+        async with self.engine.begin() as connection:
+            result = await connection.execute(
+                delete(self.profiles).where(self.profiles.c.source == source, self.profiles.c.synced_at < synced_before)
+            )
+        return result.rowcount
+
+    async def get_user_by_identity(self, provider: str, subject: str):
+        """
+        Retrieves the user linked to a provider identity with one primary-key lookup joined to the user.
+
+        :param provider: The identity provider (e.g. "google", "github").
+        :param subject: The provider's stable user ID.
+        :return: The user object if found, otherwise None.
+        """
+        query = (
+            select(self.orm_model)
+            .join(self.identities, self.identities.c.user_id == self._user_pk)
+            .where(self.identities.c.provider == provider, self.identities.c.subject == subject)
+        )
+        await self._ensure_tables(self.identity_metadata)
+        async with self.session_factory() as session:
+            result = await session.execute(query)
+            return result.scalars().first()
+
+    async def link_identity(self, provider: str, subject: str, user):
+        """
+        Links a provider identity to a user.
+
+        :param provider: The identity provider (e.g. "google", "github").
+        :param subject: The provider's stable user ID.
+        :param user: The user object.
+        :raises ValueError: If the identity is already linked to another user.
+        """
+        user_id = getattr(user, self._user_pk.key)
+        await self._ensure_tables(self.identity_metadata)
+        try:
+            async with self.engine.begin() as connection:
+                await connection.execute(self.identities.insert().values(provider=provider, subject=subject, user_id=user_id))
+        except IntegrityError:
+            if await self._identity_owner(provider, subject) != user_id:
+                raise ValueError(f"The {provider} identity is already linked to another user.")
+
+    async def _identity_owner(self, provider: str, subject: str):
+        async with self.engine.connect() as connection:
+            return await connection.scalar(
+                select(self.identities.c.user_id).where(self.identities.c.provider == provider, self.identities.c.subject == subject)
+            )
+
     async def create_user(self, user_data: dict):
         """
         Creates a new user in the database.
@@ -26,6 +218,59 @@ class SQLDatabase(AbstractDatabase):
                 user = self.orm_model(**user_data)
                 session.add(user)
 
+    async def upsert_user(self, user_data: dict, key: str = "username"):
+        """
+        Returns the user matching `user_data[key]`, inserting `user_data` if there is none.
+
+        On PostgreSQL and SQLite this is a single `INSERT ... ON CONFLICT (key) DO UPDATE ... RETURNING`
+        statement; the no-op update makes the existing row come back from RETURNING. ON CONFLICT needs
+        a unique constraint (or unique index) on the `key` column, declared on the ORM model, e.g.
+        `username = Column(String, unique=True)`. Models without one, and other databases, fall back
+        to a lookup and an insert, which two concurrent first logins can race.
+
+        :param user_data: The user to insert when none matches.
+        :param key: The column identifying the user ("username" or "email").
+        :return: The existing or newly inserted user object.
+        :raises ValueError: If `user_data` has no value for `key`.
+        """
+        if user_data.get(key) is None:
+            raise ValueError(f"upsert_user requires a value for {key}.")
+        dialect = self.engine.dialect.name
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            insert = None
+        if insert is None or not self._is_unique(key):
+            user = await self.get_user_by_identifier(**{key: user_data[key]})
+            if user is None:
+                await self.create_user(user_data)
+                user = await self.get_user_by_identifier(**{key: user_data[key]})
+            return user
+
+        column = getattr(self.orm_model, key)
+        statement = insert(self.orm_model).values(**user_data)
+        statement = statement.on_conflict_do_update(
+            index_elements=[column],
+            set_={key: getattr(statement.excluded, key)}
+        ).returning(self.orm_model)
+
+        async with self.session_factory() as session:
+            async with session.begin():
+                result = await session.execute(statement)
+                return result.scalars().one()
+
+    def _is_unique(self, key: str) -> bool:
+        """Whether the model declares a unique constraint or unique index on exactly the `key` column."""
+        table = self.orm_model.__table__
+        column = table.c[key]
+        if column.primary_key or column.unique:
+            return True
+        constraints = [constraint.columns for constraint in table.constraints if isinstance(constraint, UniqueConstraint)]
+        constraints += [index.columns for index in table.indexes if index.unique]
+        return any([c.name for c in columns] == [key] for columns in constraints)
+
     async def get_user_by_identifier(self, username=None, email=None, phone=None):
         """
         Retrieves a user from the database using a unique identifier (username, email, or phone).
@@ -110,7 +355,27 @@ class SQLDatabase(AbstractDatabase):
                     raise ValueError("User not found.")
 
                 # Update the user's password
-                user.password = new_password
+                user.hashed_password = new_password
                 session.add(user) 
 
         return {"message": "Password updated successfully."}
+
+    async def update_user_password_if_unchanged(self, identifier: str, expected_password: str, new_password: str) -> bool:
+        """
+        Replaces the user's password hash only if it still equals `expected_password`, with one
+        conditional `UPDATE ... WHERE hashed_password = :expected`.
+
+        :param identifier: The email, username, or phone of the user.
+        :param expected_password: The hash the stored password must still equal.
+        :param new_password: The new hashed password to set.
+        :return: True if the password was replaced, False if it had changed or the user is gone.
+        """
+        field = "email" if "@" in identifier else "phone" if identifier.isdigit() else "username"
+        statement = (
+            update(self.orm_model)
+            .where(getattr(self.orm_model, field) == identifier, self.orm_model.hashed_password == expected_password)
+            .values(hashed_password=new_password)
+        )
+        async with self.engine.begin() as connection:
+            result = await connection.execute(statement)
+        return result.rowcount > 0
@@ -4,5 +4,10 @@ from .apple import AppleManager
 from .github import GitHubManager
 from .facebook import FacebookManager
 from .google import GoogleManager
+from .http import ResilientHTTPClient
+from .oauth_state import OAuthStateManager
+from .oidc import OIDCProvider
+from .profile_cache import ProfileCache
+from .refresh_scheduler import RefreshScheduler
 
-__all__ = ["AppleManager", "GitHubManager", "FacebookManager", "GoogleManager"]
+__all__ = ["AppleManager", "GitHubManager", "FacebookManager", "GoogleManager", "ResilientHTTPClient", "OAuthStateManager", "OIDCProvider", "ProfileCache", "RefreshScheduler"]
@@ -1,56 +1,71 @@
-import requests
-import jwt
 import time
 
-class AppleManager:
-    def __init__(self, client_id, team_id, key_id, private_key):
-        self.client_id = client_id
+import jwt
+
+from authy_package.social.oidc import OIDCProvider
+from authy_package.utils.resilience import ProviderUnavailableError
+
+class AppleManager(OIDCProvider):
+    TOKEN_URL = "https://appleid.apple.com/auth/token"
+    REVOKE_URL = "https://appleid.apple.com/auth/oauth2/v2/revoke"
+    # Apple has no userinfo endpoint; the user's claims come from the verified ID token
+    CONFIG = {
+        'issuer': "https://appleid.apple.com",
+        'authorization_endpoint': "https://appleid.apple.com/auth/oauth2/v2/authorize",
+        'token_endpoint': TOKEN_URL,
+        'revocation_endpoint': REVOKE_URL,
+        'jwks_uri': "https://appleid.apple.com/auth/keys",
+        'id_token_signing_alg_values_supported': ["RS256"],
+    }
+
+    def __init__(self, client_id, team_id, key_id, private_key, http_client=None):
+        """
+        Args:
+            client_id (str): The Services ID of the app.
+            team_id (str): The Apple developer team ID.
+            key_id (str): The ID of the Sign in with Apple private key.
+            private_key (str): The PEM-encoded private key used to sign client secrets.
+            http_client (optional): An httpx.AsyncClient to use instead of the shared pooled client, or a
+                ResilientHTTPClient to change the breaker, deadline, retry and hedging policies.
+        """
+        super().__init__("apple", client_id, http_client=http_client)
         self.team_id = team_id
         self.key_id = key_id
         self.private_key = private_key
 
-    def get_authorization_url(self, redirect_uri, scope="openid email profile"):
+    def client_credentials(self):
+        # Apple authenticates clients with a short-lived JWT signed by the app's private key
+        return {'client_id': self.client_id, 'client_secret': self.generate_client_secret()}
+
+    async def get_authorization_url(self, redirect_uri, scope="openid email profile", state=None, nonce=None, **params):
         """
         Generates the authorization URL for Apple Sign-In.
 
         Args:
             redirect_uri (str): The redirect URI for your application.
             scope (str, optional): Requested scopes (default: openid email profile).
+            state (str, optional): An opaque value echoed back to the redirect URI (CSRF protection).
+            nonce (str, optional): A value Apple embeds in the ID token, checked by `get_user_info`.
+            **params: Further query parameters, e.g. `response_mode`.
 
         Returns:
             str: The authorization URL.
         """
-        url = "https://appleid.apple.com/auth/oauth2/v2/authorize"
-        params = {
-            'client_id': self.client_id,
-            'redirect_uri': redirect_uri,
-            'scope': scope,
-            'response_type': 'code',
-        }
-        return url + "?" + requests.utils.urlencode(params)
+        return await super().get_authorization_url(state=state, nonce=nonce, redirect_uri=redirect_uri, scopes=scope.split(), **params)
 
-    def get_access_token(self, code):
+    async def get_access_token(self, code, redirect_uri=None):
         """
         Exchanges the authorization code for an access token and ID token.
 
         Args:
             code (str): The authorization code received in the redirect URI.
+            redirect_uri (str, optional): The redirect URI of the authorization request, which Apple
+                requires when one was sent.
 
         Returns:
             dict: The dictionary containing access token, ID token, refresh token (optional), etc.
         """
-        url = "https://appleid.apple.com/auth/token"
-        headers = {
-            'Content-Type': 'application/x-www-form-urlencoded'
-        }
-        data = {
-            'client_id': self.client_id,
-            'client_secret': self.generate_client_secret(),
-            'code': code,
-            'grant_type': 'authorization_code'
-        }
-        response = requests.post(url, headers=headers, data=data)
-        return response.json()
+        return await self.exchange_code(code, redirect_uri=redirect_uri)
 
     def generate_client_secret(self):
         """
@@ -69,23 +84,25 @@ class AppleManager:
             "aud": "https://appleid.apple.com",
             "sub": self.client_id
         }
-        client_secret = jwt.encode(payload, self.private_key, algorithm='ES256', headers=header)
-        return client_secret.decode()  # Decode to string for requests
+        return jwt.encode(payload, self.private_key, algorithm='ES256', headers=header)
 
-    def get_user_info(self, id_token):
+    async def get_user_info(self, id_token, nonce=None):
         """
-        Decodes the ID token to get user information.
+        Verifies the ID token against Apple's signing keys and returns its claims.
 
         Args:
             id_token (str): The ID token obtained from the access token response.
+            nonce (str, optional): The nonce sent with the authorization request, if any.
 
         Returns:
-            dict: The user information decoded from the ID token.
+            dict: The user information from the verified ID token.
+
+        Raises:
+            ValueError: If the ID token is not a valid token issued by Apple for this app.
         """
-        decoded_token = jwt.decode(id_token, options={"verify_signature": False})
-        return decoded_token
+        return await self.verify_id_token(id_token, nonce=nonce)
 
-    def refresh_access_token(self, refresh_token):
+    async def refresh_access_token(self, refresh_token):
         """
         Refreshes the access token using the refresh token.
 
@@ -95,23 +112,14 @@ class AppleManager:
         Returns:
             dict (optional): The refreshed access token information or None if refresh fails.
         """
-        url = "https://appleid.apple.com/auth/token"
-        headers = {
-            'Content-Type': 'application/x-www-form-urlencoded'
-        }
-        data = {
-            'client_id': self.client_id,
-            'client_secret': self.generate_client_secret(),
-            'refresh_token': refresh_token,
-            'grant_type': 'refresh_token'
-        }
-        response = requests.post(url, headers=headers, data=data)
-        if response.status_code == 200:
-            return response.json()
-        else:
+        try:
+            return await super().refresh_access_token(refresh_token)
+        except ProviderUnavailableError:
+            raise
+        except ValueError:
             return None
 
-    def logout(self, access_token):
+    async def logout(self, access_token):
         """
         Revokes the user's access token, effectively logging them out.
 
@@ -121,15 +129,4 @@ class AppleManager:
         Returns:
             None
         """
-        url = "https://appleid.apple.com/auth/oauth2/v2/revoke"
-        headers = {
-            'Content-Type': 'application/x-www-form-urlencoded'
-        }
-        data = {
-            'client_id': self.client_id,
-            'client_secret': self.generate_client_secret(),
-            'token': access_token
-        }
-        response = requests.post(url, headers=headers, data=data)
-        if response.status_code != 200:
-            raise ValueError(f"Failed to log out: {response.text}")
\ No newline at end of file
+        await self.revoke(access_token, token_type_hint="access_token")
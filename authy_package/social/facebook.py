@@ -1,35 +1,70 @@
-import requests
 import time
+from urllib.parse import urlencode
+
+from authy_package.social.http import resilient_http_client
+from authy_package.social.profile_cache import ProfileCache
+from authy_package.utils.resilience import RateLimiter, shared_rate_limiter
 
 class FacebookManager:
-    def __init__(self, app_id, app_secret, redirect_uri):
+    DIALOG_URL = "https://www.facebook.com/v10.0/dialog/oauth"
+    GRAPH_URL = "https://graph.facebook.com"
+
+    def __init__(self, app_id, app_secret, redirect_uri, http_client=None, rate_limiter: RateLimiter = None,
+                 profile_cache: ProfileCache = None):
+        """
+        Args:
+            app_id (str): The ID of the Facebook app.
+            app_secret (str): The secret of the Facebook app.
+            redirect_uri (str): The URI to which the user will be redirected after authorization.
+            http_client (optional): An httpx.AsyncClient to use instead of the shared pooled client, or a
+                ResilientHTTPClient to change the breaker, deadline, retry and hedging policies.
+            rate_limiter (RateLimiter, optional): Paces the calls of this app; defaults to the limiter
+                shared by every manager of the app, which follows the Graph API usage headers.
+            profile_cache (ProfileCache, optional): Caches profiles per access token and revalidates them
+                with their ETag.
+        """
         self.app_id = app_id
         self.app_secret = app_secret
         self.redirect_uri = redirect_uri
+        self._http = resilient_http_client(http_client)
+        self.rate_limiter = rate_limiter or shared_rate_limiter(f"facebook:{app_id}")
+        self.profile_cache = profile_cache or ProfileCache()
 
-    def get_authorization_url(self):
+    @property
+    def http(self):
+        return self._http
+
+    def get_authorization_url(self, state=None, **params):
         """
         Generates the URL for Facebook login authorization.
 
+        Args:
+            state (str, optional): An opaque value echoed back to the redirect URI (CSRF protection),
+                e.g. from OAuthStateManager.
+            **params: Further query parameters, e.g. `code_challenge` and `code_challenge_method` for PKCE.
+
         Returns:
             str: The authorization URL where the user needs to log in.
         """
-        url = "https://www.facebook.com/v10.0/dialog/oauth"
-        params = {
+        url = self.DIALOG_URL
+        query = {
             'client_id': self.app_id,
             'redirect_uri': self.redirect_uri,
             'scope': 'email,public_profile',  # Request required permissions
             'response_type': 'code',
-            'state': 'your_custom_state_parameter'  # For CSRF protection
         }
-        return url + "?" + requests.utils.urlencode(params)
+        if state:
+            query['state'] = state
+        query.update(params)
+        return url + "?" + urlencode(query)
 
-    def get_access_token(self, code):
+    async def get_access_token(self, code, code_verifier=None):
         """
         Exchanges the authorization code for a short-lived access token.
 
         Args:
             code (str): The authorization code obtained from Facebook's login redirect.
+            code_verifier (str, optional): The PKCE code verifier, if the authorization request sent a code challenge.
 
         Returns:
             dict: The access token information including access token, expiration time, etc.
@@ -37,14 +72,17 @@ class FacebookManager:
         Raises:
             ValueError: If the access token request fails.
         """
-        url = f"https://graph.facebook.com/v10.0/oauth/access_token"
+        url = f"{self.GRAPH_URL}/v10.0/oauth/access_token"
         params = {
             'client_id': self.app_id,
             'client_secret': self.app_secret,
             'redirect_uri': self.redirect_uri,
             'code': code
         }
-        response = requests.get(url, params=params)
+        if code_verifier:
+            params['code_verifier'] = code_verifier
+        # The code is single-use: a retried exchange would fail even if the first one went through
+        response = await self.http.get(url, params=params, idempotent=False, rate_limiter=self.rate_limiter)
         if response.status_code != 200:
             raise ValueError(f"Failed to get access token: {response.text}")
         access_info = response.json()
@@ -53,7 +91,7 @@ class FacebookManager:
         access_info['expires_at'] = time.time() + 3600  # Adjust this based on Facebook's expiration
         return access_info
 
-    def get_long_lived_access_token(self, short_lived_token):
+    async def get_long_lived_access_token(self, short_lived_token):
         """
         Exchanges the short-lived access token for a long-lived access token.
 
@@ -66,14 +104,14 @@ class FacebookManager:
         Raises:
             ValueError: If the long-lived token request fails.
         """
-        url = f"https://graph.facebook.com/v10.0/oauth/access_token"
+        url = f"{self.GRAPH_URL}/v10.0/oauth/access_token"
         params = {
             'grant_type': 'fb_exchange_token',
             'client_id': self.app_id,
             'client_secret': self.app_secret,
             'fb_exchange_token': short_lived_token
         }
-        response = requests.get(url, params=params)
+        response = await self.http.get(url, params=params, hedge=True, rate_limiter=self.rate_limiter)
         if response.status_code != 200:
             raise ValueError(f"Failed to get long-lived access token: {response.text}")
         access_info = response.json()
@@ -82,7 +120,7 @@ class FacebookManager:
         access_info['expires_at'] = time.time() + (60 * 24 * 3600)  # 60 days
         return access_info
 
-    def get_user_info(self, access_token):
+    async def get_user_info(self, access_token):
         """
         Retrieves user information using the access token.
 
@@ -95,13 +133,17 @@ class FacebookManager:
         Raises:
             ValueError: If the user information request fails.
         """
-        url = f"https://graph.facebook.com/me?fields=id,name,email&access_token={access_token}"
-        response = requests.get(url)
+        url = f"{self.GRAPH_URL}/me"
+        params = {'fields': 'id,name,email', 'access_token': access_token}
+        response = await self.profile_cache.get(
+            access_token,
+            lambda conditional: self.http.get(url, params=params, headers=conditional, hedge=True, rate_limiter=self.rate_limiter)
+        )
         if response.status_code != 200:
             raise ValueError(f"Failed to get user info: {response.text}")
         return response.json()
 
-    def logout(self, access_token):
+    async def logout(self, access_token):
         """
         Revokes the user's access token, effectively logging them out.
 
@@ -111,8 +153,9 @@ class FacebookManager:
         Raises:
             ValueError: If the logout request fails.
         """
-        url = f"https://graph.facebook.com/me/permissions?access_token={access_token}"
-        response = requests.delete(url)
+        url = f"{self.GRAPH_URL}/me/permissions"
+        self.profile_cache.invalidate(access_token)
+        response = await self.http.delete(url, params={'access_token': access_token}, rate_limiter=self.rate_limiter)
         if response.status_code != 200:
             raise ValueError(f"Failed to log out: {response.text}")
 
@@ -1,63 +1,97 @@
-import requests
+from urllib.parse import urlencode
+
+from authy_package.social.http import resilient_http_client
+from authy_package.social.profile_cache import ProfileCache
+from authy_package.utils.resilience import RateLimiter, shared_rate_limiter
 
 class GitHubManager:
-    def __init__(self, client_id, client_secret, redirect_uri):
+    AUTHORIZE_URL = "https://github.com/login/oauth/authorize"
+    TOKEN_URL = "https://github.com/login/oauth/access_token"
+    USER_URL = "https://api.github.com/user"
+
+    def __init__(self, client_id, client_secret, redirect_uri, http_client=None, rate_limiter: RateLimiter = None,
+                 profile_cache: ProfileCache = None):
         """
         Initializes the GitHubManager with client ID, client secret, and redirect URI.
 
         :param client_id: The client ID of the GitHub OAuth application.
         :param client_secret: The client secret of the GitHub OAuth application.
         :param redirect_uri: The URI to which the user will be redirected after authorization.
+        :param http_client: An httpx.AsyncClient to use instead of the shared pooled client, or a
+            ResilientHTTPClient to change the breaker, deadline, retry and hedging policies.
+        :param rate_limiter: Paces the calls of this OAuth app; defaults to the limiter shared by every
+            manager of the app, which follows GitHub's X-RateLimit headers.
+        :param profile_cache: Caches profiles per access token and revalidates them with their ETag.
         """
         self.client_id = client_id
         self.client_secret = client_secret
         self.redirect_uri = redirect_uri
+        self._http = resilient_http_client(http_client)
+        self.rate_limiter = rate_limiter or shared_rate_limiter(f"github:{client_id}")
+        self.profile_cache = profile_cache or ProfileCache()
 
-    def get_authorization_url(self):
+    @property
+    def http(self):
+        return self._http
+
+    def get_authorization_url(self, state: str = None, **params):
         """
         Constructs the authorization URL for GitHub's OAuth flow.
 
         This method generates the URL that the user needs to visit to authorize the application.
 
+        :param state: An opaque value echoed back to the redirect URI (CSRF protection), e.g. from OAuthStateManager.
+        :param params: Further query parameters, e.g. `code_challenge` and `code_challenge_method` for PKCE.
         :return: The URL for the user to authorize the application.
         """
-        url = "https://github.com/login/oauth/authorize"
-        params = {
+        url = self.AUTHORIZE_URL
+        query = {
             'client_id': self.client_id,
             'redirect_uri': self.redirect_uri,
             'scope': 'user:email,user:public_profile'
         }
-        return url + "?" + requests.utils.urlencode(params)
+        if state:
+            query['state'] = state
+        query.update(params)
+        return url + "?" + urlencode(query)
 
-    def get_access_token(self, code):
+    async def get_access_token(self, code, code_verifier: str = None):
         """
         Exchanges the authorization code for an access token.
 
         This method sends a request to GitHub to exchange the provided authorization code for an access token.
 
         :param code: The authorization code obtained from the user.
+        :param code_verifier: The PKCE code verifier, if the authorization request sent a code challenge.
         :return: A JSON object containing the access token and other relevant information.
         """
-        url = "https://github.com/login/oauth/access_token"
+        url = self.TOKEN_URL
         params = {
             'client_id': self.client_id,
             'client_secret': self.client_secret,
             'code': code,
             'redirect_uri': self.redirect_uri
         }
-        response = requests.post(url, data=params, headers={'Accept': 'application/json'})
+        if code_verifier:
+            params['code_verifier'] = code_verifier
+        response = await self.http.post(url, data=params, headers={'Accept': 'application/json'}, rate_limiter=self.rate_limiter)
         return response.json()
 
-    def get_user_info(self, access_token):
+    async def get_user_info(self, access_token):
         """
         Retrieves user information using the access token.
 
         This method sends a request to the GitHub API to get details about the authenticated user.
+        Profiles are cached per token; once stale they are revalidated with a conditional request,
+        whose 304 answer does not count against the rate limit.
 
         :param access_token: The access token obtained from the OAuth flow.
         :return: A JSON object containing user information.
         """
-        url = "https://api.github.com/user"
+        url = self.USER_URL
         headers = {'Authorization': f'token {access_token}'}
-        response = requests.get(url, headers=headers)
+        response = await self.profile_cache.get(
+            access_token,
+            lambda conditional: self.http.get(url, headers={**headers, **conditional}, hedge=True, rate_limiter=self.rate_limiter)
+        )
         return response.json()
@@ -1,102 +1,166 @@
-import requests
-from google_auth_oauthlib.flow import InstalledAppFlow
 import datetime
+import json
 
+from google.oauth2.credentials import Credentials
 
-class GoogleManager:
-    def __init__(self, client_secrets_file, redirect_uri, scopes):
+from authy_package.social.oidc import OIDCProvider
+from authy_package.social.profile_cache import ProfileCache
+
+
+def load_client_config(client_secrets_file: str) -> dict:
+    """
+    Reads a client secrets JSON file as downloaded from the Google Cloud console.
+
+    :param client_secrets_file: Path to the client secrets JSON file.
+    :return: The parsed configuration, with a "web" or "installed" section.
+    """
+    with open(client_secrets_file) as file:
+        config = json.load(file)
+    if "web" not in config and "installed" not in config:
+        raise ValueError("Client secrets must contain a 'web' or 'installed' section.")
+    return config
+
+
+class GoogleManager(OIDCProvider):
+    """
+    Google sign-in on top of the generic OIDC client: endpoints and signing keys come from Google's
+    discovery document, and tokens are returned as google-auth Credentials.
+    """
+    DISCOVERY_URL = "https://accounts.google.com/.well-known/openid-configuration"
+    AUTH_URI = "https://accounts.google.com/o/oauth2/auth"
+    TOKEN_URI = "https://oauth2.googleapis.com/token"
+    USER_INFO_URL = "https://www.googleapis.com/oauth2/v2/userinfo"
+    ISSUERS = ("accounts.google.com",)
+
+    def __init__(self, client_secrets_file=None, redirect_uri=None, scopes=None, client_config: dict = None, http_client=None,
+                 profile_cache: ProfileCache = None):
         """
         Initializes the GoogleManager with client secrets, redirect URI, and OAuth scopes.
 
+        The client configuration is read once here; no call afterwards touches the disk.
+
         :param client_secrets_file: Path to the client secrets JSON file.
         :param redirect_uri: The URI to which the user will be redirected after authorization.
         :param scopes: A list of scopes that the application requests access to.
+        :param client_config: The parsed client secrets, instead of `client_secrets_file`.
+        :param http_client: An httpx.AsyncClient to use instead of the shared pooled client, or a
+            ResilientHTTPClient to change the breaker, deadline, retry and hedging policies.
+        :param profile_cache: Caches profiles per access token (revalidated with their ETag when Google sends one).
         """
+        if client_config is None:
+            if client_secrets_file is None:
+                raise ValueError("Either client_secrets_file or client_config is required.")
+            client_config = load_client_config(client_secrets_file)
         self.client_secrets_file = client_secrets_file
-        self.redirect_uri = redirect_uri
-        self.scopes = scopes
+        self.client_config = client_config
+        section = client_config.get("web") or client_config.get("installed")
+        self.auth_uri = section.get("auth_uri", self.AUTH_URI)
+        self.token_uri = section.get("token_uri", self.TOKEN_URI)
+        super().__init__(
+            "google", section["client_id"], section["client_secret"], redirect_uri=redirect_uri, scopes=scopes,
+            config={'authorization_endpoint': self.auth_uri, 'token_endpoint': self.token_uri, 'userinfo_endpoint': self.USER_INFO_URL},
+            http_client=http_client, profile_cache=profile_cache
+        )
+
+    async def get_authorization_url(self, state: str = None, access_type: str = "offline", prompt: str = None, **params):
+        """
+        Builds the URL of Google's consent page for the web-server flow.
 
-    def authorize(self):
+        :param state: An opaque value echoed back to the redirect URI (CSRF protection).
+        :param access_type: "offline" to receive a refresh token.
+        :param prompt: Optional prompt, e.g. "consent" to force a new refresh token.
+        :param params: Further parameters, see `OIDCProvider.get_authorization_url`.
+        :return: The authorization URL.
+        """
+        return await super().get_authorization_url(state=state, access_type=access_type, prompt=prompt, **params)
+
+    async def authorize(self):
         """
         Initiates the OAuth authorization flow and retrieves the authorization code.
 
-        This method prints the authorization URL and prompts the user to visit it to authorize the application.
-        
+        This is the interactive desktop flow: it prints the authorization URL and reads the code from
+        stdin. Web applications redirect to `get_authorization_url()` instead.
+
         :return: The authorization code obtained after user authorization.
         """
-        flow = InstalledAppFlow.from_client_secrets_file(
-            self.client_secrets_file, scopes=self.scopes)
-        authorization_url, _ = flow.authorization_url(redirect_uri=self.redirect_uri)
-        print(f"Please visit this URL to authorize the application: {authorization_url}")
+        print(f"Please visit this URL to authorize the application: {await self.get_authorization_url()}")
         code = input("Enter the code from the authorization page: ")
         return code
 
-    def exchange_code_for_tokens(self, code):
+    @staticmethod
+    def dump_credentials(credentials: Credentials) -> dict:
         """
-        Exchanges the authorization code for access and refresh tokens.
+        Returns the token fields of credentials as a token-endpoint style response (without the client
+        secret), e.g. to hand a refresh result to another worker; `load_credentials` reverses it.
+        """
+        expires_in = None
+        if credentials.expiry:
+            expires_in = max(int((credentials.expiry - datetime.datetime.utcnow()).total_seconds()), 0)
+        return {
+            'access_token': credentials.token,
+            'refresh_token': credentials.refresh_token,
+            'id_token': credentials.id_token,
+            'scope': " ".join(credentials.scopes or []),
+            'expires_in': expires_in,
+        }
+
+    def load_credentials(self, token_response: dict) -> Credentials:
+        """Builds credentials for this client from a token-endpoint style response."""
+        return self._credentials(token_response)
+
+    def _credentials(self, token_response: dict, refresh_token: str = None) -> Credentials:
+        credentials = Credentials(
+            token=token_response['access_token'],
+            refresh_token=token_response.get('refresh_token') or refresh_token,
+            id_token=token_response.get('id_token'),
+            token_uri=self.token_uri,
+            client_id=self.client_id,
+            client_secret=self.client_secret,
+            scopes=token_response['scope'].split() if token_response.get('scope') else self.scopes,
+        )
+        if token_response.get('expires_in') is not None:
+            # google-auth compares expiries as naive UTC datetimes
+            credentials.expiry = datetime.datetime.utcnow() + datetime.timedelta(seconds=int(token_response['expires_in']))
+        return credentials
+
+    async def exchange_code_for_tokens(self, code, code_verifier: str = None):
+        """
+        Exchanges the authorization code for access and refresh tokens at Google's token endpoint.
 
         :param code: The authorization code obtained from the user.
+        :param code_verifier: The PKCE code verifier, if the authorization request sent a code challenge.
         :return: Credentials containing the access and refresh tokens.
         """
-        flow = InstalledAppFlow.from_client_secrets_file(
-            self.client_secrets_file, scopes=self.scopes)
-        credentials = flow.exchange(code=code)
-        return credentials
+        token_response = await self.exchange_code(code, code_verifier=code_verifier)
+        return self._credentials(token_response)
 
-    def refresh_access_token(self, credentials):
+    async def refresh_access_token(self, credentials):
         """
         Refreshes the access token using the refresh token.
 
-        This method checks if the credentials are expired and attempts to refresh the access token.
-        
-        :param credentials: The credentials containing the refresh token.
-        :return: Updated credentials with the new access token, or None if refreshing failed.
+        :param credentials: The credentials containing the refresh token, or the refresh token itself.
+            Credentials that have not expired yet are returned unchanged.
+        :return: Updated credentials with the new access token.
         """
-        if credentials.expired and credentials.refresh_token:
-            refresh_token = credentials.refresh_token
-            url = "https://www.googleapis.com/oauth2/v4/token"
-            headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-            data = {
-                'client_id': credentials.client_id,
-                'client_secret': credentials.client_secret,
-                'refresh_token': refresh_token,
-                'grant_type': 'refresh_token'
-            }
-
-            try:
-                response = requests.post(url, headers=headers, data=data)
-                response.raise_for_status()  # Raise an HTTPError if the response was unsuccessful
-            except requests.exceptions.RequestException as e:
-                print(f"Error refreshing access token: {e}")
-                return None
-
-            response_data = response.json()
-
-            # Ensure the response contains the required tokens
-            if 'access_token' in response_data and 'expires_in' in response_data:
-                updated_credentials = credentials.with_subject(response_data.get('id_token'))
-                updated_credentials.token = response_data['access_token']
-
-                # Set the expiration time using datetime
-                updated_credentials.expiry = datetime.datetime.utcnow() + datetime.timedelta(seconds=response_data['expires_in'])
-                return updated_credentials
-            else:
-                print("Error: Token refresh failed, missing access_token or expires_in.")
-                return None
+        if isinstance(credentials, str):
+            refresh_token = credentials
+        elif not credentials.expired:
+            return credentials
         else:
-            print("Credentials are not expired or refresh token is not available.")
-            return None
-    
-    def get_user_info(self, credentials):
+            refresh_token = credentials.refresh_token
+        if not refresh_token:
+            raise ValueError("No refresh token available.")
+
+        token_response = await super().refresh_access_token(refresh_token)
+        return self._credentials(token_response, refresh_token=refresh_token)
+
+    async def get_user_info(self, credentials):
         """
         Retrieves user information using the access token.
 
         This method sends a request to the Google User Info API to get details about the user.
 
-        :param credentials: The credentials containing the access token.
+        :param credentials: The credentials containing the access token, or the access token itself.
         :return: A JSON object containing user information.
         """
-        url = "https://www.googleapis.com/oauth2/v2/userinfo"
-        headers = {'Authorization': f'Bearer {credentials.token}'}
-        response = requests.get(url, headers=headers)
-        return response.json()
+        return await super().get_user_info(credentials if isinstance(credentials, str) else credentials.token)
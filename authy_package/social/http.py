@@ -0,0 +1,201 @@
+import asyncio
+
+import httpx
+
+from authy_package.utils.resilience import CircuitBreaker, ProviderUnavailableError, RateLimiter, RetryBudget, backoff
+
+# Connect/read timeouts for provider calls; a hung provider must not hold a login forever
+DEFAULT_TIMEOUT = httpx.Timeout(10.0, connect=5.0)
+DEFAULT_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20)
+
+_shared_client = None
+
+
+def shared_http_client() -> httpx.AsyncClient:
+    """
+    Returns the process-wide pooled HTTP client used by the provider managers.
+
+    Reusing one client keeps TCP/TLS connections to the providers alive between logins, instead of
+    paying a new handshake on every call. Managers accept their own `http_client` when a different
+    configuration (proxies, timeouts, transport) is needed.
+    """
+    global _shared_client
+    if _shared_client is None or _shared_client.is_closed:
+        _shared_client = httpx.AsyncClient(timeout=DEFAULT_TIMEOUT, limits=DEFAULT_LIMITS)
+    return _shared_client
+
+
+async def close_shared_http_client():
+    """Closes the shared client's connections, e.g. on application shutdown."""
+    global _shared_client
+    if _shared_client is not None:
+        await _shared_client.aclose()
+        _shared_client = None
+
+
+class ResilientHTTPClient:
+    """
+    Wraps an httpx.AsyncClient with the failure handling provider calls need.
+
+    - Circuit breakers: one per endpoint (method, host and path). Once the share of failures (transport
+      errors, timeouts and 5xx responses) among its recent calls reaches `failure_rate`, calls to
+      that endpoint fail fast with ProviderUnavailableError until a probe succeeds again.
+    - Deadlines: every call, including its retries, completes within `deadline` seconds or raises
+      ProviderUnavailableError, however slowly the provider answers.
+    - Retries: idempotent calls are retried up to `max_attempts` in total with jittered exponential
+      backoff, as long as the shared retry budget allows. Other calls (e.g. exchanging a single-use
+      authorization code) are never retried.
+    - Hedging: GETs made with `hedge=True` send a second request if the first has not answered after
+      `hedge_after` seconds and use whichever succeeds first. Hedges draw on the retry budget.
+    - Rate limits: a call made with a `rate_limiter` takes a token from it before every attempt (queueing
+      or being shed with RateLimitedError) and feeds the response's rate-limit headers back into it.
+
+    A failed response that is not retried is returned to the caller, so managers keep reporting
+    provider errors the way they do without the wrapper.
+    """
+    IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+    def __init__(self, client: httpx.AsyncClient = None, deadline: float = 5.0, max_attempts: int = 3, failure_rate: float = 0.5,
+                 reset_timeout: float = 30.0, hedge_after: float = None, retry_budget: RetryBudget = None,
+                 backoff_base: float = 0.05, backoff_cap: float = 1.0):
+        """
+        :param client: The client to send requests with; defaults to the shared pooled client.
+        :param deadline: Seconds a call may take including retries, or None for no deadline.
+        :param max_attempts: Attempts per idempotent call, including the first.
+        :param failure_rate: Share of failed recent calls that opens an endpoint's breaker, or None to disable breakers.
+        :param reset_timeout: Seconds an open breaker refuses calls before letting a probe through.
+        :param hedge_after: Seconds after which a hedged GET sends its second request, or None to disable hedging.
+        :param retry_budget: The budget retries and hedges draw on; defaults to a budget of 20% of requests.
+        :param backoff_base: Base of the exponential backoff between retries, in seconds.
+        :param backoff_cap: Upper bound of a single backoff delay, in seconds.
+        """
+        self._client = client
+        self.deadline = deadline
+        self.max_attempts = max_attempts
+        self.failure_rate = failure_rate
+        self.reset_timeout = reset_timeout
+        self.hedge_after = hedge_after
+        self.retry_budget = retry_budget or RetryBudget()
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.breakers = {}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        return self._client or shared_http_client()
+
+    def breaker(self, method: str, url) -> CircuitBreaker:
+        """Returns the breaker of the endpoint a request goes to, or None when breakers are disabled."""
+        if self.failure_rate is None:
+            return None
+        url = httpx.URL(url)
+        endpoint = f"{method} {url.host}{url.path}"
+        breaker = self.breakers.get(endpoint)
+        if breaker is None:
+            breaker = self.breakers[endpoint] = CircuitBreaker(self.failure_rate, reset_timeout=self.reset_timeout)
+        return breaker
+
+    @staticmethod
+    def _failed(response: httpx.Response) -> bool:
+        return response.status_code == 429 or response.status_code >= 500
+
+    async def request(self, method: str, url, *, idempotent: bool = None, hedge: bool = False, rate_limiter: RateLimiter = None,
+                      **kwargs) -> httpx.Response:
+        """
+        Sends a request with the policies above.
+
+        :param method: The HTTP method.
+        :param url: The request URL.
+        :param idempotent: Whether the call may be retried; defaults to True for GET, HEAD, OPTIONS, PUT and DELETE.
+        :param hedge: Hedge the request (idempotent calls only, and only when `hedge_after` is set).
+        :param rate_limiter: The rate limiter of the provider app the call counts against.
+        :param kwargs: Passed on to `httpx.AsyncClient.request`.
+        :return: The response.
+        """
+        method = method.upper()
+        if idempotent is None:
+            idempotent = method in self.IDEMPOTENT_METHODS
+        breaker = self.breaker(method, url)
+        if breaker and not breaker.allow():
+            raise ProviderUnavailableError(f"Circuit open for {method} {url}")
+
+        self.retry_budget.deposit()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline if self.deadline is not None else None
+        attempt = 0
+        while True:
+            error = response = None
+            if rate_limiter:
+                await rate_limiter.acquire(deadline - loop.time() if deadline is not None else None)
+            try:
+                if hedge and idempotent and self.hedge_after is not None:
+                    send = self._hedged(method, url, kwargs, rate_limiter)
+                else:
+                    send = self._send(method, url, kwargs)
+                response = await asyncio.wait_for(send, deadline - loop.time() if deadline is not None else None)
+            except (httpx.TransportError, asyncio.TimeoutError) as e:
+                error = e
+            if rate_limiter and response is not None:
+                rate_limiter.update(response.headers, response.status_code)
+
+            if response is not None and not self._failed(response):
+                if breaker:
+                    breaker.record_success()
+                return response
+            if breaker and (response is None or response.status_code != 429):
+                # Throttling is the rate limiter's business, not a sign the endpoint is down
+                breaker.record_failure()
+
+            attempt += 1
+            delay = backoff(attempt - 1, self.backoff_base, self.backoff_cap)
+            retry = (
+                idempotent and attempt < self.max_attempts
+                and (deadline is None or loop.time() + delay < deadline)
+                and (breaker is None or breaker.allow())
+                and self.retry_budget.withdraw()
+            )
+            if not retry:
+                if response is not None:
+                    return response
+                raise ProviderUnavailableError(f"{method} {url} failed: {error!r}") from error
+            await asyncio.sleep(delay)
+
+    async def _send(self, method: str, url, kwargs: dict) -> httpx.Response:
+        return await self.client.request(method, url, **kwargs)
+
+    async def _hedged(self, method: str, url, kwargs: dict, rate_limiter: RateLimiter = None) -> httpx.Response:
+        first = asyncio.ensure_future(self._send(method, url, kwargs))
+        tasks = {first}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_after)
+            # A hedge is only worth sending while the rate limit has room for it
+            if not done and (rate_limiter is None or rate_limiter.try_acquire()) and self.retry_budget.withdraw():
+                tasks.add(asyncio.ensure_future(self._send(method, url, kwargs)))
+            last = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    last = task
+                    if task.exception() is None and not self._failed(task.result()):
+                        return task.result()
+            # Neither request succeeded; report the outcome of the last one
+            return last.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def get(self, url, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    async def delete(self, url, **kwargs) -> httpx.Response:
+        return await self.request("DELETE", url, **kwargs)
+
+
+def resilient_http_client(http_client=None) -> ResilientHTTPClient:
+    """Wraps `http_client` (or the shared client) with the default policies, unless it is wrapped already."""
+    if isinstance(http_client, ResilientHTTPClient):
+        return http_client
+    return ResilientHTTPClient(http_client)
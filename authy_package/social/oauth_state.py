@@ -0,0 +1,131 @@
+import base64
+import hashlib
+import hmac
+import json
+import secrets
+import time
+
+from authy_package.cache.abstract_cache import AbstractCache
+
+# Random bytes identifying one authorization flow; 16 bytes encode to 22 url-safe characters
+NONCE_BYTES = 16
+
+
+def _encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+class OAuthStateManager:
+    """
+    Issues and validates the `state` parameter of OAuth authorization flows without storing anything.
+
+    A state is `<payload>.<signature>`: the payload holds the provider, a random flow nonce, the
+    redirect target and an expiry; the signature is an HMAC-SHA256 over it (and over an optional
+    `binding`, e.g. the browser session, which is never sent to the provider). The PKCE code verifier
+    and the OIDC nonce are derived from the flow nonce with the same secret, so the callback recomputes
+    them from the state alone instead of looking them up.
+
+    Without a cache, validation costs no storage round trip; a state can then be replayed until it
+    expires, which the single-use authorization code it comes with usually makes harmless. With a
+    cache, each state is additionally accepted only once: its nonce is claimed with the cache's
+    `claim_once` until the state expires.
+
+    Several secrets may be given to rotate them: states are signed with the first and accepted with any.
+    """
+
+    def __init__(self, secret, ttl: int = 600, cache=None):
+        """
+        :param secret: The signing secret (str or bytes), or a list of them with the current one first.
+        :param ttl: Seconds a state stays valid, i.e. how long a user may take to sign in at the provider.
+        :param cache: An optional cache backend (any AbstractCache) that makes every state single-use.
+        """
+        keys = secret if isinstance(secret, (list, tuple)) else [secret]
+        if not keys or not all(keys):
+            raise ValueError("A state signing secret is required.")
+        self.secrets = [key.encode("utf-8") if isinstance(key, str) else key for key in keys]
+        self.ttl = ttl
+        if isinstance(cache, AbstractCache) and type(cache).claim_once is AbstractCache.claim_once:
+            raise ValueError(f"{type(cache).__name__} does not implement claim_once, which single-use states require.")
+        self.cache = cache
+
+    @staticmethod
+    def _sign(secret: bytes, payload: str, binding: str = None) -> bytes:
+        message = b"authy-state\x00" + payload.encode("utf-8") + b"\x00" + (binding or "").encode("utf-8")
+        return hmac.new(secret, message, hashlib.sha256).digest()
+
+    @staticmethod
+    def _derive(secret: bytes, purpose: bytes, nonce: str) -> str:
+        return _encode(hmac.new(secret, purpose + b"\x00" + nonce.encode("ascii"), hashlib.sha256).digest())
+
+    def _flow(self, secret: bytes, claims: dict) -> dict:
+        return {
+            "provider": claims["p"],
+            "redirect_to": claims.get("r"),
+            "expires_at": claims["e"],
+            "nonce": self._derive(secret, b"nonce", claims["n"]),
+            # A SHA-256 digest encodes to a 43 character verifier, the minimum length RFC 7636 allows
+            "code_verifier": self._derive(secret, b"pkce", claims["n"]) if claims.get("k") else None,
+        }
+
+    def issue(self, provider: str, redirect_to: str = None, binding: str = None, pkce: bool = True) -> dict:
+        """
+        Starts an authorization flow.
+
+        :param provider: The provider the flow is for; the state is only accepted for it.
+        :param redirect_to: Where the application sends the user after the callback.
+        :param binding: A value the callback must present again, e.g. a session ID, tying the flow to
+            the browser that started it.
+        :param pkce: Whether to derive a PKCE code verifier for the flow.
+        :return: A dictionary with the "state", the OIDC "nonce", and with PKCE the "code_challenge" and
+            "code_challenge_method" to send with the authorization request.
+        """
+        secret = self.secrets[0]
+        claims = {"p": provider, "n": _encode(secrets.token_bytes(NONCE_BYTES)), "e": int(time.time()) + self.ttl}
+        if redirect_to:
+            claims["r"] = redirect_to
+        if pkce:
+            claims["k"] = 1
+        payload = _encode(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+        flow = self._flow(secret, claims)
+        grant = {"state": f"{payload}.{_encode(self._sign(secret, payload, binding))}", "nonce": flow["nonce"]}
+        if pkce:
+            grant["code_challenge"] = _encode(hashlib.sha256(flow["code_verifier"].encode("ascii")).digest())
+            grant["code_challenge_method"] = "S256"
+        return grant
+
+    async def validate(self, state: str, provider: str = None, binding: str = None) -> dict:
+        """
+        Validates the state received at the callback.
+
+        :param state: The state parameter of the callback.
+        :param provider: The provider the callback is for.
+        :param binding: The value passed to `issue`, if any.
+        :return: A dictionary with the "provider", "redirect_to", "expires_at", the OIDC "nonce" and the
+            PKCE "code_verifier" (None without PKCE).
+        :raises ValueError: If the state is malformed, forged, expired, meant for another provider or
+            (with a cache) already used.
+        """
+        payload, _, signature = (state or "").partition(".")
+        try:
+            signature = _decode(signature)
+        except ValueError:
+            raise ValueError("Invalid state.") from None
+        secret = next((key for key in self.secrets if hmac.compare_digest(self._sign(key, payload, binding), signature)), None)
+        if secret is None:
+            raise ValueError("Invalid state.")
+
+        claims = json.loads(_decode(payload))
+        remaining = claims["e"] - time.time()
+        if remaining <= 0:
+            raise ValueError("State has expired.")
+        if provider is not None and claims["p"] != provider:
+            raise ValueError("State was issued for another provider.")
+
+        if self.cache is not None:
+            if not await self.cache.claim_once(f"oauth-state:{claims['n']}", remaining):
+                raise ValueError("State has already been used.")
+        return self._flow(secret, claims)
@@ -0,0 +1,305 @@
+import re
+import time
+from urllib.parse import urlencode
+
+import jwt
+
+from authy_package.social.http import resilient_http_client
+from authy_package.social.profile_cache import ProfileCache
+from authy_package.utils.resilience import ProviderUnavailableError, RateLimiter
+from authy_package.utils.single_flight import SingleFlight
+
+# Signature algorithms accepted on ID tokens; symmetric and "none" algorithms are never accepted
+ASYMMETRIC_ALGORITHMS = ("RS256", "RS384", "RS512", "PS256", "PS384", "PS512", "ES256", "ES384", "ES512", "EdDSA")
+
+_MAX_AGE = re.compile(r"max-age=(\d+)")
+
+# url -> (document, fetched_at, expires_at), shared by every provider in the process
+_documents = {}
+_document_fetches = SingleFlight()
+
+
+async def fetch_document(http, url: str, ttl: float, force: bool = False) -> dict:
+    """
+    Returns a provider's JSON document (discovery metadata or JWKS), cached process-wide per URL.
+
+    A document is kept for the response's `Cache-Control: max-age`, or `ttl` seconds when the provider
+    sends none. Concurrent fetches of the same URL share one request. While the provider cannot be
+    reached, an expired copy is served instead of failing the login.
+
+    :param http: The ResilientHTTPClient to fetch with.
+    :param url: The document URL.
+    :param ttl: Seconds a document without caching headers is kept.
+    :param force: Fetch again even if the cached copy has not expired.
+    :return: The parsed document.
+    """
+    cached = _documents.get(url)
+    if cached and not force and time.monotonic() < cached[2]:
+        return cached[0]
+
+    async def load():
+        try:
+            response = await http.get(url, hedge=True)
+        except ProviderUnavailableError:
+            if cached:
+                return cached[0]
+            raise
+        if response.status_code != 200:
+            if cached and response.status_code >= 500:
+                return cached[0]
+            raise ValueError(f"Failed to fetch {url}: {response.status_code}, {response.text}")
+        document = response.json()
+        max_age = _MAX_AGE.search(response.headers.get("cache-control", ""))
+        now = time.monotonic()
+        _documents[url] = (document, now, now + (int(max_age.group(1)) if max_age else ttl))
+        return document
+
+    return await _document_fetches.do(url, load)
+
+
+def _document_age(url: str) -> float:
+    cached = _documents.get(url)
+    return time.monotonic() - cached[1] if cached else float("inf")
+
+
+class OIDCProvider:
+    """
+    A generic OpenID Connect / OAuth 2.0 client: authorization URL, code exchange, refresh, userinfo,
+    ID token verification and revocation against any standards-compliant provider.
+
+    Endpoints come from the provider's discovery document (`.well-known/openid-configuration`), from
+    a static `config`, or both: static values win, so a provider whose endpoints are all configured
+    never fetches its discovery document. Discovery documents and JWKS are cached process-wide (see
+    `fetch_document`); a token signed with an unknown key refetches the JWKS once, at most every
+    `jwks_refresh_interval` seconds, to pick up rotated keys. Requests go through the shared pooled
+    client with the ResilientHTTPClient policies, and userinfo responses through a ProfileCache.
+
+    Usage:
+        okta = OIDCProvider("okta", client_id, client_secret, redirect_uri="https://app/callback",
+                            discovery_url="https://example.okta.com/.well-known/openid-configuration")
+        social_auth = SocialAuthManager(db, cache, oidc_providers=[okta])
+    """
+    DISCOVERY_URL = None
+    CONFIG = {}
+    # Issuers accepted on ID tokens besides the one in the metadata
+    ISSUERS = ()
+    SCOPES = ("openid", "email", "profile")
+
+    def __init__(self, name: str, client_id: str, client_secret: str = None, redirect_uri: str = None, scopes=None,
+                 discovery_url: str = None, config: dict = None, http_client=None, rate_limiter: RateLimiter = None,
+                 profile_cache: ProfileCache = None, metadata_ttl: float = 3600, jwks_ttl: float = 3600,
+                 jwks_refresh_interval: float = 60, leeway: float = 60):
+        """
+        :param name: The provider name users are linked and tokens are stored under, e.g. "okta".
+        :param client_id: The OAuth client ID; also the expected ID token audience.
+        :param client_secret: The OAuth client secret, or None for public clients.
+        :param redirect_uri: The default redirect URI of the authorization and code exchange requests.
+        :param scopes: The scopes to request; defaults to `SCOPES`.
+        :param discovery_url: The provider's `.well-known/openid-configuration` URL; defaults to `DISCOVERY_URL`.
+        :param config: Provider metadata (e.g. "token_endpoint", "jwks_uri", "issuer") overriding the
+            discovered values; merged over `CONFIG`. Verifying ID tokens requires an "issuer".
+        :param http_client: An httpx.AsyncClient to use instead of the shared pooled client, or a
+            ResilientHTTPClient to change the breaker, deadline, retry and hedging policies.
+        :param rate_limiter: Paces the calls to the provider, or None to send them as they come.
+        :param profile_cache: Caches userinfo responses per access token.
+        :param metadata_ttl: Seconds a discovery document without caching headers is kept.
+        :param jwks_ttl: Seconds a JWKS without caching headers is kept.
+        :param jwks_refresh_interval: Minimum seconds between two refetches of the JWKS caused by an unknown key.
+        :param leeway: Seconds of clock skew tolerated when checking ID token timestamps.
+        """
+        self.name = name
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.redirect_uri = redirect_uri
+        self.scopes = list(scopes or self.SCOPES)
+        self.discovery_url = discovery_url or self.DISCOVERY_URL
+        self.config = {**self.CONFIG, **(config or {})}
+        if self.discovery_url is None and "token_endpoint" not in self.config:
+            raise ValueError("Either discovery_url or a config with a token_endpoint is required.")
+        self._http = resilient_http_client(http_client)
+        self.rate_limiter = rate_limiter
+        self.profile_cache = profile_cache or ProfileCache()
+        self.metadata_ttl = metadata_ttl
+        self.jwks_ttl = jwks_ttl
+        self.jwks_refresh_interval = jwks_refresh_interval
+        self.leeway = leeway
+
+    @property
+    def http(self):
+        return self._http
+
+    async def metadata(self) -> dict:
+        """Returns the provider metadata: the discovery document with the static config merged over it."""
+        if self.discovery_url is None:
+            return self.config
+        document = await fetch_document(self.http, self.discovery_url, self.metadata_ttl)
+        return {**document, **self.config}
+
+    async def endpoint(self, name: str) -> str:
+        """
+        Returns a provider endpoint, e.g. "token_endpoint", without fetching the discovery document
+        when the static config has it.
+        """
+        url = self.config.get(name) or (await self.metadata()).get(name)
+        if not url:
+            raise ValueError(f"The {self.name} provider has no {name}.")
+        return url
+
+    async def jwks(self, force: bool = False) -> dict:
+        """Returns the provider's JSON Web Key Set."""
+        return await fetch_document(self.http, await self.endpoint("jwks_uri"), self.jwks_ttl, force=force)
+
+    def client_credentials(self) -> dict:
+        """Returns the client authentication sent with token and revocation requests."""
+        credentials = {'client_id': self.client_id}
+        if self.client_secret:
+            credentials['client_secret'] = self.client_secret
+        return credentials
+
+    async def get_authorization_url(self, state: str = None, nonce: str = None, redirect_uri: str = None, scopes=None, **params) -> str:
+        """
+        Builds the URL of the provider's authorization page for the authorization code flow.
+
+        :param state: An opaque value echoed back to the redirect URI (CSRF protection).
+        :param nonce: A value the provider embeds in the ID token, checked by `verify_id_token`.
+        :param redirect_uri: The redirect URI; defaults to the provider's.
+        :param scopes: The scopes to request; defaults to the provider's.
+        :param params: Additional query parameters, e.g. `prompt` or `code_challenge`.
+        :return: The authorization URL.
+        """
+        query = {
+            'client_id': self.client_id,
+            'redirect_uri': redirect_uri or self.redirect_uri,
+            'response_type': 'code',
+            'scope': " ".join(scopes or self.scopes),
+        }
+        if state:
+            query['state'] = state
+        if nonce:
+            query['nonce'] = nonce
+        query.update({key: value for key, value in params.items() if value is not None})
+        return f"{await self.endpoint('authorization_endpoint')}?{urlencode(query)}"
+
+    async def token_request(self, data: dict) -> dict:
+        """
+        Posts a grant to the token endpoint and returns the token response.
+
+        :raises ValueError: If the provider rejects the grant.
+        """
+        # An authorization code is single-use, so only refresh grants are safe to retry
+        response = await self.http.post(
+            await self.endpoint('token_endpoint'), data={**self.client_credentials(), **data},
+            headers={'Accept': 'application/json'}, idempotent=data['grant_type'] == 'refresh_token',
+            rate_limiter=self.rate_limiter
+        )
+        if response.status_code != 200:
+            raise ValueError(f"Token request failed: {response.status_code}, {response.text}")
+        return response.json()
+
+    async def exchange_code(self, code: str, redirect_uri: str = None, code_verifier: str = None) -> dict:
+        """
+        Exchanges an authorization code for tokens.
+
+        :param code: The authorization code received at the redirect URI.
+        :param redirect_uri: The redirect URI the authorization request used; defaults to the provider's.
+        :param code_verifier: The PKCE code verifier, if the authorization request sent a code challenge.
+        :return: The token response, with "access_token" and usually "id_token", "refresh_token" and "expires_in".
+        """
+        data = {'code': code, 'grant_type': 'authorization_code'}
+        if redirect_uri or self.redirect_uri:
+            data['redirect_uri'] = redirect_uri or self.redirect_uri
+        if code_verifier:
+            data['code_verifier'] = code_verifier
+        return await self.token_request(data)
+
+    async def refresh_access_token(self, refresh_token: str) -> dict:
+        """
+        Exchanges a refresh token for a new access token.
+
+        :param refresh_token: The refresh token.
+        :return: The token response; "refresh_token" is only present if the provider rotated it.
+        """
+        if not refresh_token:
+            raise ValueError("No refresh token available.")
+        return await self.token_request({'refresh_token': refresh_token, 'grant_type': 'refresh_token'})
+
+    async def get_user_info(self, access_token: str) -> dict:
+        """
+        Retrieves the user's claims from the userinfo endpoint.
+
+        :param access_token: The access token.
+        :return: The userinfo claims.
+        """
+        url = await self.endpoint('userinfo_endpoint')
+        headers = {'Authorization': f'Bearer {access_token}', 'Accept': 'application/json'}
+        response = await self.profile_cache.get(
+            access_token,
+            lambda conditional: self.http.get(url, headers={**headers, **conditional}, hedge=True, rate_limiter=self.rate_limiter)
+        )
+        if response.status_code != 200:
+            raise ValueError(f"Failed to get user info: {response.status_code}, {response.text}")
+        return response.json()
+
+    async def _signing_key(self, kid: str):
+        keys = (await self.jwks()).get("keys", [])
+        if kid is None and len(keys) == 1:
+            return keys[0]
+        key = next((key for key in keys if key.get("kid") == kid), None)
+        if key is None and _document_age(await self.endpoint("jwks_uri")) >= self.jwks_refresh_interval:
+            # The provider may have rotated its keys since the JWKS was cached
+            keys = (await self.jwks(force=True)).get("keys", [])
+            key = next((key for key in keys if key.get("kid") == kid), None)
+        return key
+
+    async def verify_id_token(self, id_token: str, nonce: str = None) -> dict:
+        """
+        Verifies an ID token's signature against the provider's JWKS and checks its issuer, audience,
+        expiry and nonce.
+
+        :param id_token: The ID token from the token response.
+        :param nonce: The nonce sent with the authorization request, if any.
+        :return: The verified claims.
+        :raises ValueError: If the token is invalid, or no issuer is known to check it against.
+        """
+        try:
+            header = jwt.get_unverified_header(id_token)
+        except jwt.PyJWTError as e:
+            raise ValueError(f"Invalid ID token: {e}") from e
+        metadata = await self.metadata()
+        if not metadata.get("issuer"):
+            # Without an issuer any token signed by a key in the JWKS would pass, e.g. one of a shared multi-tenant JWKS
+            raise ValueError(f"Cannot verify ID token: no issuer configured for {self.name}; add one to its config.")
+        allowed = [alg for alg in metadata.get("id_token_signing_alg_values_supported", ["RS256"]) if alg in ASYMMETRIC_ALGORITHMS]
+        if header.get("alg") not in allowed:
+            raise ValueError(f"Invalid ID token: unsupported algorithm {header.get('alg')}.")
+
+        key = await self._signing_key(header.get("kid"))
+        if key is None:
+            raise ValueError("Invalid ID token: unknown signing key.")
+        issuers = [metadata["issuer"], *self.ISSUERS]
+        try:
+            claims = jwt.decode(
+                id_token, jwt.PyJWK(key, algorithm=header["alg"]).key, algorithms=[header["alg"]],
+                audience=self.client_id, issuer=issuers, leeway=self.leeway, options={"require": ["exp", "iat", "sub"]}
+            )
+        except jwt.PyJWTError as e:
+            raise ValueError(f"Invalid ID token: {e}") from e
+        if nonce is not None and claims.get("nonce") != nonce:
+            raise ValueError("Invalid ID token: nonce mismatch.")
+        return claims
+
+    async def revoke(self, token: str, token_type_hint: str = None):
+        """
+        Revokes a token at the provider's revocation endpoint (RFC 7009).
+
+        :param token: The access or refresh token to revoke.
+        :param token_type_hint: "access_token" or "refresh_token".
+        :raises ValueError: If the provider rejects the revocation.
+        """
+        data = {**self.client_credentials(), 'token': token}
+        if token_type_hint:
+            data['token_type_hint'] = token_type_hint
+        response = await self.http.post(await self.endpoint('revocation_endpoint'), data=data, idempotent=True, rate_limiter=self.rate_limiter)
+        if response.status_code != 200:
+            raise ValueError(f"Failed to revoke token: {response.status_code}, {response.text}")
+        self.profile_cache.invalidate(token)
@@ -0,0 +1,89 @@
+import time
+from collections import OrderedDict
+
+import httpx
+
+from authy_package.utils.single_flight import SingleFlight
+from authy_package.utils.tokens import token_digest
+
+
+class ProfileCache:
+    """
+    Caches provider profile responses per access token, so repeated profile reads do not refetch
+    the full profile.
+
+    Entries are keyed by a digest of the access token, so the cache never holds usable tokens. A
+    cached profile is served without any request for `ttl` seconds. After that, an entry whose
+    response carried an ETag is kept for `stale_ttl` seconds and revalidated with `If-None-Match`:
+    a 304 (which GitHub does not count against the rate limit) renews it, anything else replaces it.
+    Concurrent reads for the same token share one request. Only 200 responses are cached.
+    """
+
+    def __init__(self, ttl: float = 60, stale_ttl: float = 3600, max_entries: int = 10000):
+        """
+        :param ttl: Seconds a profile is served without contacting the provider.
+        :param stale_ttl: Seconds an expired profile with an ETag is kept for revalidation.
+        :param max_entries: Maximum number of profiles kept; the least recently used are evicted first.
+        """
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        # token digest -> (content, etag, fetched_at)
+        self._entries = OrderedDict()
+        self._inflight = SingleFlight()
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+
+    @staticmethod
+    def _response(content: bytes, etag: str = None) -> httpx.Response:
+        headers = {"Content-Type": "application/json"}
+        if etag:
+            headers["ETag"] = etag
+        return httpx.Response(200, content=content, headers=headers)
+
+    async def get(self, access_token: str, fetch) -> httpx.Response:
+        """
+        Returns the profile response for an access token, from the cache or through `fetch`.
+
+        :param access_token: The access token the profile is read with.
+        :param fetch: A coroutine function taking extra request headers and returning the provider's httpx.Response.
+        :return: The provider's response, or a 200 response rebuilt from the cache.
+        """
+        key = token_digest(access_token)
+        entry = self._entries.get(key)
+        if entry and time.monotonic() - entry[2] < self.ttl:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._response(entry[0], entry[1])
+        return await self._inflight.do(key, lambda: self._fetch(key, entry, fetch))
+
+    async def _fetch(self, key: str, entry, fetch) -> httpx.Response:
+        etag = entry[1] if entry and time.monotonic() - entry[2] < self.stale_ttl else None
+        response = await fetch({"If-None-Match": etag} if etag else {})
+        if response.status_code == 304 and etag:
+            self.revalidations += 1
+            self._store(key, entry[0], etag)
+            return self._response(entry[0], etag)
+
+        self.misses += 1
+        if response.status_code == 200:
+            self._store(key, response.content, response.headers.get("etag"))
+        else:
+            self._entries.pop(key, None)
+        return response
+
+    def _store(self, key: str, content: bytes, etag: str = None):
+        self._entries[key] = (content, etag, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, access_token: str):
+        """Drops the profile of an access token, e.g. once the token is revoked."""
+        self._entries.pop(token_digest(access_token), None)
+
+    def hit_ratio(self) -> float:
+        """Share of profile reads answered without a full fetch (cache hits and 304 revalidations)."""
+        reads = self.hits + self.revalidations + self.misses
+        return (self.hits + self.revalidations) / reads if reads else 0.0
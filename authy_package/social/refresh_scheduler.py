@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import random
+import time
+
+from redis.exceptions import LockError
+
+logger = logging.getLogger(__name__)
+
+
+class RefreshScheduler:
+    """
+    Refreshes stored social access tokens in the background shortly before they expire, so user
+    requests find a valid token in the cache instead of waiting on the provider.
+
+    Every stored token that comes with a refresh token is tracked as a `<provider>:<identifier>` member
+    of a Redis sorted set, scored by the time its refresh is due: `refresh_ahead` seconds before the
+    token expires, moved earlier by up to `jitter` seconds so tokens issued together are not all refreshed
+    in the same instant. Only one worker runs the refreshes at a time; it holds a leader lock that it
+    renews every cycle and that expires after `lease` seconds if the worker dies.
+
+    Each cycle the leader claims due members in batches of `batch_size` by pushing their score
+    `retry_delay` seconds ahead, then refreshes them through `SocialAuthManager.refresh_access_token`
+    with at most `concurrency` refreshes in flight. A successful refresh schedules the next one; a
+    failed one is simply retried once its claim runs out. Tokens whose refresh token is gone (logout,
+    expiry) are dropped from the schedule.
+
+    Usage:
+        scheduler = RefreshScheduler(redis_cache)
+        social_auth = SocialAuthManager(db, redis_cache, google_manager=google, refresh_scheduler=scheduler)
+        scheduler.start()
+    """
+    def __init__(self, cache, refresh_ahead: float = 300, jitter: float = 60, interval: float = 5, batch_size: int = 100,
+                 concurrency: int = 10, lease: float = 30, retry_delay: float = 60):
+        """
+        :param cache: The RedisCaching instance holding the social tokens.
+        :param refresh_ahead: Seconds before expiry at which a token is refreshed.
+        :param jitter: Upper bound of the random number of seconds a refresh is moved earlier.
+        :param interval: Seconds between two cycles; each sleep is randomized by ±20% so workers drift apart.
+        :param batch_size: Due refreshes claimed at once.
+        :param concurrency: Maximum number of refreshes in flight.
+        :param lease: Seconds after which the leader lock of a crashed worker expires.
+        :param retry_delay: Seconds before a claimed refresh that did not complete is attempted again.
+        """
+        self.cache = cache
+        self.redis = cache.redis
+        self.schedule_key = cache.keys.refresh_schedule()
+        self.refresh_ahead = refresh_ahead
+        self.jitter = jitter
+        self.interval = interval
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.retry_delay = retry_delay
+        self.leader_lock = self.redis.lock(cache.keys.refresh_leader(), timeout=lease)
+        self.social_manager = None
+        self._task = None
+
+    @staticmethod
+    def _member(provider: str, identifier: str) -> str:
+        return f"{provider}:{identifier}"
+
+    async def track(self, provider: str, identifier: str, exp=None):
+        """
+        Schedules the refresh of a user's stored social token.
+
+        :param provider: The social provider that issued the token.
+        :param identifier: The user identifier the tokens are stored under.
+        :param exp: The token's lifetime in seconds or its absolute expiry timestamp; defaults to the cache's access token lifetime.
+        """
+        expires_in = self.cache._ttl(exp, self.cache.TOKEN_EXPIRATION_TIME)
+        due = time.time() + max(expires_in - self.refresh_ahead - random.uniform(0, self.jitter), 0)
+        await self.redis.zadd(self.schedule_key, {self._member(provider, identifier): due})
+
+    async def untrack(self, provider: str, identifier: str):
+        """Removes a user's token from the schedule, e.g. on logout."""
+        await self.redis.zrem(self.schedule_key, self._member(provider, identifier))
+
+    async def _lead(self) -> bool:
+        """Takes or renews the leader lock; returns whether this worker is the leader."""
+        if self.leader_lock.local.token is not None:
+            try:
+                await self.leader_lock.reacquire()
+                return True
+            except LockError:
+                # The lease ran out and another worker may have taken over
+                self.leader_lock.local.token = None
+        return await self.leader_lock.acquire(blocking=False)
+
+    async def _claim(self) -> list:
+        now = time.time()
+        members = await self.redis.zrangebyscore(self.schedule_key, "-inf", now, start=0, num=self.batch_size)
+        if members:
+            # Claimed refreshes become due again after retry_delay unless a successful refresh reschedules them
+            await self.redis.zadd(self.schedule_key, {member: now + self.retry_delay for member in members}, xx=True)
+        return [member.decode("utf-8") if isinstance(member, bytes) else member for member in members]
+
+    async def _refresh(self, member: str, semaphore: asyncio.Semaphore) -> bool:
+        provider, _, identifier = member.partition(":")
+        async with semaphore:
+            try:
+                refresh_token = await self.cache.retrieve_social_refresh_token(identifier)
+                if not refresh_token:
+                    await self.redis.zrem(self.schedule_key, member)
+                    return False
+                await self.social_manager.refresh_access_token(provider, refresh_token, {"username": identifier})
+                return True
+            except Exception:
+                logger.exception("Background refresh of the %s token of %s failed", provider, identifier)
+                return False
+
+    async def run_once(self) -> int:
+        """
+        Refreshes every token that is due, batch by batch. Does not check leadership.
+
+        :return: The number of tokens refreshed.
+        """
+        if self.social_manager is None:
+            raise ValueError("The scheduler is not attached to a SocialAuthManager.")
+        semaphore = asyncio.Semaphore(self.concurrency)
+        refreshed = 0
+        while True:
+            members = await self._claim()
+            results = await asyncio.gather(*(self._refresh(member, semaphore) for member in members))
+            refreshed += sum(results)
+            if len(members) < self.batch_size:
+                return refreshed
+
+    async def _run_forever(self):
+        while True:
+            try:
+                if await self._lead():
+                    await self.run_once()
+            except Exception:
+                # A failed cycle only delays refreshes; requests still refresh on demand
+                logger.exception("Scheduled social token refresh failed")
+            await asyncio.sleep(self.interval * random.uniform(0.8, 1.2))
+
+    def start(self):
+        """Starts the refresh loop on the running event loop."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run_forever())
+
+    async def close(self):
+        """Stops the refresh loop and hands leadership over to another worker."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.leader_lock.local.token is not None:
+            try:
+                await self.leader_lock.release()
+            except LockError:
+                pass
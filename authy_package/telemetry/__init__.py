@@ -0,0 +1,9 @@
+# auth_package/telemetry/__init__.py
+
+from .instrumentation import Instrumentation, OpenTelemetryInstrumentation, instrument, instrument_flows, instrument_function
+from .metrics import MetricsInstrumentation, MetricsRegistry
+
+__all__ = [
+    "Instrumentation", "OpenTelemetryInstrumentation", "instrument", "instrument_flows", "instrument_function",
+    "MetricsInstrumentation", "MetricsRegistry",
+]
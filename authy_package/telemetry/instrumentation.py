@@ -0,0 +1,206 @@
+import asyncio
+import functools
+import inspect
+import time
+from contextlib import nullcontext
+from contextvars import ContextVar
+
+# Phase timings of the flow running in the current task, only set while a debug-mode flow runs
+_phase_timings = ContextVar("authy_phase_timings", default=None)
+
+
+class Instrumentation:
+    """
+    Receives a callback for every instrumented call.
+
+    This base class only feeds the per-phase timing breakdown of debug mode; subclass it and override
+    `span` and/or `record` to export traces and latency histograms. Nothing is wrapped when a manager
+    has no instrumentation, so the disabled path costs nothing.
+    """
+
+    def span(self, name: str, attributes: dict):
+        """
+        Returns a context manager that spans one call.
+
+        :param name: The operation name, e.g. "db.get_user_by_identifier".
+        :param attributes: Static attributes of the instrumented component.
+        """
+        return nullcontext()
+
+    def record(self, name: str, duration: float, attributes: dict, error: BaseException = None, result=None):
+        """
+        Records the duration of a finished call.
+
+        :param name: The operation name.
+        :param duration: Wall-clock duration in seconds.
+        :param attributes: Static attributes of the instrumented component.
+        :param error: The exception raised by the call, if any.
+        :param result: The value returned by the call.
+        """
+        pass
+
+    def wrap_flow(self, func, name: str, debug: bool = False):
+        """
+        Wraps a top-level manager flow (e.g. `login_user`) in a span.
+
+        With `debug` enabled, the time spent in each instrumented phase is collected while the flow runs
+        and attached to a dict result as `"timings"` (milliseconds per phase, summed over repeated calls).
+        """
+        wrapped = instrument_function(func, name, self, {"authy.component": name.split(".", 1)[0]})
+        if not debug:
+            return wrapped
+
+        @functools.wraps(func)
+        async def flow(*args, **kwargs):
+            timings = {}
+            token = _phase_timings.set(timings)
+            try:
+                result = await wrapped(*args, **kwargs)
+            finally:
+                _phase_timings.reset(token)
+            if isinstance(result, dict):
+                result["timings"] = {phase: round(seconds * 1000, 3) for phase, seconds in timings.items()}
+            return result
+
+        return flow
+
+
+def _finish(instrumentation: Instrumentation, name: str, start: float, attributes: dict, error, result):
+    duration = time.perf_counter() - start
+    instrumentation.record(name, duration, attributes, error, result)
+    timings = _phase_timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + duration
+
+
+def instrument_function(func, name: str, instrumentation: Instrumentation, attributes: dict = None):
+    """
+    Wraps a sync or async callable so each call is spanned and timed.
+
+    :param func: The callable to wrap.
+    :param name: The operation name reported for each call.
+    :param instrumentation: The instrumentation receiving the calls.
+    :param attributes: Static attributes reported with each call.
+    :return: The wrapped callable.
+    """
+    attributes = attributes or {}
+
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            start, error, result = time.perf_counter(), None, None
+            with instrumentation.span(name, attributes):
+                try:
+                    result = await func(*args, **kwargs)
+                    return result
+                except BaseException as e:
+                    error = e
+                    raise
+                finally:
+                    _finish(instrumentation, name, start, attributes, error, result)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start, error, result = time.perf_counter(), None, None
+        with instrumentation.span(name, attributes):
+            try:
+                result = func(*args, **kwargs)
+                return result
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                _finish(instrumentation, name, start, attributes, error, result)
+    return wrapper
+
+
+class _InstrumentedProxy:
+    """Forwards attribute access to the target, wrapping its public methods on first use."""
+
+    __slots__ = ("_target", "_instrumentation", "_component", "_attributes", "_methods")
+
+    def __init__(self, target, instrumentation: Instrumentation, component: str):
+        object.__setattr__(self, "_target", target)
+        object.__setattr__(self, "_instrumentation", instrumentation)
+        object.__setattr__(self, "_component", component)
+        object.__setattr__(self, "_attributes", {"authy.component": component, "authy.backend": type(target).__name__})
+        object.__setattr__(self, "_methods", {})
+
+    def __getattr__(self, name):
+        methods = self._methods
+        if name in methods:
+            return methods[name]
+        value = getattr(self._target, name)
+        if name.startswith("_") or not inspect.ismethod(value):
+            return value
+        wrapped = instrument_function(value, f"{self._component}.{name}", self._instrumentation, self._attributes)
+        methods[name] = wrapped
+        return wrapped
+
+    def __setattr__(self, name, value):
+        self._methods.pop(name, None)
+        setattr(self._target, name, value)
+
+    def __bool__(self):
+        return bool(self._target)
+
+    def __repr__(self):
+        return f"<instrumented {self._component} {self._target!r}>"
+
+
+def instrument(target, instrumentation: Instrumentation, component: str):
+    """
+    Returns `target` with every public method call spanned and timed as `<component>.<method>`.
+
+    Returns the target untouched when it or the instrumentation is None.
+
+    :param target: A database, cache, provider manager, CognitoManager, SecurityManager, ...
+    :param instrumentation: The instrumentation receiving the calls.
+    :param component: The prefix of the reported operation names (e.g. "db", "social.github").
+    """
+    if target is None or instrumentation is None:
+        return target
+    return _InstrumentedProxy(target, instrumentation, component)
+
+
+class OpenTelemetryInstrumentation(Instrumentation):
+    """
+    Exports spans and a latency histogram through OpenTelemetry (requires `opentelemetry-api`).
+
+    Spans are named after the operation, and every call is recorded in the `authy.call.duration`
+    histogram (seconds) with the operation, component and error flag as attributes.
+    """
+
+    def __init__(self, tracer=None, meter=None):
+        """
+        :param tracer: The tracer to use; defaults to the global tracer provider's "authy_package" tracer.
+        :param meter: The meter to use; defaults to the global meter provider's "authy_package" meter.
+        """
+        from opentelemetry import metrics, trace
+
+        self.tracer = tracer or trace.get_tracer("authy_package")
+        meter = meter or metrics.get_meter("authy_package")
+        self.duration = meter.create_histogram("authy.call.duration", unit="s", description="Duration of authy_package calls")
+
+    def span(self, name: str, attributes: dict):
+        return self.tracer.start_as_current_span(name, attributes=attributes)
+
+    def record(self, name: str, duration: float, attributes: dict, error: BaseException = None, result=None):
+        self.duration.record(duration, {**attributes, "authy.operation": name, "authy.error": error is not None})
+
+
+def instrument_flows(manager, instrumentation: Instrumentation, prefix: str, flows, debug: bool = False):
+    """
+    Replaces the given flow methods of a manager instance with instrumented versions.
+
+    :param manager: The manager instance.
+    :param instrumentation: The instrumentation receiving the calls; nothing is changed when None.
+    :param prefix: The prefix of the reported flow names (e.g. "traditional").
+    :param flows: The names of the flow methods.
+    :param debug: Attach a per-phase timing breakdown to dict results.
+    """
+    if instrumentation is None:
+        return
+    for flow in flows:
+        setattr(manager, flow, instrumentation.wrap_flow(getattr(manager, flow), f"{prefix}.{flow}", debug))
@@ -0,0 +1,368 @@
+import time
+from bisect import bisect_left
+from threading import get_ident
+
+from authy_package.telemetry.instrumentation import Instrumentation
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _CounterChild:
+    """
+    One labelled counter.
+
+    Each thread increments its own cell, so recording never takes a lock and never loses an update
+    to a concurrent read-modify-write; cells are only summed when the registry is scraped.
+    """
+    __slots__ = ("_cells",)
+
+    def __init__(self):
+        self._cells = {}
+
+    def inc(self, amount=1):
+        cell = self._cells.get(get_ident())
+        if cell is None:
+            cell = self._cells.setdefault(get_ident(), [0])
+        cell[0] += amount
+
+    def value(self):
+        return sum(cell[0] for cell in list(self._cells.values()))
+
+
+class _HistogramChild:
+    """One labelled histogram, with per-thread cells like _CounterChild."""
+    __slots__ = ("_bounds", "_cells")
+
+    def __init__(self, bounds: tuple):
+        self._bounds = bounds
+        self._cells = {}
+
+    def observe(self, value: float):
+        cell = self._cells.get(get_ident())
+        if cell is None:
+            cell = self._cells.setdefault(get_ident(), [[0] * (len(self._bounds) + 1), 0.0, 0])
+        cell[0][bisect_left(self._bounds, value)] += 1
+        cell[1] += value
+        cell[2] += 1
+
+    def snapshot(self):
+        """Returns (cumulative bucket counts, sum, count)."""
+        buckets = [0] * (len(self._bounds) + 1)
+        total, count = 0.0, 0
+        for counts, cell_sum, cell_count in list(self._cells.values()):
+            for index, bucket in enumerate(counts):
+                buckets[index] += bucket
+            total += cell_sum
+            count += cell_count
+        cumulative, running = [], 0
+        for bucket in buckets:
+            running += bucket
+            cumulative.append(running)
+        return cumulative, total, count
+
+
+class _Metric:
+    TYPE = None
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """Returns the child for the given label values (positional, in `labelnames` order)."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.TYPE}"]
+
+
+class Counter(_Metric):
+    TYPE = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def collect(self):
+        lines = self.header()
+        for values, child in list(self._children.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value())}")
+        return lines
+
+
+class Histogram(_Metric):
+    TYPE = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def collect(self):
+        lines = self.header()
+        bounds = self.buckets + (float("inf"),)
+        for values, child in list(self._children.items()):
+            cumulative, total, count = child.snapshot()
+            for bound, bucket in zip(bounds, cumulative):
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {bucket}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, values)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, values)} {count}")
+        return lines
+
+
+class CallbackGauge(_Metric):
+    """A gauge whose value is computed by a callback when the registry is scraped."""
+    TYPE = "gauge"
+
+    def __init__(self, name: str, help: str, callback):
+        super().__init__(name, help)
+        self.callback = callback
+
+    def collect(self):
+        return self.header() + [f"{self.name} {_format_value(self.callback())}"]
+
+
+class MetricsRegistry:
+    """
+    A minimal Prometheus-compatible metrics registry.
+
+    Metrics are created once (registering the same name twice returns the existing metric) and
+    recorded without locks; `exposition()` renders them in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str, labelnames=()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name: str, help: str, callback) -> CallbackGauge:
+        return self._register(CallbackGauge(name, help, callback))
+
+    def exposition(self) -> str:
+        """Renders every metric in the Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+    def fastapi_endpoint(self):
+        """
+        Returns a FastAPI route handler serving the exposition, e.g.
+        `app.get("/metrics")(registry.fastapi_endpoint())`.
+        """
+        from fastapi import Response
+
+        async def metrics():
+            return Response(content=self.exposition(), media_type=CONTENT_TYPE)
+
+        return metrics
+
+
+# Flow name -> login method, for the flows counted as logins, registrations and refreshes
+LOGIN_FLOWS = {
+    "traditional.login_user": "password",
+    "social.facebook_social_login": "facebook",
+    "social.github_social_login": "github",
+    "social.apple_social_login": "apple",
+    "social.google_social_login": "google",
+    "cognito_auth.login_user": "cognito",
+}
+REGISTRATION_FLOWS = {"traditional.register_user": "password", "cognito_auth.register_user": "cognito"}
+REFRESH_FLOWS = {"traditional.refresh_token": "password", "social.refresh_access_token": "social", "cognito_auth.refresh_token": "cognito"}
+MFA_VERIFICATIONS = {"mfa.verify_mfa_code", "cognito.verify_mfa"}
+# SecurityManager sends the email from inside generate_and_send_reset_link, where the proxy cannot see the call
+RESET_EMAILS = {"security.generate_and_send_reset_link"}
+CACHE_LOOKUPS = {"validate_access_token", "validate_refresh_token", "retrieve_access_token", "get_reset_token"}
+
+
+def _outcome(error, result) -> str:
+    # CognitoManager reports failures as {"Error": ...} instead of raising
+    if error is not None or (isinstance(result, dict) and "Error" in result):
+        return "failure"
+    return "success"
+
+
+class MetricsInstrumentation(Instrumentation):
+    """
+    Turns instrumented calls (see `authy_package.telemetry.instrumentation`) into auth metrics.
+
+    Pass it as `instrumentation=` to the managers and serve `registry.exposition()`:
+
+        metrics = MetricsInstrumentation()
+        manager = TraditionalAuthManager(db, cache, instrumentation=metrics)
+        app.get("/metrics")(metrics.registry.fastapi_endpoint())
+
+    Redis round trips, connection pool waits and the client-side cache hit ratio are not visible at
+    the method level; register them with `track_redis_cache`, `track_sql_database` and `mongo_pool_listener`.
+    """
+
+    def __init__(self, registry: MetricsRegistry = None):
+        self.registry = registry or MetricsRegistry()
+        r = self.registry
+        self.logins = r.counter("authy_logins_total", "Login attempts", ("method", "outcome"))
+        self.registrations = r.counter("authy_registrations_total", "Registration attempts", ("method", "outcome"))
+        self.refreshes = r.counter("authy_token_refreshes_total", "Token refresh attempts", ("method", "outcome"))
+        self.mfa_verifications = r.counter("authy_mfa_verifications_total", "MFA code verifications", ("outcome",))
+        self.reset_emails = r.counter("authy_reset_emails_total", "Password reset emails sent", ("outcome",))
+        self.flow_duration = r.histogram("authy_flow_duration_seconds", "Duration of auth flows", ("flow",))
+        self.cache_calls = r.histogram("authy_cache_call_duration_seconds", "Duration of cache calls", ("backend", "operation"))
+        self.cache_lookups = r.counter("authy_cache_lookups_total", "Cache lookups by result", ("operation", "result"))
+        self.db_calls = r.histogram("authy_db_call_duration_seconds", "Duration of database calls", ("backend", "operation"))
+        self.provider_calls = r.histogram("authy_provider_call_duration_seconds", "Duration of identity provider calls", ("provider", "operation"))
+        self.provider_errors = r.counter("authy_provider_call_errors_total", "Failed identity provider calls", ("provider", "operation"))
+        self.redis_round_trips = r.counter("authy_redis_round_trips_total", "Redis round trips (commands or pipelines)", ("role",))
+        self.pool_waits = r.histogram("authy_pool_wait_seconds", "Time spent waiting for a pooled connection", ("pool",))
+        r.gauge("authy_cache_hit_ratio", "Share of cache lookups that found a value", self.cache_hit_ratio)
+
+    def cache_hit_ratio(self) -> float:
+        hits = misses = 0
+        for (_, result), child in list(self.cache_lookups._children.items()):
+            if result == "hit":
+                hits += child.value()
+            else:
+                misses += child.value()
+        return hits / (hits + misses) if hits + misses else 0.0
+
+    def record(self, name: str, duration: float, attributes: dict, error: BaseException = None, result=None):
+        component = attributes.get("authy.component", "")
+        operation = name.rsplit(".", 1)[-1]
+
+        if component == "cache":
+            self.cache_calls.labels(attributes.get("authy.backend"), operation).observe(duration)
+            if operation in CACHE_LOOKUPS and error is None:
+                self.cache_lookups.labels(operation, "hit" if result else "miss").inc()
+        elif component == "db":
+            self.db_calls.labels(attributes.get("authy.backend"), operation).observe(duration)
+        elif component.startswith("social.") or component == "cognito":
+            provider = component.split(".", 1)[-1]
+            self.provider_calls.labels(provider, operation).observe(duration)
+            if _outcome(error, result) == "failure":
+                self.provider_errors.labels(provider, operation).inc()
+
+        if name in MFA_VERIFICATIONS:
+            self.mfa_verifications.labels(_outcome(error, result)).inc()
+        elif name in RESET_EMAILS:
+            self.reset_emails.labels(_outcome(error, result)).inc()
+        elif component in ("traditional", "social", "cognito_auth"):
+            self.flow_duration.labels(name).observe(duration)
+            if name in LOGIN_FLOWS:
+                self.logins.labels(LOGIN_FLOWS[name], _outcome(error, result)).inc()
+            elif name in REGISTRATION_FLOWS:
+                self.registrations.labels(REGISTRATION_FLOWS[name], _outcome(error, result)).inc()
+            elif name in REFRESH_FLOWS:
+                self.refreshes.labels(REFRESH_FLOWS[name], _outcome(error, result)).inc()
+
+    def _track_pool(self, pool, name: str, round_trips=None):
+        """Times `get_connection` of a redis-py pool; every checkout is one command or pipeline round trip."""
+        get_connection = pool.get_connection
+        wait = self.pool_waits.labels(name)
+
+        async def timed_get_connection(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await get_connection(*args, **kwargs)
+            finally:
+                wait.observe(time.perf_counter() - start)
+                if round_trips:
+                    round_trips.inc()
+
+        pool.get_connection = timed_get_connection
+
+    def track_redis_cache(self, cache):
+        """
+        Counts Redis round trips and pool waits of a RedisCaching (standalone or sentinel mode), and
+        exports the hit ratio of its client-side cache.
+        """
+        self._track_pool(cache.redis.connection_pool, "redis", self.redis_round_trips.labels("primary"))
+        if cache.replica is not cache.redis:
+            self._track_pool(cache.replica.connection_pool, "redis_replica", self.redis_round_trips.labels("replica"))
+        self.registry.gauge("authy_redis_local_cache_hit_ratio", "Share of access-token validations served by the client-side cache",
+                            cache.local_cache_hit_ratio)
+
+    def track_sql_database(self, db):
+        """Records how long a SQLDatabase waits for a connection from its SQLAlchemy pool."""
+        pool = db.engine.sync_engine.pool
+        connect = pool.connect
+        wait = self.pool_waits.labels("sql")
+
+        def timed_connect(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return connect(*args, **kwargs)
+            finally:
+                wait.observe(time.perf_counter() - start)
+
+        pool.connect = timed_connect
+
+    def mongo_pool_listener(self):
+        """
+        Returns a pymongo pool listener recording connection checkout waits; pass it to
+        `MongoDB(..., event_listeners=[metrics.mongo_pool_listener()])`.
+        """
+        from pymongo import monitoring
+
+        wait = self.pool_waits.labels("mongodb")
+
+        class PoolWaitListener(monitoring.ConnectionPoolListener):
+            def connection_checked_out(self, event):
+                # `duration` (pymongo >= 4.7) covers the whole checkout, including waiting for a free connection
+                duration = getattr(event, "duration", None)
+                if duration is not None:
+                    wait.observe(duration)
+
+            def pool_created(self, event): pass
+            def pool_ready(self, event): pass
+            def pool_cleared(self, event): pass
+            def pool_closed(self, event): pass
+            def connection_created(self, event): pass
+            def connection_ready(self, event): pass
+            def connection_closed(self, event): pass
+            def connection_check_out_started(self, event): pass
+            def connection_check_out_failed(self, event): pass
+            def connection_checked_in(self, event): pass
+
+        return PoolWaitListener()
@@ -1,5 +1,17 @@
 # auth_package/db/__init__.py
 
-from .security import SecurityManager, hash_password, verify_password, generate_reset_token
+from .security import (
+    SecurityManager, hash_password, verify_password, generate_reset_token,
+    calibrate_password_hashing, configure_password_hashing, password_needs_update,
+)
+from .resilience import (
+    AdaptiveConcurrency, CircuitBreaker, ProviderUnavailableError, RateLimitedError, RateLimiter, RetryBudget, shared_rate_limiter,
+)
+from .single_flight import SingleFlight
 
-__all__ = ["SecurityManager", "hash_password", "verify_password", "generate_reset_token"]
+__all__ = [
+    "SecurityManager", "hash_password", "verify_password", "generate_reset_token",
+    "calibrate_password_hashing", "configure_password_hashing", "password_needs_update",
+    "AdaptiveConcurrency", "CircuitBreaker", "ProviderUnavailableError", "RateLimitedError", "RateLimiter", "RetryBudget", "shared_rate_limiter",
+    "SingleFlight",
+]
@@ -0,0 +1,375 @@
+import asyncio
+import json
+import logging
+import math
+import random
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderUnavailableError(ValueError):
+    """Raised when an outbound call is refused by an open circuit or does not complete within its deadline."""
+
+
+class CircuitBreaker:
+    """
+    Stops calling an endpoint that keeps failing, so callers fail fast instead of each waiting for a timeout.
+
+    The breaker keeps the outcomes of the last `window_size` calls. Once at least `min_calls` of them
+    are known and the share of failures reaches `failure_rate`, it opens and refuses calls for
+    `reset_timeout` seconds. It then lets a single probe through (half-open): a success closes the
+    breaker, a failure opens it again. A probe that never reports back is replaced after another
+    `reset_timeout`. Judging a failure rate rather than a streak keeps a degraded endpoint, whose
+    failures retries can still absorb, from being cut off entirely.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_rate: float = 0.5, window_size: int = 20, min_calls: int = 10, reset_timeout: float = 30.0):
+        """
+        :param failure_rate: Share of failed calls in the window that opens the breaker.
+        :param window_size: Number of recent calls the failure rate is computed over.
+        :param min_calls: Calls that must be recorded before the breaker can open.
+        :param reset_timeout: Seconds the breaker stays open before letting a probe through.
+        """
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._outcomes = deque(maxlen=window_size)
+        self._failures = 0
+        self._changed_at = 0.0
+
+    def allow(self) -> bool:
+        """Returns whether a call may be made now; in the half-open state only one probe is let through."""
+        if self.state == self.CLOSED:
+            return True
+        now = time.monotonic()
+        if now - self._changed_at < self.reset_timeout:
+            return False
+        self.state, self._changed_at = self.HALF_OPEN, now
+        return True
+
+    def _record(self, failed: bool):
+        if len(self._outcomes) == self._outcomes.maxlen:
+            self._failures -= self._outcomes[0]
+        self._outcomes.append(failed)
+        self._failures += failed
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            self.state = self.CLOSED
+            self._outcomes.clear()
+            self._failures = 0
+        self._record(False)
+
+    def record_failure(self):
+        self._record(True)
+        if self.state == self.HALF_OPEN or (len(self._outcomes) >= self.min_calls and self._failures >= self.failure_rate * len(self._outcomes)):
+            self.state, self._changed_at = self.OPEN, time.monotonic()
+
+
+class RetryBudget:
+    """
+    Caps retries (and hedged requests) at a share of the recent request volume.
+
+    Retrying every failed call multiplies the load on a provider that is already struggling. Within
+    the last `window` seconds, at most `min_retries_per_second * window + ratio * requests` retries
+    are allowed; beyond that, failures are returned to the caller as they are.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_retries_per_second: float = 1.0, window: float = 10.0):
+        """
+        :param ratio: Retries allowed per request made.
+        :param min_retries_per_second: Retries always allowed, so a quiet process can still retry.
+        :param window: Seconds over which requests and retries are counted.
+        """
+        self.ratio = ratio
+        self.min_retries_per_second = min_retries_per_second
+        self.window = window
+        self._requests = deque()
+        self._retries = deque()
+
+    def _trim(self, now: float):
+        for events in (self._requests, self._retries):
+            while events and events[0] <= now - self.window:
+                events.popleft()
+
+    def deposit(self):
+        """Records a request."""
+        now = time.monotonic()
+        self._trim(now)
+        self._requests.append(now)
+
+    def withdraw(self) -> bool:
+        """Records a retry and returns True if the budget allows it, otherwise returns False."""
+        now = time.monotonic()
+        self._trim(now)
+        if len(self._retries) >= self.min_retries_per_second * self.window + self.ratio * len(self._requests):
+            return False
+        self._retries.append(now)
+        return True
+
+
+def backoff(attempt: int, base: float = 0.05, cap: float = 1.0) -> float:
+    """
+    Returns the delay before retry number `attempt` (0 based), with full jitter.
+
+    The delay is drawn uniformly from `[0, min(cap, base * 2**attempt)]`, so clients that failed
+    together do not retry in lockstep.
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class RateLimitedError(ProviderUnavailableError):
+    """Raised when a request is shed because the provider's rate limit would not admit it in time."""
+
+
+class RateLimiter:
+    """
+    Paces the requests of one provider app with a token bucket, so they stay under the provider's
+    rate limit instead of running into 403/429 responses.
+
+    A request takes a token; tokens refill at `rate` per second up to `burst`. When none is left, the
+    request queues for the next one, unless that would take more than `max_wait` seconds, in which
+    case it is shed with RateLimitedError. Without a configured `rate` the bucket only applies what
+    the provider reports in its responses (see `update`):
+
+    - `X-RateLimit-Remaining`/`X-RateLimit-Reset` (GitHub): once less than `headroom` of the quota is
+      left, the remaining calls are spread evenly until the reset; at zero, requests wait for the reset.
+    - `X-App-Usage`/`X-Business-Use-Case-Usage` (Facebook, percentages of the hourly quota): above
+      `1 - headroom` the request rate is cut back proportionally; at 100% requests wait until access
+      is regained.
+    - `Retry-After` on a 429 or 503 response: requests wait that long.
+    """
+    USAGE_WINDOW = 60.0
+
+    def __init__(self, rate: float = None, burst: float = None, max_wait: float = 1.0, headroom: float = 0.2):
+        """
+        :param rate: Requests per second the app may make, or None to rely on the provider's headers.
+        :param burst: Requests that may be made at once after an idle period; defaults to one second's worth.
+        :param max_wait: Seconds a request may queue for a token before it is shed.
+        :param headroom: Share of the provider quota below which requests are paced.
+        """
+        self.rate = rate
+        self.burst = burst or max(rate or 1.0, 1.0)
+        self.max_wait = max_wait
+        self.headroom = headroom
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paced_rate = None
+        self._paced_until = 0.0
+        self._blocked_until = 0.0
+        self._recent = deque()
+
+    def _current_rate(self, now: float):
+        rates = [rate for rate in (self.rate, self._paced_rate if now < self._paced_until else None) if rate is not None]
+        return min(rates) if rates else None
+
+    def _reserve(self, now: float, limit: float) -> float:
+        """Takes a token and returns how long to wait for it, or returns None if that exceeds `limit`."""
+        rate = self._current_rate(now)
+        wait = max(self._blocked_until - now, 0.0)
+        if rate is not None:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * rate)
+            # A negative balance is the queue of requests that already hold a reservation
+            wait = max(wait, (1 - self._tokens) / rate if rate > 0 else float("inf"))
+        self._updated = now
+        if wait > limit:
+            return None
+        if rate is not None:
+            self._tokens -= 1
+        self._recent.append(now)
+        while self._recent[0] <= now - self.USAGE_WINDOW:
+            self._recent.popleft()
+        return wait
+
+    async def acquire(self, timeout: float = None):
+        """
+        Waits for a token.
+
+        :param timeout: Seconds the caller can wait at most (e.g. its remaining deadline); capped by `max_wait`.
+        :raises RateLimitedError: If no token becomes available in time.
+        """
+        limit = self.max_wait if timeout is None else min(self.max_wait, timeout)
+        wait = self._reserve(time.monotonic(), limit)
+        if wait is None:
+            raise RateLimitedError("Provider rate limit reached; request shed.")
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def try_acquire(self) -> bool:
+        """Takes a token if one is available right away."""
+        return self._reserve(time.monotonic(), 0.0) is not None
+
+    def update(self, headers, status_code: int = 200):
+        """Adjusts the pace to the rate-limit headers of a provider response."""
+        now, wall = time.monotonic(), time.time()
+
+        retry_after = headers.get("retry-after")
+        if retry_after and status_code in (429, 503):
+            try:
+                self._blocked_until = max(self._blocked_until, now + float(retry_after))
+            except ValueError:
+                pass
+
+        remaining = self._header_number(headers, "x-ratelimit-remaining", int)
+        reset = self._header_number(headers, "x-ratelimit-reset", float)
+        limit = self._header_number(headers, "x-ratelimit-limit", int)
+        if remaining is not None and reset is not None:
+            until_reset = max(reset - wall, 1.0)
+            if remaining <= 0:
+                self._blocked_until = max(self._blocked_until, now + until_reset)
+            elif limit and remaining < self.headroom * int(limit):
+                self._paced_rate, self._paced_until = remaining / until_reset, now + until_reset
+
+        usage = self._usage(headers)
+        if usage is not None:
+            percent, regain_minutes = usage
+            if percent >= 100:
+                self._blocked_until = max(self._blocked_until, now + 60 * (regain_minutes or 1))
+            elif percent >= 100 * (1 - self.headroom):
+                # Cut the recent request rate back in proportion to the quota left
+                observed = len(self._recent) / self.USAGE_WINDOW
+                self._paced_rate = max(observed * (100 - percent) / (100 * self.headroom), 1 / self.USAGE_WINDOW)
+                self._paced_until = now + self.USAGE_WINDOW
+
+    @staticmethod
+    def _header_number(headers, name: str, parse):
+        """Returns a numeric header parsed with `parse`, or None if it is missing or malformed (a proxy may mangle it)."""
+        value = headers.get(name)
+        if value is None:
+            return None
+        try:
+            number = parse(value)
+        except ValueError:
+            number = None
+        if number is None or not math.isfinite(number):
+            logger.warning("Ignoring malformed %s header: %r", name, value)
+            return None
+        return number
+
+    @staticmethod
+    def _usage(headers):
+        """Returns the highest quota percentage and the minutes until access is regained from Facebook's usage headers."""
+        percents, regain = [], 0
+        app_usage = headers.get("x-app-usage")
+        if app_usage:
+            try:
+                percents.extend(float(value) for value in json.loads(app_usage).values())
+            except (ValueError, TypeError, AttributeError):
+                pass
+        business_usage = headers.get("x-business-use-case-usage")
+        if business_usage:
+            try:
+                for entries in json.loads(business_usage).values():
+                    for entry in entries:
+                        percents.extend(float(entry.get(key, 0)) for key in ("call_count", "total_time", "total_cputime"))
+                        regain = max(regain, int(entry.get("estimated_time_to_regain_access", 0)))
+            except (ValueError, TypeError, AttributeError):
+                pass
+        return (max(percents), regain) if percents else None
+
+
+_rate_limiters = {}
+
+
+def shared_rate_limiter(key: str, **kwargs) -> RateLimiter:
+    """
+    Returns the process-wide rate limiter of a provider app (e.g. "github:<client id>"), creating it
+    with `kwargs` on first use, so all managers of the same app share one budget.
+    """
+    limiter = _rate_limiters.get(key)
+    if limiter is None:
+        limiter = _rate_limiters[key] = RateLimiter(**kwargs)
+    return limiter
+
+
+class AdaptiveConcurrency:
+    """
+    Limits the number of calls in flight and adapts the limit to what the service accepts (AIMD).
+
+    Every successful call raises the limit by `1 / limit`, i.e. by one per limit's worth of successes,
+    up to `maximum`. A throttled call cuts it by `decrease_factor`, down to `minimum`, and pauses new
+    calls for a jittered exponential backoff that grows while throttling continues, since a lower
+    limit alone does not slow down calls the service answers quickly. Calls that were already in
+    flight when the limit was cut carry an older epoch, so a burst of throttling caused by one
+    overshoot cuts the limit once instead of once per throttled call.
+
+    Usage:
+        epoch = await concurrency.acquire()
+        try:
+            ...  # call the service, then record_success() or record_throttle(epoch)
+        finally:
+            concurrency.release()
+    """
+
+    def __init__(self, initial: int = 4, minimum: int = 1, maximum: int = 64, decrease_factor: float = 0.5,
+                 backoff_base: float = 0.1, backoff_cap: float = 5.0):
+        """
+        :param initial: The limit to start with.
+        :param minimum: The limit is never cut below this.
+        :param maximum: The limit never grows beyond this.
+        :param decrease_factor: Factor the limit is multiplied with on throttling.
+        :param backoff_base: Base of the exponential pause after throttling, in seconds.
+        :param backoff_cap: Upper bound of a single pause, in seconds.
+        """
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease_factor = decrease_factor
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.in_flight = 0
+        self.epoch = 0
+        self._throttles = 0
+        self._paused_until = 0.0
+        self._waiters = deque()
+
+    async def acquire(self) -> int:
+        """Waits until a call may start and returns the current epoch for `record_throttle`."""
+        while time.monotonic() < self._paused_until:
+            await asyncio.sleep(self._paused_until - time.monotonic())
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                else:
+                    # The slot this waiter was woken for goes to the next one
+                    self._wake()
+                raise
+        self.in_flight += 1
+        return self.epoch
+
+    def release(self):
+        """Ends a call started with `acquire`."""
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    def record_success(self):
+        self._throttles = 0
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        self._wake()
+
+    def record_throttle(self, epoch: int):
+        """Cuts the limit and pauses new calls, unless that already happened since the throttled call started."""
+        if epoch == self.epoch:
+            self.limit = max(self.minimum, self.limit * self.decrease_factor)
+            self.epoch += 1
+            self._paused_until = time.monotonic() + backoff(self._throttles, self.backoff_base, self.backoff_cap)
+            self._throttles += 1
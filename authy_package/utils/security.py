@@ -1,17 +1,23 @@
 import os
-import hashlib
 import time
 from mailjet_rest import Client
 from authy_package.db.abstract_db import AbstractDatabase
 from authy_package.cache.abstract_cache import AbstractCache
+from authy_package.utils.tokens import generate_token
 from passlib.context import CryptContext
 
-# Password hashing context using bcrypt
+# Password hashing context using bcrypt; see configure_password_hashing to change the scheme or cost
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# Hashes kept verifiable after a scheme change, so existing users can still log in (and get rehashed)
+LEGACY_SCHEMES = ("bcrypt",)
+
+BCRYPT_MIN_ROUNDS = 4
+BCRYPT_MAX_ROUNDS = 20
+
 
 def hash_password(password: str) -> str:
-    """Hashes the given password using bcrypt."""
+    """Hashes the given password with the configured scheme (bcrypt by default)."""
     return pwd_context.hash(password)
 
 
@@ -20,9 +26,99 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 
+def password_needs_update(hashed_password: str) -> bool:
+    """Returns True when the hash uses a deprecated scheme or a cost other than the configured one."""
+    return pwd_context.needs_update(hashed_password)
+
+
+def configure_password_hashing(scheme: str = "bcrypt", **settings):
+    """
+    Reconfigures the password hashing scheme and cost, e.g. with the output of calibrate_password_hashing.
+
+    Hashes made with another scheme or cost keep verifying but are reported by password_needs_update,
+    so TraditionalAuthManager rehashes them on the next successful login.
+
+    :param scheme: "bcrypt" or "argon2" (requires `argon2-cffi`).
+    :param settings: Cost settings of the scheme: `rounds` for bcrypt; `time_cost`, `memory_cost` (KiB)
+        and `parallelism` for argon2.
+    """
+    if scheme not in ("bcrypt", "argon2"):
+        raise ValueError(f"Unsupported password hashing scheme: {scheme}")
+    options = {"schemes": [scheme] + [legacy for legacy in LEGACY_SCHEMES if legacy != scheme], "default": scheme, "deprecated": "auto"}
+    if scheme == "bcrypt":
+        if "rounds" in settings:
+            # min == default makes hashes with fewer rounds "need update"; more rounds are kept
+            options["bcrypt__default_rounds"] = options["bcrypt__min_rounds"] = settings["rounds"]
+    else:
+        if "time_cost" in settings:
+            # passlib calls argon2's time cost "rounds"
+            options["argon2__default_rounds"] = options["argon2__min_rounds"] = settings["time_cost"]
+        for name in ("memory_cost", "parallelism"):
+            if name in settings:
+                options[f"argon2__{name}"] = settings[name]
+    pwd_context.load(options)
+
+
+def _time_hash(handler, samples: int) -> float:
+    """Returns the fastest of `samples` hashes in milliseconds."""
+    best = float("inf")
+    for _ in range(samples):
+        start = time.perf_counter()
+        handler.hash("calibration-password")
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def calibrate_password_hashing(target_ms: float = 250, scheme: str = "bcrypt", memory_cost: int = 65536, parallelism: int = 1, samples: int = 3) -> dict:
+    """
+    Measures this host and picks the largest hashing cost that stays within a latency budget.
+
+    For bcrypt each extra round doubles the cost, so the rounds are chosen from one measurement and
+    then verified. For argon2 the memory cost is fixed (memory-hardness is the point of the scheme)
+    and the number of passes is raised until the next one would exceed the budget.
+
+    :param target_ms: The target milliseconds per hash.
+    :param scheme: "bcrypt" or "argon2" (requires `argon2-cffi`).
+    :param memory_cost: The argon2 memory cost in KiB (default 64 MiB).
+    :param parallelism: The argon2 parallelism.
+    :param samples: Hashes timed per candidate; the fastest one counts.
+    :return: The settings for configure_password_hashing, plus the measured "ms" per hash.
+    """
+    if scheme == "bcrypt":
+        from passlib.hash import bcrypt
+
+        base = 10
+        base_ms = _time_hash(bcrypt.using(rounds=base), samples)
+        rounds = base
+        while rounds < BCRYPT_MAX_ROUNDS and base_ms * 2 ** (rounds + 1 - base) <= target_ms:
+            rounds += 1
+        while rounds > BCRYPT_MIN_ROUNDS and base_ms * 2 ** (rounds - base) > target_ms:
+            rounds -= 1
+        measured = _time_hash(bcrypt.using(rounds=rounds), samples)
+        # The estimate assumes exact doubling; step down if the real cost overshoots the budget
+        while measured > target_ms and rounds > BCRYPT_MIN_ROUNDS:
+            rounds -= 1
+            measured = _time_hash(bcrypt.using(rounds=rounds), samples)
+        return {"scheme": "bcrypt", "rounds": rounds, "ms": round(measured, 2)}
+
+    if scheme == "argon2":
+        from passlib.hash import argon2
+
+        time_cost = 1
+        measured = _time_hash(argon2.using(rounds=time_cost, memory_cost=memory_cost, parallelism=parallelism), samples)
+        while True:
+            candidate = _time_hash(argon2.using(rounds=time_cost + 1, memory_cost=memory_cost, parallelism=parallelism), samples)
+            if candidate > target_ms:
+                break
+            time_cost, measured = time_cost + 1, candidate
+        return {"scheme": "argon2", "time_cost": time_cost, "memory_cost": memory_cost, "parallelism": parallelism, "ms": round(measured, 2)}
+
+    raise ValueError(f"Unsupported password hashing scheme: {scheme}")
+
+
 def generate_reset_token() -> str:
-    """Generates a reset token using SHA256 and the current time."""
-    return hashlib.sha256(str(time.time()).encode()).hexdigest()
+    """Generates a cryptographically random, url-safe reset token."""
+    return generate_token()
 
 
 class SecurityManager:
@@ -127,7 +223,7 @@ class SecurityManager:
         # Generate a reset token and store it in cache (expires in 15 minutes)
         reset_token = generate_reset_token()
         if self.cache:
-            self.cache.store_reset_token(user['email'], reset_token, expiration=900)
+            await self.cache.store_reset_token(user['email'], reset_token, expiration=900)
 
         # Generate the reset link (in production, this should point to the real reset page)
         reset_link = f"http://example.com/reset-password?token={reset_token}&email={user['email']}"
@@ -144,7 +240,7 @@ class SecurityManager:
         :param token: The reset token to validate.
         :return: True if the token is valid, otherwise raises a ValueError.
         """
-        stored_token = self.cache.get_reset_token(email) if self.cache else None
+        stored_token = await self.cache.get_reset_token(email) if self.cache else None
         if stored_token and stored_token == token:
             return True
         raise ValueError("Invalid or expired reset token.")
@@ -159,8 +255,8 @@ class SecurityManager:
         """
         await self.validate_reset_token(email=email, token=token)
         hashed_password = hash_password(new_password)
-        await self.db.update_user_password(email=email, new_password=hashed_password)
+        await self.db.update_user_password(identifier=email, new_password=hashed_password)
         if self.cache:
-            self.cache.delete_reset_token(email)
+            await self.cache.delete_reset_token(email)
 
         return {"message": "Password updated successfully."}
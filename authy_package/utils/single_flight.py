@@ -0,0 +1,83 @@
+import asyncio
+import json
+import time
+
+from redis.exceptions import LockError
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key into one execution whose result every caller gets.
+
+    In-process, the first caller for a key starts the call and later callers await the same task.
+    With a Redis client, workers additionally coordinate through a short lock: the worker holding
+    `<prefix>{key}:lock` runs the call and publishes its JSON-encoded result under `<prefix>{key}:result`
+    for `result_ttl` seconds; the others poll for that result instead of repeating the call. If the
+    lock holder dies, its lock expires and a waiting worker takes over.
+
+    The `{key}` hash tag keeps both keys in one Redis Cluster slot.
+    """
+
+    def __init__(self, redis=None, key_prefix: str = "authy:sf:", lock_timeout: float = 15.0, result_ttl: float = 5.0, poll_interval: float = 0.05):
+        """
+        :param redis: An optional redis.asyncio client (e.g. `RedisCaching(...).redis`) for cross-worker coalescing.
+        :param key_prefix: Prefix of the lock and result keys.
+        :param lock_timeout: Seconds after which the lock of a crashed worker expires; also bounds how long waiters wait.
+        :param result_ttl: Seconds a published result is handed to late callers instead of running the call again.
+        :param poll_interval: Seconds between two result polls of a waiting worker.
+        """
+        self.redis = redis
+        self.key_prefix = key_prefix
+        self.lock_timeout = lock_timeout
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self._inflight = {}
+
+    async def do(self, key: str, func, dump=None, load=None):
+        """
+        Runs `func()` unless a call for `key` is already in flight, and returns its result.
+
+        A caller that is cancelled does not cancel the shared call.
+
+        :param key: The coalescing key, e.g. "google:alice".
+        :param func: A coroutine function taking no arguments.
+        :param dump: Turns the result into a JSON-serializable value for other workers (default: unchanged).
+        :param load: The inverse of `dump`, applied to results received from other workers.
+        :return: The result of the shared call.
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._run(key, func, dump, load))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._inflight.pop(key, None) if self._inflight.get(key) is done else None)
+        return await asyncio.shield(task)
+
+    async def _run(self, key: str, func, dump, load):
+        if self.redis is None:
+            return await func()
+
+        result_key = f"{self.key_prefix}{{{key}}}:result"
+        lock = self.redis.lock(f"{self.key_prefix}{{{key}}}:lock", timeout=self.lock_timeout)
+        deadline = time.monotonic() + self.lock_timeout
+        while True:
+            published = await self.redis.get(result_key)
+            if published is not None:
+                value = json.loads(published)
+                return load(value) if load else value
+
+            if await lock.acquire(blocking=False):
+                try:
+                    result = await func()
+                    value = dump(result) if dump else result
+                    await self.redis.set(result_key, json.dumps(value), px=int(self.result_ttl * 1000))
+                    return result
+                finally:
+                    try:
+                        await lock.release()
+                    except LockError:
+                        # The call outlived the lock timeout and another worker may hold the lock now
+                        pass
+
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"Timed out waiting for the in-flight call for {key}")
+            await asyncio.sleep(self.poll_interval)
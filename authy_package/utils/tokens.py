@@ -0,0 +1,37 @@
+import base64
+import hashlib
+import secrets
+
+# 24 random bytes encode to exactly 32 url-safe characters (no padding to strip)
+DEFAULT_TOKEN_BYTES = 24
+
+# Number of SHA-256 digest bytes kept for storage keys; 18 bytes encode to 24 characters
+KEY_DIGEST_BYTES = 18
+
+
+def generate_token(nbytes: int = DEFAULT_TOKEN_BYTES) -> str:
+    """
+    Generates a cryptographically random, url-safe token.
+
+    With the default of 24 bytes the token carries 192 bits of entropy and is 32 characters long,
+    half the size of the previous SHA-256 hex tokens.
+
+    :param nbytes: The number of random bytes in the token.
+    :return: The url-safe token string.
+    """
+    return base64.urlsafe_b64encode(secrets.token_bytes(nbytes)).rstrip(b"=").decode("ascii")
+
+
+def token_digest(token: str) -> str:
+    """
+    Returns a compact, url-safe digest of the token.
+
+    The digest is what gets stored as (part of) a cache key, so a leaked key listing or
+    a `KEYS`/`SCAN` dump never exposes usable tokens.
+
+    :param token: The raw token.
+    :return: A 24 character url-safe digest of the token.
+    """
+    digest = hashlib.sha256(token.encode("utf-8")).digest()
+    return base64.urlsafe_b64encode(digest[:KEY_DIGEST_BYTES]).decode("ascii")
+
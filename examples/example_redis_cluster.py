@@ -0,0 +1,42 @@
+import asyncio
+from authy_package.cache.redis_cache import RedisCaching
+
+# A local 6 node cluster (3 masters, 3 replicas) can be started with:
+#   for port in 7000 7001 7002 7003 7004 7005; do
+#       redis-server --port $port --cluster-enabled yes --cluster-config-file nodes-$port.conf --daemonize yes
+#   done
+#   redis-cli --cluster create 127.0.0.1:7000 127.0.0.1:7001 127.0.0.1:7002 \
+#       127.0.0.1:7003 127.0.0.1:7004 127.0.0.1:7005 --cluster-replicas 1 --cluster-yes
+#
+# and a sentinel setup with a master on 6379, a replica on 6380 and a sentinel on 26379:
+#   redis-server --port 6379 --daemonize yes
+#   redis-server --port 6380 --replicaof 127.0.0.1 6379 --daemonize yes
+#   printf "port 26379\nsentinel monitor mymaster 127.0.0.1 6379 1\n" > sentinel.conf
+#   redis-sentinel sentinel.conf --daemonize yes
+
+CLUSTER_URL = "redis://127.0.0.1:7000"
+SENTINELS = [("127.0.0.1", 26379)]
+
+# Any node of the cluster can be used for discovery; reads may be served by replicas
+cluster_cache = RedisCaching(CLUSTER_URL, mode="cluster", read_from_replicas=True)
+
+# Writes go to the master elected by the sentinels, reads to one of its replicas
+sentinel_cache = RedisCaching(mode="sentinel", sentinels=SENTINELS, service_name="mymaster", read_from_replicas=True)
+
+async def main():
+    for name, cache in (("Cluster", cluster_cache), ("Sentinel", sentinel_cache)):
+        # All keys of a user's token family share a hash slot, so the pipelined writes stay on one shard
+        access_token, refresh_token = await cache.create_token_pair("jane@example.com")
+        await cache.store_social_token("jane@example.com", "social-access-token", "social-refresh-token")
+        print(f"{name} tokens:", access_token, refresh_token)
+
+        # Replication is asynchronous; give the replica a moment before reading from it
+        await asyncio.sleep(0.1)
+        print(f"{name} validated identifier:", await cache.validate_access_token(access_token))
+        print(f"{name} memory per session:", await cache.memory_report(measure=True))
+
+        await cache.delete_access_token(access_token)
+        await cache.delete_refresh_token("jane@example.com")
+
+if __name__ == "__main__":
+    asyncio.run(main())
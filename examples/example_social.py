@@ -32,7 +32,11 @@ redis_cache = RedisCaching(REDIS_URL)
 facebook_manager = FacebookManager(FACEBOOK_APP_ID, FACEBOOK_APP_SECRET)
 github_manager = GitHubManager(GITHUB_CLIENT_ID, GITHUB_CLIENT_SECRET)
 apple_manager = AppleManager(APPLE_TEAM_ID, APPLE_CLIENT_ID, APPLE_KEY_ID, APPLE_PRIVATE_KEY_PATH)
-google_manager = GoogleManager(GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET)
+google_manager = GoogleManager(
+    client_config={"web": {"client_id": GOOGLE_CLIENT_ID, "client_secret": GOOGLE_CLIENT_SECRET}},
+    redirect_uri="https://your-app.com/auth/google/callback",
+    scopes=["openid", "email", "profile"]
+)
 
 # Initialize AuthManager for MongoDB, Redis, and social login providers
 auth_manager = SocialAuthManager(
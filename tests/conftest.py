@@ -0,0 +1,14 @@
+import shutil
+
+import pytest
+
+from tests.redis_processes import RedisProcesses
+
+
+@pytest.fixture
+def redis_processes():
+    if not shutil.which("redis-server") or not shutil.which("redis-sentinel") or not shutil.which("redis-cli"):
+        pytest.skip("redis-server, redis-sentinel and redis-cli are required on PATH")
+    processes = RedisProcesses()
+    yield processes
+    processes.stop()
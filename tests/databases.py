@@ -0,0 +1,53 @@
+import tempfile
+
+from mongomock_motor import AsyncMongoMockClient
+from sqlalchemy import Boolean, Column, Integer, String
+from sqlalchemy.orm import declarative_base
+
+from authy_package.db.mongodb import MongoDB
+from authy_package.db.sql import SQLDatabase
+
+Base = declarative_base()
+
+
+class User(Base):
+    """A user model like the ones in the examples: no unique constraints."""
+    __tablename__ = "users"
+    id = Column(Integer, primary_key=True)
+    username = Column(String(255))
+    email = Column(String(255))
+    phone = Column(String(32))
+    hashed_password = Column(String(255))
+    provider = Column(String(32))
+    mfa_enabled = Column(Boolean, default=False)
+    mfa_secret = Column(String(64))
+
+
+class UniqueUser(Base):
+    __tablename__ = "unique_users"
+    id = Column(Integer, primary_key=True)
+    username = Column(String(255), unique=True)
+    email = Column(String(255), unique=True)
+    phone = Column(String(32))
+    hashed_password = Column(String(255))
+    provider = Column(String(32))
+    mfa_enabled = Column(Boolean, default=False)
+    mfa_secret = Column(String(64))
+
+
+async def sqlite_database(model=User, **options) -> SQLDatabase:
+    """A SQLDatabase on a fresh SQLite file with the users table created (the identity table is not)."""
+    path = tempfile.mktemp(suffix=".db")
+    db = SQLDatabase(f"sqlite+aiosqlite:///{path}", model, echo=False, **options)
+    async with db.engine.begin() as connection:
+        await connection.run_sync(model.__table__.create)
+    return db
+
+
+def mongo_database() -> MongoDB:
+    db = MongoDB("mongodb://127.0.0.1:1", "authy", "users")
+    client = AsyncMongoMockClient()
+    db.db = client["authy"]
+    db.collection = db.db["users"]
+    db.profiles = db.db["mirrored_profiles"]
+    return db
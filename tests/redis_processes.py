@@ -0,0 +1,65 @@
+import os
+import random
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+
+
+def _bindable(port: int) -> bool:
+    with socket.socket() as sock:
+        try:
+            sock.bind(("127.0.0.1", port))
+        except OSError:
+            return False
+    return True
+
+
+def free_port() -> int:
+    # Cluster nodes also listen on port + 10000 for their bus
+    while True:
+        port = random.randint(20000, 40000)
+        if _bindable(port) and _bindable(port + 10000):
+            return port
+
+
+def wait_until(condition, timeout: float = 30.0, interval: float = 0.1):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return
+        time.sleep(interval)
+    raise TimeoutError("Condition not met in time")
+
+
+class RedisProcesses:
+    """Starts throwaway redis-server and redis-sentinel processes in a temporary directory."""
+
+    def __init__(self):
+        self.directory = tempfile.mkdtemp(prefix="authy-redis-")
+        self.processes = []
+
+    def start(self, *args, sentinel: bool = False) -> int:
+        port = free_port()
+        if sentinel:
+            config = os.path.join(self.directory, f"sentinel-{port}.conf")
+            with open(config, "w") as file:
+                file.write("\n".join(args) + "\n")
+            command = ["redis-sentinel", config, "--port", str(port)]
+        else:
+            command = ["redis-server", "--port", str(port), "--save", "", "--appendonly", "no", *args]
+        self.processes.append(subprocess.Popen(command, cwd=self.directory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        wait_until(lambda: self.cli(port, "PING") == "PONG")
+        return port
+
+    @staticmethod
+    def cli(port: int, *args) -> str:
+        result = subprocess.run(["redis-cli", "-p", str(port), *args], capture_output=True, text=True)
+        return result.stdout.strip()
+
+    def stop(self):
+        for process in self.processes:
+            process.kill()
+            process.wait()
+        shutil.rmtree(self.directory, ignore_errors=True)
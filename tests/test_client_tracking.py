@@ -0,0 +1,153 @@
+import asyncio
+import time
+
+import fakeredis
+import pytest
+from redis.asyncio import Redis
+
+from authy_package.cache.redis_cache import RedisCaching
+
+
+async def eventually(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError("Condition not met in time")
+        await asyncio.sleep(0.01)
+
+
+async def tracking_cache(port: int) -> RedisCaching:
+    cache = RedisCaching(f"redis://127.0.0.1:{port}", client_tracking=True)
+    await cache.start_tracking()
+    await eventually(lambda: cache._tracking_active)
+    return cache
+
+
+@pytest.mark.integration
+def test_deleted_token_is_never_served_from_the_local_cache(redis_processes):
+    port = redis_processes.start()
+
+    async def scenario():
+        cache, other = await tracking_cache(port), Redis(port=port)
+        try:
+            access_token, _ = await cache.create_token_pair("jane")
+            assert await cache.validate_access_token(access_token) == "jane"
+            assert await cache.validate_access_token(access_token) == "jane"
+            assert (cache.local_cache_misses, cache.local_cache_hits) == (1, 1)
+
+            # Another process revokes the token
+            await other.delete(cache.keys.access_token(access_token))
+            await eventually(lambda: not cache._local_cache)
+            assert await cache.validate_access_token(access_token) is None
+        finally:
+            await other.aclose()
+            await cache.close()
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.integration
+def test_rotated_token_is_reread(redis_processes):
+    port = redis_processes.start()
+
+    async def scenario():
+        cache, other = await tracking_cache(port), Redis(port=port)
+        try:
+            access_token, _ = await cache.create_token_pair("jane")
+            assert await cache.validate_access_token(access_token) == "jane"
+
+            await other.set(cache.keys.access_token(access_token), "john", ex=60)
+            await eventually(lambda: not cache._local_cache)
+            assert await cache.validate_access_token(access_token) == "john"
+        finally:
+            await other.aclose()
+            await cache.close()
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.integration
+def test_expired_token_is_dropped_locally(redis_processes):
+    port = redis_processes.start()
+
+    async def scenario():
+        cache, other = await tracking_cache(port), Redis(port=port)
+        try:
+            access_token, _ = await cache.create_token_pair("jane")
+            await other.pexpire(cache.keys.access_token(access_token), 200)
+            assert await cache.validate_access_token(access_token) == "jane"
+            await asyncio.sleep(0.3)
+            # The local copy expires with the key, even before Redis reports the expiry
+            assert await cache.validate_access_token(access_token) is None
+        finally:
+            await other.aclose()
+            await cache.close()
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.integration
+def test_lost_tracking_connection_clears_the_local_cache(redis_processes):
+    port = redis_processes.start()
+
+    async def scenario():
+        cache, other = await tracking_cache(port), Redis(port=port)
+        try:
+            access_token, _ = await cache.create_token_pair("jane")
+            await cache.validate_access_token(access_token)
+            assert cache._local_cache
+
+            await other.execute_command("CLIENT", "KILL", "TYPE", "pubsub")
+            await eventually(lambda: not cache._tracking_active)
+            assert not cache._local_cache
+
+            # While tracking is down, a revocation is seen at once since every read goes to Redis
+            await other.delete(cache.keys.access_token(access_token))
+            assert await cache.validate_access_token(access_token) is None
+            await eventually(lambda: cache._tracking_active)
+        finally:
+            await other.aclose()
+            await cache.close()
+
+    asyncio.run(scenario())
+
+
+def test_invalidation_during_a_read_keeps_the_result_out_of_the_local_cache():
+    async def scenario():
+        cache = RedisCaching("redis://127.0.0.1:1", client_tracking=True)
+        cache.redis = cache.replica = fakeredis.FakeAsyncRedis()
+        # Tracking is simulated: the test delivers the invalidation itself
+        cache._tracking_active = True
+        access_token, _ = await cache.create_token_pair("jane")
+
+        pipeline = cache.replica.pipeline
+
+        class InvalidatedPipeline:
+            def __init__(self, *args, **kwargs):
+                self.pipe = pipeline(*args, **kwargs)
+
+            async def __aenter__(self):
+                await self.pipe.__aenter__()
+                return self
+
+            async def __aexit__(self, *exc_info):
+                return await self.pipe.__aexit__(*exc_info)
+
+            def __getattr__(self, name):
+                return getattr(self.pipe, name)
+
+            async def execute(self):
+                result = await self.pipe.execute()
+                # An invalidation arrives while the reply is on its way
+                cache._tracking_epoch += 1
+                return result
+
+        cache.replica.pipeline = InvalidatedPipeline
+        assert await cache.validate_access_token(access_token) == "jane"
+        assert not cache._local_cache
+
+        cache.replica.pipeline = pipeline
+        assert await cache.validate_access_token(access_token) == "jane"
+        assert cache.keys.access_token(access_token) in cache._local_cache
+
+    asyncio.run(scenario())
@@ -0,0 +1,235 @@
+import asyncio
+import datetime
+import gzip
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from botocore.exceptions import ClientError
+
+from authy_package.cognito.cognito_manager import CognitoManager
+from authy_package.utils.resilience import AdaptiveConcurrency
+
+POOL_ID = "us-east-1_bulk"
+
+
+def client_error(code: str, operation: str) -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": code}}, operation)
+
+
+class AdminClient:
+    """
+    Answers AdminUpdateUserAttributes like Cognito would: users in `throttled` are throttled that many
+    times before the call goes through, users in `missing` do not exist, and calls for users in `blocked`
+    wait until `release` is set.
+    """
+
+    def __init__(self, throttled: dict = None, missing=(), blocked=()):
+        self.throttled = dict(throttled or {})
+        self.missing = set(missing)
+        self.blocked = set(blocked)
+        self.release = threading.Event()
+        self.calls = []
+
+    def admin_update_user_attributes(self, UserPoolId, Username, UserAttributes):
+        assert UserPoolId == POOL_ID
+        self.calls.append(Username)
+        if Username in self.blocked:
+            self.release.wait(5)
+        if self.throttled.get(Username):
+            self.throttled[Username] -= 1
+            raise client_error("TooManyRequestsException", "AdminUpdateUserAttributes")
+        if Username in self.missing:
+            raise client_error("UserNotFoundException", "AdminUpdateUserAttributes")
+        return {"ResponseMetadata": {"HTTPStatusCode": 200}}
+
+
+class ListingClient:
+    """
+    Answers ListUsers from `usernames`, `page_size` users per page, honouring `username ^= "<prefix>"`
+    filters; fails with `failure` once `fail_after` pages were served.
+    """
+
+    def __init__(self, usernames, page_size: int = 2, fail_after: int = None, failure: str = "InternalErrorException"):
+        self.usernames = sorted(usernames)
+        self.page_size = page_size
+        self.fail_after = fail_after
+        self.failure = failure
+        self.filters = []
+        self.pages = 0
+
+    def list_users(self, UserPoolId, Limit, Filter=None, AttributesToGet=None, PaginationToken=None):
+        assert UserPoolId == POOL_ID
+        if self.fail_after is not None and self.pages >= self.fail_after:
+            raise client_error(self.failure, "ListUsers")
+        self.pages += 1
+        if PaginationToken is None:
+            self.filters.append(Filter)
+        usernames = self.usernames
+        if Filter:
+            prefix = Filter.partition(' ^= "')[2][:-1].replace('\\"', '"')
+            usernames = [username for username in usernames if username.startswith(prefix)]
+        start = int(PaginationToken or 0)
+        page = usernames[start:start + min(Limit, self.page_size)]
+        created = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+        response = {"Users": [{"Username": username, "UserCreateDate": created} for username in page]}
+        if start + len(page) < len(usernames):
+            response["PaginationToken"] = str(start + len(page))
+        return response
+
+
+def manager_with(client) -> CognitoManager:
+    manager = CognitoManager("us-east-1", POOL_ID, "client-id", failure_rate=None)
+    manager._admin_client = lambda max_connections: (client, ThreadPoolExecutor(max_workers=max_connections))
+    return manager
+
+
+def updates(*usernames):
+    return [(username, [{"Name": "custom:plan", "Value": "pro"}]) for username in usernames]
+
+
+def test_throttled_calls_are_retried_and_counted():
+    async def scenario():
+        client = AdminClient(throttled={"jane": 2, "john": 5}, missing={"gone"})
+        manager = manager_with(client)
+        concurrency = AdaptiveConcurrency(backoff_base=0.001)
+        results = {
+            result["username"]: result
+            async for result in manager.bulk_update_user_attributes(updates("jane", "john", "gone", "joe"), concurrency, max_retries=3)
+        }
+
+        assert results["jane"] == {"username": "jane", "response": {}, "attempts": 3}
+        assert results["joe"] == {"username": "joe", "response": {}, "attempts": 1}
+        # Throttled beyond max_retries: reported with the last throttling error
+        assert results["john"]["attempts"] == 4 and "TooManyRequestsException" in results["john"]["Error"]
+        assert client.calls.count("john") == 4
+        # Cognito answered, so the call is not retried
+        assert results["gone"]["attempts"] == 1 and "UserNotFoundException" in results["gone"]["Error"]
+        assert client.calls.count("gone") == 1
+        # Throttling cut the limit
+        assert concurrency.epoch > 0
+
+    asyncio.run(scenario())
+
+
+def test_results_are_yielded_in_completion_order():
+    async def scenario():
+        client = AdminClient(blocked={"slow"})
+        manager = manager_with(client)
+        bulk = manager.bulk_update_user_attributes(updates("slow", "fast"))
+        try:
+            assert (await bulk.__anext__())["username"] == "fast"
+            client.release.set()
+            assert (await bulk.__anext__())["username"] == "slow"
+        finally:
+            client.release.set()
+            await bulk.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_closing_the_iterator_early_cancels_pending_calls():
+    async def scenario():
+        client = AdminClient(blocked={f"user{index}" for index in range(1, 100)})
+        manager = manager_with(client)
+        consumed = []
+
+        def requests():
+            for username, attributes in updates(*(f"user{index}" for index in range(100))):
+                consumed.append(username)
+                yield username, attributes
+
+        bulk = manager.bulk_update_user_attributes(requests(), AdaptiveConcurrency(initial=4, maximum=4))
+        try:
+            assert (await bulk.__anext__())["username"] == "user0"
+            await bulk.aclose()
+            await asyncio.sleep(0)
+            assert all(task.done() for task in asyncio.all_tasks() if task is not asyncio.current_task())
+            # Only the read-ahead window was taken from the requests
+            assert len(consumed) <= 5
+        finally:
+            client.release.set()
+        calls = len(client.calls)
+        await asyncio.sleep(0.05)
+        assert len(client.calls) == calls
+
+    asyncio.run(scenario())
+
+
+def test_listing_pages_through_the_pool():
+    async def scenario():
+        client = ListingClient([f"user{index}" for index in range(5)])
+        manager = manager_with(client)
+        usernames = [user["Username"] async for user in manager.list_users(filter='status = "Enabled"')]
+        assert usernames == [f"user{index}" for index in range(5)]
+        assert client.filters == ['status = "Enabled"'] and client.pages == 3
+
+    asyncio.run(scenario())
+
+
+def test_segments_are_scanned_in_parallel_with_escaped_prefixes():
+    async def scenario():
+        client = ListingClient(["a1", "a2", "b1", 'q"1', "z9"])
+        manager = manager_with(client)
+        usernames = [user["Username"] async for user in manager.list_users(segments=["a", "b", 'q"'])]
+
+        assert sorted(usernames) == ["a1", "a2", "b1", 'q"1']
+        assert sorted(client.filters) == ['username ^= "a"', 'username ^= "b"', 'username ^= "q\\""']
+
+    asyncio.run(scenario())
+
+
+def test_filter_and_segments_are_mutually_exclusive():
+    async def scenario():
+        manager = manager_with(ListingClient([]))
+        with pytest.raises(ValueError, match="either filter or segments"):
+            async for _ in manager.list_users(filter='status = "Enabled"', segments=["a"]):
+                pass
+
+    asyncio.run(scenario())
+
+
+def test_failed_page_fails_the_listing():
+    async def scenario():
+        manager = manager_with(ListingClient(["a1", "a2", "a3"], page_size=1, fail_after=1))
+        with pytest.raises(ClientError, match="InternalErrorException"):
+            async for _ in manager.list_users():
+                pass
+
+    asyncio.run(scenario())
+
+
+def read_lines(path, opener=open):
+    with opener(path, "rt", encoding="utf-8") as file:
+        return [json.loads(line) for line in file]
+
+
+@pytest.mark.parametrize("name, opener", [("users.jsonl", open), ("users.jsonl.gz", gzip.open)])
+def test_export_writes_every_user_once_complete(tmp_path, name, opener):
+    async def scenario():
+        manager = manager_with(ListingClient([f"user{index}" for index in range(5)]))
+        path = tmp_path / name
+        assert await manager.export_users(str(path), chunk_size=2) == 5
+        return path
+
+    path = asyncio.run(scenario())
+    users = read_lines(path, opener)
+    assert [user["Username"] for user in users] == [f"user{index}" for index in range(5)]
+    assert users[0]["UserCreateDate"] == "2024-01-01T00:00:00+00:00"
+    assert [entry.name for entry in tmp_path.iterdir()] == [name]
+
+
+def test_failed_export_leaves_no_partial_file(tmp_path):
+    path = tmp_path / "users.jsonl"
+    path.write_text("previous export\n")
+
+    async def scenario():
+        manager = manager_with(ListingClient([f"user{index}" for index in range(5)], page_size=1, fail_after=3))
+        with pytest.raises(ClientError):
+            await manager.export_users(str(path), chunk_size=1)
+
+    asyncio.run(scenario())
+    # The previous export is kept and the partial one removed
+    assert path.read_text() == "previous export\n"
+    assert [entry.name for entry in tmp_path.iterdir()] == ["users.jsonl"]
@@ -0,0 +1,94 @@
+import asyncio
+
+import fakeredis
+import pytest
+
+from authy_package.cache.memory_cache import MemoryCaching
+from authy_package.cache.redis_cache import RedisCaching
+
+
+async def memory_cache():
+    return MemoryCaching()
+
+
+async def redis_cache():
+    cache = RedisCaching("redis://127.0.0.1:1")
+    cache.redis = cache.replica = fakeredis.FakeAsyncRedis()
+    return cache
+
+
+@pytest.mark.parametrize("make_cache", [memory_cache, redis_cache])
+def test_social_refresh_tokens_behave_like_redis(make_cache):
+    async def scenario():
+        cache = await make_cache()
+        assert await cache.retrieve_social_refresh_token("jane") is None
+
+        await cache.store_social_token("jane", "access", "refresh", exp=60)
+        assert await cache.retrieve_social_refresh_token("jane") == "refresh"
+        # A refresh that returns no new refresh token keeps the stored one
+        await cache.update_social_token("jane", "access-2")
+        assert await cache.retrieve_access_token("jane") == "access-2"
+        assert await cache.retrieve_social_refresh_token("jane") == "refresh"
+        await cache.update_social_token("jane", "access-3", "refresh-3")
+        assert await cache.retrieve_social_refresh_token("jane") == "refresh-3"
+
+        await cache.delete_refresh_token("jane")
+        assert await cache.retrieve_social_refresh_token("jane") is None
+
+    asyncio.run(scenario())
+
+
+def test_entries_expire():
+    async def scenario():
+        cache = MemoryCaching(token_expiration_time=0.05)
+        access_token, refresh_token = await cache.create_token_pair("jane")
+        assert await cache.validate_access_token(access_token) == "jane"
+
+        await asyncio.sleep(0.1)
+        assert await cache.validate_access_token(access_token) is None
+        assert await cache.validate_refresh_token(refresh_token) == "jane"
+
+        # Expired entries are dropped on the next write even if never read again
+        await cache.store_reset_token("jane@example.com", "token", expiration=0.05)
+        await asyncio.sleep(0.1)
+        await cache.store_reset_token("john@example.com", "token")
+        assert (MemoryCaching.RESET_TOKEN, "jane@example.com") not in cache._entries
+
+    asyncio.run(scenario())
+
+
+def test_least_recently_used_entries_are_evicted():
+    async def scenario():
+        cache = MemoryCaching(max_entries=3)
+        for email in ("a@example.com", "b@example.com", "c@example.com"):
+            await cache.store_reset_token(email, email)
+        assert await cache.get_reset_token("a@example.com") == "a@example.com"
+
+        await cache.store_reset_token("d@example.com", "d@example.com")
+        assert cache.evictions == 1
+        assert await cache.get_reset_token("b@example.com") is None
+        assert [await cache.get_reset_token(email) for email in ("a@example.com", "c@example.com", "d@example.com")] == [
+            "a@example.com", "c@example.com", "d@example.com"
+        ]
+
+    asyncio.run(scenario())
+
+
+def test_expiry_heap_is_compacted():
+    async def scenario():
+        cache = MemoryCaching()
+        for index in range(5000):
+            await cache.store_reset_token("jane@example.com", f"token-{index}", expiration=0.05)
+        # Rewrites leave stale heap items behind until the heap is rebuilt from the live entries
+        assert len(cache._expiry_heap) <= 2 * len(cache._entries) + 1025
+        assert await cache.get_reset_token("jane@example.com") == "token-4999"
+
+        cache._compact()
+        assert len(cache._expiry_heap) == len(cache._entries) == 1
+
+        # The rebuilt heap still expires the entry
+        await asyncio.sleep(0.1)
+        await cache.store_reset_token("john@example.com", "token")
+        assert list(cache._entries) == [(MemoryCaching.RESET_TOKEN, "john@example.com")]
+
+    asyncio.run(scenario())
@@ -0,0 +1,128 @@
+import asyncio
+
+from passlib.hash import bcrypt
+
+from authy_package.bench.fakes import InMemoryDatabase
+from authy_package.cache.memory_cache import MemoryCaching
+from authy_package.core.auth_manager import TraditionalAuthManager
+from authy_package.telemetry import MetricsInstrumentation, MetricsRegistry, instrument
+from authy_package.telemetry.instrumentation import Instrumentation
+from authy_package.utils.security import SecurityManager
+
+
+class Mailjet:
+    """Records the messages sent instead of calling Mailjet."""
+
+    def __init__(self, status_code: int = 200):
+        self.status_code = status_code
+        self.sent = []
+
+    def send(self, data):
+        self.sent.append(data)
+        return type("Response", (), {"status_code": self.status_code, "json": lambda self: {}})()
+
+
+async def manager_with_user(metrics: Instrumentation, mailjet: Mailjet = None, debug_timings: bool = False):
+    db, cache = InMemoryDatabase(), MemoryCaching()
+    await db.create_user({"username": "jane", "email": "jane@example.com", "hashed_password": bcrypt.using(rounds=4).hash("secret")})
+    security = SecurityManager(db, cache, api_key="key", api_secret="secret")
+    security.mailjet_client = mailjet or Mailjet()
+    return TraditionalAuthManager(db, cache, security_manager=security, instrumentation=metrics, debug_timings=debug_timings)
+
+
+def test_password_reset_emails_are_counted():
+    async def scenario():
+        metrics, mailjet = MetricsInstrumentation(), Mailjet()
+        manager = await manager_with_user(metrics, mailjet)
+        await manager.request_password_reset(email="jane@example.com", username=None, phone=None)
+        assert len(mailjet.sent) == 1
+
+        manager.security_manager.mailjet_client = Mailjet(status_code=500)
+        for _ in range(2):
+            try:
+                await manager.request_password_reset(email="jane@example.com", username=None, phone=None)
+            except ValueError:
+                pass
+
+        exposition = metrics.registry.exposition()
+        assert 'authy_reset_emails_total{outcome="success"} 1\n' in exposition
+        assert 'authy_reset_emails_total{outcome="failure"} 2\n' in exposition
+        assert 'authy_flow_duration_seconds_count{flow="traditional.request_password_reset"} 3\n' in exposition
+
+    asyncio.run(scenario())
+
+
+def test_logins_and_cache_lookups_are_counted():
+    async def scenario():
+        metrics = MetricsInstrumentation()
+        manager = await manager_with_user(metrics)
+        tokens = await manager.login_user(username="jane", password="secret")
+        try:
+            await manager.login_user(username="jane", password="wrong")
+        except ValueError:
+            pass
+        assert await manager.cache.validate_access_token(tokens["access_token"]) == "jane"
+        assert await manager.cache.validate_access_token("unknown") is None
+
+        exposition = metrics.registry.exposition()
+        assert 'authy_logins_total{method="password",outcome="success"} 1\n' in exposition
+        assert 'authy_logins_total{method="password",outcome="failure"} 1\n' in exposition
+        assert 'authy_cache_lookups_total{operation="validate_access_token",result="hit"} 1\n' in exposition
+        assert 'authy_cache_lookups_total{operation="validate_access_token",result="miss"} 1\n' in exposition
+        assert "authy_cache_hit_ratio 0.5\n" in exposition
+        assert 'authy_db_call_duration_seconds_count{backend="InMemoryDatabase",operation="get_user_by_identifier"} 2\n' in exposition
+
+    asyncio.run(scenario())
+
+
+def test_debug_timings_break_a_flow_down_by_phase():
+    async def scenario():
+        manager = await manager_with_user(Instrumentation(), debug_timings=True)
+        result = await manager.login_user(username="jane", password="secret")
+        assert {"db.get_user_by_identifier", "password.verify", "cache.create_token_pair"} <= result["timings"].keys()
+        assert all(milliseconds >= 0 for milliseconds in result["timings"].values())
+
+    asyncio.run(scenario())
+
+
+def test_histogram_exposition_is_cumulative():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        histogram.labels("/login").observe(value)
+
+    lines = registry.exposition().splitlines()
+    assert 'latency_seconds_bucket{route="/login",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{route="/login",le="1.0"} 3' in lines
+    assert 'latency_seconds_bucket{route="/login",le="+Inf"} 4' in lines
+    assert 'latency_seconds_sum{route="/login"} 6.05' in lines
+    assert 'latency_seconds_count{route="/login"} 4' in lines
+
+
+def test_proxy_instruments_public_methods_only():
+    class Component:
+        def __init__(self):
+            self.setting = 1
+
+        def public(self):
+            return "public"
+
+        def _private(self):
+            return "private"
+
+    class Recorder(Instrumentation):
+        def __init__(self):
+            self.calls = []
+
+        def record(self, name, duration, attributes, error=None, result=None):
+            self.calls.append((name, attributes["authy.backend"], result))
+
+    recorder, component = Recorder(), Component()
+    proxy = instrument(component, recorder, "thing")
+    assert proxy.public() == "public"
+    assert proxy._private() == "private"
+    proxy.setting = 2
+
+    assert recorder.calls == [("thing.public", "Component", "public")]
+    assert component.setting == 2
+    assert instrument(component, None, "thing") is component
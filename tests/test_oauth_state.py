@@ -0,0 +1,126 @@
+import asyncio
+
+import fakeredis
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from authy_package.cache.abstract_cache import AbstractCache
+from authy_package.cache.memory_cache import MemoryCaching
+from authy_package.cache.mongo_cache import MongoCaching
+from authy_package.cache.redis_cache import RedisCaching
+from authy_package.cache.sql_cache import SQLCaching
+from authy_package.social.oauth_state import OAuthStateManager
+
+
+async def memory_cache():
+    return MemoryCaching()
+
+
+async def redis_cache():
+    cache = RedisCaching("redis://127.0.0.1:1")
+    cache.redis = cache.replica = fakeredis.FakeAsyncRedis()
+    return cache
+
+
+async def sql_cache():
+    cache = SQLCaching("sqlite+aiosqlite://")
+    await cache.create_table()
+    return cache
+
+
+async def mongo_cache():
+    return MongoCaching(AsyncMongoMockClient(), "authy")
+
+
+CACHES = [memory_cache, redis_cache, sql_cache, mongo_cache]
+
+
+@pytest.mark.parametrize("make_cache", CACHES)
+def test_claim_once(make_cache):
+    async def scenario():
+        cache = await make_cache()
+        assert await cache.claim_once("oauth-state:a", 60)
+        assert not await cache.claim_once("oauth-state:a", 60)
+        assert await cache.claim_once("oauth-state:b", 60)
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("make_cache", CACHES)
+def test_expired_claim_can_be_claimed_again(make_cache):
+    async def scenario():
+        cache = await make_cache()
+        assert await cache.claim_once("oauth-state:a", 0.05)
+        await asyncio.sleep(0.1)
+        assert await cache.claim_once("oauth-state:a", 60)
+        assert not await cache.claim_once("oauth-state:a", 60)
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("make_cache", CACHES)
+def test_state_is_accepted_once(make_cache):
+    async def scenario():
+        states = OAuthStateManager("secret", cache=await make_cache())
+        grant = states.issue("github")
+        flow = await states.validate(grant["state"], provider="github")
+        assert flow["provider"] == "github"
+        with pytest.raises(ValueError, match="already been used"):
+            await states.validate(grant["state"], provider="github")
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_validations_accept_a_state_once():
+    async def scenario():
+        states = OAuthStateManager("secret", cache=await sql_cache())
+        grant = states.issue("github")
+        results = await asyncio.gather(*(states.validate(grant["state"]) for _ in range(5)), return_exceptions=True)
+        assert sum(not isinstance(result, Exception) for result in results) == 1
+
+    asyncio.run(scenario())
+
+
+def test_memory_claims_survive_eviction():
+    async def scenario():
+        cache = MemoryCaching(max_entries=2)
+        assert await cache.claim_once("oauth-state:a", 60)
+        for index in range(10):
+            await cache.store_reset_token(f"user{index}@example.com", "token")
+        assert cache.evictions == 8
+        assert not await cache.claim_once("oauth-state:a", 60)
+
+    asyncio.run(scenario())
+
+
+def test_memory_claims_expire():
+    async def scenario():
+        cache = MemoryCaching()
+        for index in range(100):
+            await cache.claim_once(f"oauth-state:{index}", 0.01)
+        await asyncio.sleep(0.02)
+        assert await cache.claim_once("oauth-state:0", 60)
+        assert list(cache._claims) == ["oauth-state:0"]
+
+    asyncio.run(scenario())
+
+
+class LegacyCache(MemoryCaching):
+    """A custom backend written before claim_once existed."""
+    claim_once = AbstractCache.claim_once
+
+
+def test_backend_without_claim_once_still_works():
+    # Subclasses written before claim_once existed must still instantiate
+    assert "claim_once" not in AbstractCache.__abstractmethods__
+
+    async def scenario():
+        cache = LegacyCache()
+        await cache.store_reset_token("jane@example.com", "token")
+        assert await cache.get_reset_token("jane@example.com") == "token"
+        with pytest.raises(NotImplementedError):
+            await cache.claim_once("oauth-state:a", 60)
+
+    asyncio.run(scenario())
+    with pytest.raises(ValueError, match="claim_once"):
+        OAuthStateManager("secret", cache=LegacyCache())
@@ -0,0 +1,45 @@
+import asyncio
+import time
+
+import httpx
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from authy_package.social.oidc import OIDCProvider
+
+ISSUER = "https://idp.example.com"
+
+private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+jwk = {**jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key(), as_dict=True), "kid": "key-1", "alg": "RS256"}
+
+
+def id_token(**claims) -> str:
+    now = int(time.time())
+    claims = {"iss": ISSUER, "aud": "client", "sub": "user-1", "iat": now, "exp": now + 300, **claims}
+    return jwt.encode(claims, private_key, algorithm="RS256", headers={"kid": "key-1"})
+
+
+def provider(jwks_uri: str, **config) -> OIDCProvider:
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, json={"keys": [jwk]}))
+    return OIDCProvider(
+        "idp", "client", config={"token_endpoint": f"{ISSUER}/token", "jwks_uri": jwks_uri, **config},
+        http_client=httpx.AsyncClient(transport=transport)
+    )
+
+
+def test_id_token_of_the_configured_issuer_is_accepted():
+    idp = provider(f"{ISSUER}/keys/accepted", issuer=ISSUER)
+    assert asyncio.run(idp.verify_id_token(id_token()))["sub"] == "user-1"
+
+
+def test_id_token_of_another_issuer_is_rejected():
+    idp = provider(f"{ISSUER}/keys/other", issuer=ISSUER)
+    with pytest.raises(ValueError, match="issuer"):
+        asyncio.run(idp.verify_id_token(id_token(iss="https://other-tenant.example.com")))
+
+
+def test_verification_fails_closed_without_an_issuer():
+    idp = provider(f"{ISSUER}/keys/no-issuer")
+    with pytest.raises(ValueError, match="no issuer configured"):
+        asyncio.run(idp.verify_id_token(id_token()))
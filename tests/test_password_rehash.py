@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+from passlib.hash import bcrypt
+
+from authy_package.bench.fakes import InMemoryDatabase
+from authy_package.cache.memory_cache import MemoryCaching
+from authy_package.core.auth_manager import TraditionalAuthManager
+from authy_package.utils.security import configure_password_hashing, hash_password, password_needs_update, verify_password
+
+
+async def manager_with_user(password: str):
+    db = InMemoryDatabase()
+    await db.create_user({"username": "jane", "email": "jane@example.com", "hashed_password": hash_password(password)})
+    return TraditionalAuthManager(db), db.indexes["username"]["jane"]
+
+
+def test_rehash_replaces_the_verified_hash():
+    async def scenario():
+        manager, user = await manager_with_user("old-password")
+        verified_hash = user["hashed_password"]
+
+        await manager._rehash_password("jane", "old-password", verified_hash)
+        assert user["hashed_password"] != verified_hash
+        assert verify_password("old-password", user["hashed_password"])
+
+    asyncio.run(scenario())
+
+
+def test_rehash_does_not_undo_a_concurrent_reset():
+    async def scenario():
+        manager, user = await manager_with_user("old-password")
+        verified_hash = user["hashed_password"]
+
+        # The password is reset while the login's rehash is still hashing
+        rehash = asyncio.ensure_future(manager._rehash_password("jane", "old-password", verified_hash))
+        await manager.db.update_user_password("jane", hash_password("new-password"))
+        await rehash
+
+        assert verify_password("new-password", user["hashed_password"])
+        assert not verify_password("old-password", user["hashed_password"])
+
+    asyncio.run(scenario())
+
+
+class MFA:
+    """Accepts a single code instead of checking a TOTP secret."""
+
+    async def verify_mfa_code(self, mfa_code, username=None, email=None, phone=None):
+        return mfa_code == "123456"
+
+
+@pytest.fixture
+def cheap_hashing():
+    # Hashes below 5 rounds need an update; both costs keep the tests fast
+    configure_password_hashing("bcrypt", rounds=5)
+    yield
+    configure_password_hashing("bcrypt")
+
+
+async def login_manager(mfa_enabled: bool = False):
+    db = InMemoryDatabase()
+    await db.create_user({
+        "username": "jane", "email": "jane@example.com", "mfa_enabled": mfa_enabled,
+        "hashed_password": bcrypt.using(rounds=4).hash("old-password")
+    })
+    manager = TraditionalAuthManager(db, MemoryCaching(), mfa_manager=MFA())
+    return manager, db.indexes["username"]["jane"]
+
+
+def test_login_rehashes_an_outdated_hash(cheap_hashing):
+    async def scenario():
+        manager, user = await login_manager()
+        outdated = user["hashed_password"]
+        assert password_needs_update(outdated)
+
+        with pytest.raises(ValueError, match="Invalid credentials"):
+            await manager.login_user(username="jane", password="wrong")
+        await manager.wait_for_rehashes()
+        assert user["hashed_password"] == outdated
+
+        assert "access_token" in await manager.login_user(username="jane", password="old-password")
+        await manager.wait_for_rehashes()
+        assert user["hashed_password"].startswith("$2b$05$")
+        assert verify_password("old-password", user["hashed_password"])
+        assert not password_needs_update(user["hashed_password"])
+
+    asyncio.run(scenario())
+
+
+def test_login_rehashes_only_after_the_mfa_code_is_verified(cheap_hashing):
+    async def scenario():
+        manager, user = await login_manager(mfa_enabled=True)
+        outdated = user["hashed_password"]
+
+        with pytest.raises(ValueError, match="Invalid MFA code"):
+            await manager.login_user(username="jane", password="old-password", mfa_code="000000")
+        await manager.wait_for_rehashes()
+        assert user["hashed_password"] == outdated
+
+        await manager.login_user(username="jane", password="old-password", mfa_code="123456")
+        await manager.wait_for_rehashes()
+        assert user["hashed_password"] != outdated and not password_needs_update(user["hashed_password"])
+
+    asyncio.run(scenario())
+
+
+def test_login_rehash_keeps_a_password_changed_meanwhile(cheap_hashing):
+    async def scenario():
+        manager, user = await login_manager()
+        await manager.login_user(username="jane", password="old-password")
+        # The password is reset before the login's background rehash writes its hash
+        await manager.db.update_user_password("jane", hash_password("new-password"))
+        reset_hash = user["hashed_password"]
+        await manager.wait_for_rehashes()
+
+        assert user["hashed_password"] == reset_hash
+        assert verify_password("new-password", user["hashed_password"])
+
+    asyncio.run(scenario())
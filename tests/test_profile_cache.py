@@ -0,0 +1,157 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from authy_package.social.oidc import OIDCProvider
+from authy_package.social.profile_cache import ProfileCache
+
+ISSUER = "https://idp.example.com"
+
+
+class UserInfo:
+    """A userinfo endpoint that tags each profile version with an ETag and answers If-None-Match with 304."""
+
+    def __init__(self, delay: float = 0.0):
+        self.profile = {"sub": "user-1", "name": "Jane"}
+        self.version = 1
+        self.delay = delay
+        self.status_code = 200
+        self.requests = []
+
+    def change(self, **claims):
+        self.profile = {**self.profile, **claims}
+        self.version += 1
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/revoke":
+            return httpx.Response(200)
+        self.requests.append(request)
+        await asyncio.sleep(self.delay)
+        if self.status_code != 200:
+            return httpx.Response(self.status_code, json={"error": "invalid_token"})
+        etag = f'"v{self.version}"'
+        if request.headers.get("if-none-match") == etag:
+            return httpx.Response(304, headers={"ETag": etag})
+        return httpx.Response(200, content=json.dumps(self.profile).encode(), headers={"ETag": etag, "Content-Type": "application/json"})
+
+
+def provider(userinfo: UserInfo, **options) -> OIDCProvider:
+    config = {"token_endpoint": f"{ISSUER}/token", "userinfo_endpoint": f"{ISSUER}/userinfo", "revocation_endpoint": f"{ISSUER}/revoke"}
+    http_client = httpx.AsyncClient(transport=httpx.MockTransport(userinfo))
+    return OIDCProvider("idp", "client", config=config, http_client=http_client, profile_cache=ProfileCache(**options))
+
+
+def test_fresh_profiles_are_served_without_a_request():
+    async def scenario():
+        userinfo = UserInfo()
+        idp = provider(userinfo, ttl=60)
+        assert await idp.get_user_info("token") == await idp.get_user_info("token") == userinfo.profile
+        assert len(userinfo.requests) == 1
+        assert (idp.profile_cache.hits, idp.profile_cache.misses) == (1, 1)
+        # The cache never holds the token itself
+        assert "token" not in idp.profile_cache._entries
+
+    asyncio.run(scenario())
+
+
+def test_expired_profiles_are_revalidated_with_their_etag():
+    async def scenario():
+        userinfo = UserInfo()
+        idp = provider(userinfo, ttl=0)
+        first = await idp.get_user_info("token")
+
+        # Unchanged: a 304 renews the cached profile
+        assert await idp.get_user_info("token") == first
+        assert userinfo.requests[1].headers["if-none-match"] == '"v1"'
+        assert idp.profile_cache.revalidations == 1
+
+        # Changed: the new profile replaces the cached one
+        userinfo.change(name="Jane Doe")
+        assert (await idp.get_user_info("token"))["name"] == "Jane Doe"
+        assert userinfo.requests[2].headers["if-none-match"] == '"v1"'
+        assert await idp.get_user_info("token") == userinfo.profile
+        assert userinfo.requests[3].headers["if-none-match"] == '"v2"'
+        assert idp.profile_cache.hit_ratio() == 0.5
+
+    asyncio.run(scenario())
+
+
+def test_profiles_past_their_stale_ttl_are_fetched_again():
+    async def scenario():
+        userinfo = UserInfo()
+        idp = provider(userinfo, ttl=0, stale_ttl=0.05)
+        await idp.get_user_info("token")
+        await asyncio.sleep(0.1)
+        await idp.get_user_info("token")
+        assert "if-none-match" not in userinfo.requests[1].headers
+        assert idp.profile_cache.misses == 2
+
+    asyncio.run(scenario())
+
+
+def test_rejected_tokens_drop_the_cached_profile():
+    async def scenario():
+        userinfo = UserInfo()
+        idp = provider(userinfo, ttl=0)
+        await idp.get_user_info("token")
+
+        userinfo.status_code = 401
+        with pytest.raises(ValueError, match="401"):
+            await idp.get_user_info("token")
+        assert not idp.profile_cache._entries
+
+        # Nothing is left to revalidate against, so the next read is a full fetch
+        userinfo.status_code = 200
+        await idp.get_user_info("token")
+        assert "if-none-match" not in userinfo.requests[2].headers
+
+    asyncio.run(scenario())
+
+
+def test_revoked_tokens_are_invalidated():
+    async def scenario():
+        userinfo = UserInfo()
+        idp = provider(userinfo, ttl=60)
+        await idp.get_user_info("token")
+        await idp.get_user_info("other-token")
+
+        await idp.revoke("token")
+        await idp.get_user_info("token")
+        await idp.get_user_info("other-token")
+        assert len(userinfo.requests) == 3
+        assert "if-none-match" not in userinfo.requests[2].headers
+
+        idp.profile_cache.invalidate("other-token")
+        await idp.get_user_info("other-token")
+        assert len(userinfo.requests) == 4
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_reads_share_one_request():
+    async def scenario():
+        userinfo = UserInfo(delay=0.05)
+        idp = provider(userinfo)
+        results = await asyncio.gather(*(idp.get_user_info("token") for _ in range(5)))
+        assert all(result == userinfo.profile for result in results)
+        assert len(userinfo.requests) == 1
+
+    asyncio.run(scenario())
+
+
+def test_least_recently_used_profiles_are_evicted():
+    async def scenario():
+        userinfo = UserInfo()
+        idp = provider(userinfo, max_entries=2)
+        for token in ("a", "b", "a", "c"):
+            await idp.get_user_info(token)
+        assert len(userinfo.requests) == 3
+
+        # "b" was the least recently used when "c" was added
+        await idp.get_user_info("a")
+        await idp.get_user_info("b")
+        assert len(userinfo.requests) == 4
+
+    asyncio.run(scenario())
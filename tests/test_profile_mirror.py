@@ -0,0 +1,238 @@
+import asyncio
+import threading
+import time
+
+import httpx
+import jwt
+import pytest
+from botocore.exceptions import ClientError
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from authy_package.cognito.profile_mirror import SOURCE, CognitoProfileMirror
+from authy_package.core.auth_manager import CognitoAuthManager
+from tests.databases import mongo_database, sqlite_database
+
+POOL_ID = "us-east-1_mirror"
+CLIENT_ID = "mirror-client"
+ISSUER = f"https://cognito-idp.us-east-1.amazonaws.com/{POOL_ID}"
+
+private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+jwk = {**jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key(), as_dict=True), "kid": "mirror-key", "alg": "RS256"}
+
+
+def access_token(username: str) -> str:
+    now = int(time.time())
+    claims = {"iss": ISSUER, "username": username, "token_use": "access", "client_id": CLIENT_ID, "iat": now, "exp": now + 300}
+    return jwt.encode(claims, private_key, algorithm="RS256", headers={"kid": "mirror-key"})
+
+
+def attributes(email: str) -> list:
+    return [{"Name": "email", "Value": email}]
+
+
+class CognitoClient:
+    """The boto3 calls the mirror makes, answered from `users` (username -> email)."""
+
+    def __init__(self, users: dict):
+        self.meta = type("Meta", (), {"region_name": "us-east-1"})()
+        self.users = users
+        self.get_user_calls = 0
+        self.error = None
+        self.delay = 0.0
+
+    def get_user(self, AccessToken):
+        self.get_user_calls += 1
+        time.sleep(self.delay)
+        if self.error:
+            raise ClientError({"Error": {"Code": self.error, "Message": self.error}}, "GetUser")
+        username = jwt.decode(AccessToken, options={"verify_signature": False})["username"]
+        return {"Username": username, "UserAttributes": attributes(self.users[username])}
+
+    def admin_get_user(self, UserPoolId, Username):
+        for username, email in self.users.items():
+            if Username in (username, email):
+                return {"Username": username, "UserAttributes": attributes(email)}
+        raise ClientError({"Error": {"Code": "UserNotFoundException", "Message": "User does not exist."}}, "AdminGetUser")
+
+
+class Cognito:
+    """The parts of CognitoManager the mirror and CognitoAuthManager use."""
+
+    def __init__(self, users: dict):
+        self.cognito_client = CognitoClient(users)
+        self.user_pool_id = POOL_ID
+        self.app_client_id = CLIENT_ID
+        self.updated = []
+
+    async def list_users(self, segments=None, concurrency=None):
+        for username, email in list(self.cognito_client.users.items()):
+            yield {"Username": username, "Attributes": attributes(email), "UserStatus": "CONFIRMED"}
+
+    def update_user_email(self, username, email):
+        self.updated.append(username)
+        canonical = self.cognito_client.admin_get_user(POOL_ID, username)["Username"]
+        self.cognito_client.users[canonical] = email
+        return {}
+
+    async def bulk_update_user_attributes(self, updates, concurrency=None, max_retries=8):
+        for username, changes in updates:
+            if username not in self.cognito_client.users:
+                yield {"username": username, "Error": "UserNotFoundException", "attempts": 1}
+                continue
+            self.cognito_client.users[username] = changes[0]["Value"]
+            yield {"username": username, "response": {}, "attempts": 1}
+
+
+async def sqlite_backend():
+    return await sqlite_database()
+
+
+async def mongo_backend():
+    return mongo_database()
+
+
+BACKENDS = [sqlite_backend, mongo_backend]
+
+
+async def mirror_on(make_db, users: dict = None, **options):
+    cognito = Cognito(users or {"jane": "jane@example.com"})
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, json={"keys": [jwk]}))
+    mirror = CognitoProfileMirror(await make_db(), cognito, http_client=httpx.AsyncClient(transport=transport), **options)
+    return mirror, cognito
+
+
+@pytest.mark.parametrize("make_db", BACKENDS)
+def test_reads_are_served_from_the_mirror_once_fetched(make_db):
+    async def scenario():
+        mirror, cognito = await mirror_on(make_db)
+        token = access_token("jane")
+        first = await mirror.get_user_info(token)
+        second = await mirror.get_user_info(token)
+
+        assert first == second == {"Username": "jane", "UserAttributes": attributes("jane@example.com")}
+        assert cognito.cognito_client.get_user_calls == 1
+        assert (mirror.misses, mirror.hits) == (1, 1)
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("make_db", BACKENDS)
+def test_concurrent_reads_share_one_call(make_db):
+    async def scenario():
+        mirror, cognito = await mirror_on(make_db)
+        cognito.cognito_client.delay = 0.05
+        token = access_token("jane")
+        results = await asyncio.gather(*(mirror.get_user_info(token) for _ in range(5)))
+        assert all(result["Username"] == "jane" for result in results)
+        assert cognito.cognito_client.get_user_calls == 1
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("make_db", BACKENDS)
+def test_expired_profiles_are_refreshed_and_served_stale_while_throttled(make_db):
+    async def scenario():
+        mirror, cognito = await mirror_on(make_db, ttl=0)
+        token = access_token("jane")
+        await mirror.get_user_info(token)
+        cognito.cognito_client.users["jane"] = "new@example.com"
+        assert (await mirror.get_user_info(token))["UserAttributes"] == attributes("new@example.com")
+        assert cognito.cognito_client.get_user_calls == 2
+
+        cognito.cognito_client.error = "TooManyRequestsException"
+        assert (await mirror.get_user_info(token))["UserAttributes"] == attributes("new@example.com")
+        assert mirror.stale_hits == 1
+
+        # A rejected token is reported, not answered from the mirror
+        cognito.cognito_client.error = "NotAuthorizedException"
+        assert "Error" in await mirror.get_user_info(token)
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("make_db", BACKENDS)
+def test_invalid_tokens_are_rejected_locally(make_db):
+    async def scenario():
+        mirror, cognito = await mirror_on(make_db)
+        assert "Error" in await mirror.get_user_info("not-a-token")
+        forged = jwt.encode({"username": "jane"}, rsa.generate_private_key(65537, 2048), algorithm="RS256", headers={"kid": "mirror-key"})
+        assert "Error" in await mirror.get_user_info(forged)
+        assert cognito.cognito_client.get_user_calls == 0
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("make_db", BACKENDS)
+def test_read_started_before_an_invalidation_does_not_replace_it(make_db):
+    async def scenario():
+        mirror, cognito = await mirror_on(make_db)
+        cognito.cognito_client.delay = 0.1
+        started = threading.Event()
+        get_user = cognito.cognito_client.get_user
+
+        def tracked_get_user(AccessToken):
+            started.set()
+            return get_user(AccessToken)
+
+        cognito.cognito_client.get_user = tracked_get_user
+        read = asyncio.ensure_future(mirror.get_user_info(access_token("jane")))
+        while not started.is_set():
+            await asyncio.sleep(0.005)
+        await mirror.invalidate("jane")
+        await read
+
+        entry = await mirror.db.get_mirrored_profile(SOURCE, "jane")
+        assert entry["profile"] is None
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("make_db", BACKENDS)
+def test_sync_refreshes_every_profile_and_prunes_removed_users(make_db):
+    async def scenario():
+        mirror, cognito = await mirror_on(make_db, users={"jane": "jane@example.com", "john": "john@example.com"}, batch_size=1)
+        await mirror.db.store_mirrored_profiles(SOURCE, [{"key": "gone", "profile": {"Username": "gone"}, "synced_at": time.time() - 10}])
+
+        assert await mirror.sync() == 2
+        assert await mirror.db.get_mirrored_profile(SOURCE, "gone") is None
+        entry = await mirror.db.get_mirrored_profile(SOURCE, "john")
+        assert entry["profile"] == {"Username": "john", "UserAttributes": attributes("john@example.com")}
+
+        await mirror.get_user_info(access_token("john"))
+        assert cognito.cognito_client.get_user_calls == 0
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("make_db", BACKENDS)
+def test_updates_through_an_alias_invalidate_the_mirrored_profile(make_db):
+    async def scenario():
+        mirror, cognito = await mirror_on(make_db)
+        manager = CognitoAuthManager(cognito, profile_mirror=mirror)
+        token = access_token("jane")
+        await mirror.get_user_info(token)
+
+        await manager.update_user_email("jane@example.com", "jane@example.org")
+        assert cognito.updated == ["jane@example.com"]
+        assert (await mirror.get_user_info(token))["UserAttributes"] == attributes("jane@example.org")
+        assert cognito.cognito_client.get_user_calls == 2
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("make_db", BACKENDS)
+def test_bulk_updates_invalidate_the_users_they_change(make_db):
+    async def scenario():
+        mirror, cognito = await mirror_on(make_db, users={"jane": "jane@example.com", "john": "john@example.com"})
+        manager = CognitoAuthManager(cognito, profile_mirror=mirror)
+        await mirror.sync()
+
+        updates = [("jane", attributes("jane@example.org")), ("nobody", attributes("nobody@example.org"))]
+        results = [result async for result in manager.bulk_update_user_attributes(updates)]
+        assert [("Error" in result) for result in results] == [False, True]
+
+        assert (await mirror.db.get_mirrored_profile(SOURCE, "jane"))["profile"] is None
+        assert (await mirror.db.get_mirrored_profile(SOURCE, "john"))["profile"] is not None
+        assert await mirror.db.get_mirrored_profile(SOURCE, "nobody") is None
+
+    asyncio.run(scenario())
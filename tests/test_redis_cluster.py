@@ -0,0 +1,123 @@
+import asyncio
+import subprocess
+
+import fakeredis
+import pytest
+from redis.crc import key_slot
+
+from authy_package.cache.key_schema import KeySchema
+from authy_package.cache.redis_cache import RedisCaching
+from tests.redis_processes import wait_until
+
+
+def cluster_cache_on_fakeredis() -> RedisCaching:
+    # The cluster client only connects on first use, so it can be swapped for a single fake node
+    cache = RedisCaching("redis://127.0.0.1:1", mode=RedisCaching.CLUSTER)
+    cache.redis = cache.replica = fakeredis.FakeAsyncRedis()
+    return cache
+
+
+def test_token_family_keys_share_a_slot():
+    keys = KeySchema(hash_tags=True)
+    access_token = keys.tag_token("jane@example.com", "random-access")
+    refresh_token = keys.tag_token("jane@example.com", "random-refresh")
+
+    slots = {key_slot(key.encode()) for key in (keys.access_token(access_token), keys.refresh_token(refresh_token), keys.user("jane@example.com"))}
+    assert len(slots) == 1
+
+
+def test_hash_tags_only_in_cluster_mode():
+    keys = KeySchema(hash_tags=False)
+    assert keys.tag_token("jane@example.com", "token") == "token"
+    assert "{" not in keys.access_token("token") and "{" not in keys.user("jane@example.com")
+
+
+def test_users_spread_over_slots():
+    keys = KeySchema(hash_tags=True)
+    slots = {key_slot(keys.user(f"user{index}@example.com").encode()) for index in range(1000)}
+    # 1000 users over 16384 slots; a broken tag would pin them all to one slot
+    assert len(slots) > 900
+
+
+def test_cluster_pipelines_stay_on_one_slot():
+    async def scenario():
+        cache = cluster_cache_on_fakeredis()
+        access_token, refresh_token = await cache.create_token_pair("jane@example.com")
+        await cache.store_social_token("jane@example.com", "social-access", "social-refresh", id_token="social-id")
+
+        stored = await cache.redis.keys("*")
+        assert len({key_slot(key) for key in stored}) == 1
+        assert await cache.validate_access_token(access_token) == "jane@example.com"
+        assert await cache.validate_refresh_token(refresh_token) == "jane@example.com"
+        assert await cache.retrieve_access_token("jane@example.com") == "social-access"
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.integration
+def test_redis_cluster(redis_processes):
+    ports = [redis_processes.start("--cluster-enabled", "yes", "--cluster-config-file", f"nodes-{index}.conf") for index in range(3)]
+    subprocess.run(
+        ["redis-cli", "--cluster", "create", *(f"127.0.0.1:{port}" for port in ports), "--cluster-yes"],
+        check=True, capture_output=True
+    )
+    wait_until(lambda: all("cluster_state:ok" in redis_processes.cli(port, "CLUSTER", "INFO") for port in ports))
+
+    async def scenario():
+        cache = RedisCaching(f"redis://127.0.0.1:{ports[0]}", mode=RedisCaching.CLUSTER)
+        try:
+            sessions = {}
+            for index in range(50):
+                identifier = f"user{index}@example.com"
+                sessions[identifier] = await cache.create_token_pair(identifier)
+                await cache.store_social_token(identifier, f"social-{index}", f"social-refresh-{index}")
+
+            for identifier, (access_token, refresh_token) in sessions.items():
+                assert await cache.validate_access_token(access_token) == identifier
+                assert await cache.validate_refresh_token(refresh_token) == identifier
+                await cache.delete_refresh_token(identifier)
+                assert await cache.validate_refresh_token(refresh_token) is None
+
+            # The users are spread over the shards rather than pinned to one of them
+            shards = {cache.redis.get_node_from_key(cache.keys.user(identifier)).port for identifier in sessions}
+            assert len(shards) == 3
+        finally:
+            await cache.close()
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.integration
+def test_sentinel_failover(redis_processes):
+    master = redis_processes.start()
+    replica = redis_processes.start("--replicaof", "127.0.0.1", str(master))
+    sentinel = redis_processes.start(
+        f"sentinel monitor authy 127.0.0.1 {master} 1",
+        "sentinel down-after-milliseconds authy 1000",
+        "sentinel failover-timeout authy 5000",
+        sentinel=True
+    )
+    wait_until(lambda: "master_link_status:up" in redis_processes.cli(replica, "INFO", "replication"))
+
+    async def scenario():
+        cache = RedisCaching(mode=RedisCaching.SENTINEL, sentinels=[("127.0.0.1", sentinel)], service_name="authy")
+        try:
+            access_token, _ = await cache.create_token_pair("jane@example.com")
+            # Make sure the replica has the token before it is promoted
+            await cache.redis.execute_command("WAIT", 1, 5000)
+
+            # Refused with NOGOODSLAVE until the sentinel has inspected the replica itself
+            wait_until(lambda: redis_processes.cli(sentinel, "SENTINEL", "FAILOVER", "authy") == "OK", interval=0.5)
+            wait_until(lambda: redis_processes.cli(sentinel, "SENTINEL", "GET-MASTER-ADDR-BY-NAME", "authy").endswith(str(replica)))
+            wait_until(lambda: "role:master" in redis_processes.cli(replica, "INFO", "replication"))
+            wait_until(lambda: "role:slave" in redis_processes.cli(master, "INFO", "replication"))
+
+            # The client follows the promotion without being reconfigured
+            assert await cache.validate_access_token(access_token) == "jane@example.com"
+            new_access_token, _ = await cache.create_token_pair("jane@example.com")
+            assert await cache.validate_access_token(new_access_token) == "jane@example.com"
+            assert redis_processes.cli(replica, "EXISTS", cache.keys.access_token(new_access_token)) == "1"
+        finally:
+            await cache.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,165 @@
+import asyncio
+import time
+
+import fakeredis
+
+from authy_package.cache.redis_cache import RedisCaching
+from authy_package.core.auth_manager import SocialAuthManager
+from authy_package.social.refresh_scheduler import RefreshScheduler
+from tests.databases import mongo_database
+
+
+class Provider:
+    """An OIDC provider that counts its refreshes and how many run at once."""
+
+    name = "idp"
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls = 0
+        self.running = self.max_running = 0
+
+    async def refresh_access_token(self, refresh_token: str):
+        self.calls += 1
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.running -= 1
+        return {"access_token": f"access-{self.calls}", "refresh_token": refresh_token, "expires_in": 3600}
+
+
+def shared_cache(redis) -> RedisCaching:
+    cache = RedisCaching("redis://127.0.0.1:1")
+    cache.redis = cache.replica = redis
+    return cache
+
+
+def worker(redis, provider: Provider, **options) -> RefreshScheduler:
+    cache = shared_cache(redis)
+    scheduler = RefreshScheduler(cache, refresh_ahead=300, jitter=0, **options)
+    SocialAuthManager(mongo_database(), cache=cache, oidc_providers=[provider], refresh_scheduler=scheduler)
+    return scheduler
+
+
+async def store_due_tokens(scheduler: RefreshScheduler, *identifiers: str):
+    for identifier in identifiers:
+        # Expires within refresh_ahead, so the refresh is due at once
+        await scheduler.cache.store_social_token(identifier, "access", "refresh", exp=60)
+        await scheduler.track("idp", identifier, exp=60)
+
+
+async def due_at(scheduler: RefreshScheduler, identifier: str) -> float:
+    return await scheduler.redis.zscore(scheduler.schedule_key, f"idp:{identifier}")
+
+
+def test_only_one_worker_refreshes_a_due_token():
+    async def scenario():
+        redis, provider = fakeredis.FakeAsyncRedis(), Provider()
+        workers = [worker(redis, provider) for _ in range(3)]
+        await store_due_tokens(workers[0], "jane")
+
+        leaders = [scheduler for scheduler in workers if await scheduler._lead()]
+        assert len(leaders) == 1
+        for scheduler in leaders:
+            assert await scheduler.run_once() == 1
+
+        assert provider.calls == 1
+        assert await workers[0].cache.retrieve_access_token("jane") == "access-1"
+        # The refresh scheduled the next one, refresh_ahead seconds before the new token expires
+        assert await due_at(workers[0], "jane") > time.time() + 3000
+
+    asyncio.run(scenario())
+
+
+def test_leader_lock_of_a_crashed_worker_expires():
+    async def scenario():
+        redis, provider = fakeredis.FakeAsyncRedis(), Provider()
+        crashed, standby = worker(redis, provider, lease=0.1), worker(redis, provider, lease=0.1)
+        assert await crashed._lead()
+        assert await crashed._lead()
+        assert not await standby._lead()
+
+        # The leader stops renewing its lease
+        await asyncio.sleep(0.15)
+        assert await standby._lead()
+        assert not await crashed._lead()
+
+    asyncio.run(scenario())
+
+
+def test_closing_hands_leadership_over():
+    async def scenario():
+        redis, provider = fakeredis.FakeAsyncRedis(), Provider()
+        leader, standby = worker(redis, provider), worker(redis, provider)
+        assert await leader._lead()
+        await leader.close()
+        assert await standby._lead()
+
+    asyncio.run(scenario())
+
+
+def test_claimed_refreshes_are_not_claimed_twice():
+    async def scenario():
+        redis, provider = fakeredis.FakeAsyncRedis(), Provider()
+        scheduler = worker(redis, provider, retry_delay=60)
+        await store_due_tokens(scheduler, "jane", "john")
+
+        assert sorted(await scheduler._claim()) == ["idp:jane", "idp:john"]
+        assert await scheduler._claim() == []
+        assert await due_at(scheduler, "jane") > time.time() + 50
+
+        # A claim does not bring back a member that was untracked meanwhile
+        await scheduler.untrack("idp", "john")
+        await redis.zadd(scheduler.schedule_key, {"idp:jane": 0})
+        assert await scheduler._claim() == ["idp:jane"]
+        assert await due_at(scheduler, "john") is None
+
+    asyncio.run(scenario())
+
+
+def test_failed_refresh_is_retried_after_its_claim():
+    async def scenario():
+        redis, provider = fakeredis.FakeAsyncRedis(), Provider()
+        scheduler = worker(redis, provider, retry_delay=0.1)
+        await store_due_tokens(scheduler, "jane")
+
+        async def unavailable(refresh_token):
+            raise ConnectionError("provider unavailable")
+
+        provider.refresh_access_token, refresh = unavailable, provider.refresh_access_token
+        assert await scheduler.run_once() == 0
+        assert await scheduler.run_once() == 0
+
+        provider.refresh_access_token = refresh
+        await asyncio.sleep(0.15)
+        assert await scheduler.run_once() == 1
+
+    asyncio.run(scenario())
+
+
+def test_tokens_without_a_refresh_token_are_dropped():
+    async def scenario():
+        redis, provider = fakeredis.FakeAsyncRedis(), Provider()
+        scheduler = worker(redis, provider)
+        await scheduler.track("idp", "gone", exp=60)
+
+        assert await scheduler.run_once() == 0
+        assert provider.calls == 0
+        assert await due_at(scheduler, "gone") is None
+
+    asyncio.run(scenario())
+
+
+def test_refreshes_are_batched_and_bounded():
+    async def scenario():
+        redis, provider = fakeredis.FakeAsyncRedis(), Provider(delay=0.02)
+        scheduler = worker(redis, provider, batch_size=4, concurrency=2)
+        await store_due_tokens(scheduler, *(f"user{index}" for index in range(10)))
+
+        assert await scheduler.run_once() == 10
+        assert provider.calls == 10
+        assert provider.max_running == 2
+
+    asyncio.run(scenario())
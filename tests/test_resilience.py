@@ -0,0 +1,265 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from authy_package.social.http import ResilientHTTPClient
+from authy_package.utils.resilience import CircuitBreaker, ProviderUnavailableError, RateLimitedError, RateLimiter, RetryBudget
+
+URL = "https://provider.example.com/token"
+
+
+class FaultyTransport(httpx.AsyncBaseTransport):
+    """Answers requests with the faults queued in `faults`, then with `default`; records every request."""
+
+    def __init__(self, *faults, default=200):
+        self.faults = list(faults)
+        self.default = default
+        self.requests = []
+        self.cancelled = []
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        fault = self.faults.pop(0) if self.faults else self.default
+        if isinstance(fault, Exception):
+            raise fault
+        if isinstance(fault, tuple):
+            delay, fault = fault
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                self.cancelled.append(request)
+                raise
+        return httpx.Response(fault, request=request)
+
+
+def resilient(transport: FaultyTransport, **options) -> ResilientHTTPClient:
+    options.setdefault("backoff_base", 0.001)
+    return ResilientHTTPClient(httpx.AsyncClient(transport=transport), **options)
+
+
+def test_breaker_opens_half_opens_and_closes():
+    async def scenario():
+        transport = FaultyTransport(*[503] * 10)
+        http = resilient(transport, max_attempts=1, reset_timeout=0.1)
+        for _ in range(10):
+            assert (await http.get(URL)).status_code == 503
+        breaker = http.breaker("GET", URL)
+        assert breaker.state == CircuitBreaker.OPEN
+
+        # Open: calls fail fast without reaching the provider
+        with pytest.raises(ProviderUnavailableError):
+            await http.get(URL)
+        assert len(transport.requests) == 10
+
+        # After the reset timeout a single probe goes through and its success closes the breaker
+        await asyncio.sleep(0.1)
+        assert (await http.get(URL)).status_code == 200
+        assert breaker.state == CircuitBreaker.CLOSED
+        assert len(transport.requests) == 11
+
+    asyncio.run(scenario())
+
+
+def test_failed_probe_opens_the_breaker_again():
+    async def scenario():
+        transport = FaultyTransport(*[503] * 11)
+        http = resilient(transport, max_attempts=1, reset_timeout=0.1)
+        for _ in range(10):
+            await http.get(URL)
+        await asyncio.sleep(0.1)
+
+        assert (await http.get(URL)).status_code == 503
+        assert http.breaker("GET", URL).state == CircuitBreaker.OPEN
+        with pytest.raises(ProviderUnavailableError):
+            await http.get(URL)
+        assert len(transport.requests) == 11
+
+    asyncio.run(scenario())
+
+
+def test_deadline_bounds_a_hanging_provider():
+    async def scenario():
+        transport = FaultyTransport(default=(10, 200))
+        http = resilient(transport, deadline=0.2)
+        started = time.monotonic()
+        with pytest.raises(ProviderUnavailableError):
+            await http.get(URL)
+        assert time.monotonic() - started < 1
+        assert transport.cancelled == transport.requests
+
+    asyncio.run(scenario())
+
+
+def test_deadline_stops_retries():
+    async def scenario():
+        # Each attempt fails slowly; the retry is cut off by the deadline instead of running ten times
+        transport = FaultyTransport(default=(0.15, 503))
+        http = resilient(transport, deadline=0.25, max_attempts=10)
+        started = time.monotonic()
+        with pytest.raises(ProviderUnavailableError):
+            await http.get(URL)
+        assert time.monotonic() - started < 0.5
+        assert len(transport.requests) == 2
+        assert transport.cancelled == [transport.requests[1]]
+
+    asyncio.run(scenario())
+
+
+def test_idempotent_calls_are_retried():
+    async def scenario():
+        transport = FaultyTransport(httpx.ConnectError("refused"), 503)
+        http = resilient(transport)
+        assert (await http.get(URL)).status_code == 200
+        assert len(transport.requests) == 3
+
+    asyncio.run(scenario())
+
+
+def test_exhausted_retry_budget_denies_retries():
+    async def scenario():
+        transport = FaultyTransport(default=503)
+        http = resilient(transport, retry_budget=RetryBudget(ratio=0, min_retries_per_second=0.1, window=10))
+        # The budget allows a single retry in its window
+        assert (await http.get(URL)).status_code == 503
+        assert len(transport.requests) == 2
+
+        assert (await http.get(URL)).status_code == 503
+        assert len(transport.requests) == 3
+
+        transport.requests.clear()
+        transport.default = httpx.ConnectError("refused")
+        with pytest.raises(ProviderUnavailableError):
+            await http.get(URL)
+        assert len(transport.requests) == 1
+
+    asyncio.run(scenario())
+
+
+def test_hedge_wins_and_the_loser_is_cancelled():
+    async def scenario():
+        transport = FaultyTransport((10, 200), (0, 200))
+        http = resilient(transport, hedge_after=0.05)
+        started = time.monotonic()
+        response = await http.get(URL, hedge=True)
+        assert response.status_code == 200
+        assert time.monotonic() - started < 1
+        assert len(transport.requests) == 2
+
+        await asyncio.sleep(0)
+        assert transport.cancelled == [transport.requests[0]]
+
+    asyncio.run(scenario())
+
+
+def test_no_hedge_when_the_first_request_answers_in_time():
+    async def scenario():
+        transport = FaultyTransport()
+        http = resilient(transport, hedge_after=0.05)
+        assert (await http.get(URL, hedge=True)).status_code == 200
+        assert len(transport.requests) == 1
+
+    asyncio.run(scenario())
+
+
+def test_post_is_not_retried():
+    async def scenario():
+        transport = FaultyTransport(default=503)
+        http = resilient(transport)
+        assert (await http.post(URL, data={"code": "single-use"})).status_code == 503
+        assert len(transport.requests) == 1
+
+        transport.requests.clear()
+        transport.default = httpx.ConnectError("refused")
+        with pytest.raises(ProviderUnavailableError):
+            await http.post(URL, data={"code": "single-use"})
+        assert len(transport.requests) == 1
+
+    asyncio.run(scenario())
+
+
+def test_post_hedge_is_ignored():
+    async def scenario():
+        transport = FaultyTransport((0.2, 200))
+        http = resilient(transport, hedge_after=0.01)
+        assert (await http.post(URL, hedge=True)).status_code == 200
+        assert len(transport.requests) == 1
+
+    asyncio.run(scenario())
+
+
+def limited(**headers) -> httpx.Headers:
+    return httpx.Headers({name.replace("_", "-"): str(value) for name, value in headers.items()})
+
+
+def test_malformed_rate_limit_headers_are_ignored(caplog):
+    headers = {"X-RateLimit-Remaining": "n/a", "X-RateLimit-Reset": "soon", "X-RateLimit-Limit": "5000"}
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, headers=headers))
+    http = ResilientHTTPClient(httpx.AsyncClient(transport=transport))
+    limiter = RateLimiter(max_wait=0)
+
+    async def scenario():
+        for _ in range(3):
+            assert (await http.get(URL, rate_limiter=limiter)).status_code == 200
+
+    asyncio.run(scenario())
+    assert "Ignoring malformed x-ratelimit-remaining header: 'n/a'" in caplog.text
+    assert limiter.try_acquire()
+
+    limiter.update(limited(x_ratelimit_remaining="0", x_ratelimit_reset="nan"))
+    limiter.update(limited(x_ratelimit_remaining="1.5", x_ratelimit_reset=time.time() + 60))
+    assert limiter.try_acquire()
+
+
+def test_exhausted_quota_waits_for_the_reset():
+    limiter = RateLimiter(max_wait=0.5)
+    limiter.update(limited(x_ratelimit_remaining=0, x_ratelimit_reset=int(time.time()) + 60, x_ratelimit_limit=5000))
+    assert not limiter.try_acquire()
+    with pytest.raises(RateLimitedError):
+        asyncio.run(limiter.acquire())
+
+
+def test_low_quota_is_spread_until_the_reset():
+    limiter = RateLimiter(max_wait=0)
+    limiter.update(limited(x_ratelimit_remaining=4000, x_ratelimit_reset=time.time() + 10, x_ratelimit_limit=5000))
+    assert all(limiter.try_acquire() for _ in range(10))
+
+    # Below the headroom 5 calls are left for 10 seconds: one every 2 seconds
+    limiter.update(limited(x_ratelimit_remaining=5, x_ratelimit_reset=time.time() + 10, x_ratelimit_limit=5000))
+    assert limiter.try_acquire()
+    assert not limiter.try_acquire()
+
+
+def test_retry_after_delays_the_next_request():
+    limiter = RateLimiter(max_wait=1.0)
+    limiter.update(limited(retry_after="0.1"), status_code=200)
+    assert limiter.try_acquire()
+
+    limiter.update(limited(retry_after="0.1"), status_code=429)
+    assert not limiter.try_acquire()
+    started = time.monotonic()
+    asyncio.run(limiter.acquire())
+    assert time.monotonic() - started >= 0.09
+
+
+def test_configured_rate_paces_requests():
+    limiter = RateLimiter(rate=20, burst=1, max_wait=1.0)
+
+    async def scenario():
+        started = time.monotonic()
+        for _ in range(3):
+            await limiter.acquire()
+        return time.monotonic() - started
+
+    assert asyncio.run(scenario()) >= 0.09
+    # A request that cannot wait is shed instead of queued
+    assert not limiter.try_acquire()
+
+
+def test_facebook_usage_at_the_quota_blocks_requests():
+    limiter = RateLimiter(max_wait=0)
+    limiter.update(limited(x_app_usage='{"call_count": 50, "total_time": 10}'))
+    assert limiter.try_acquire()
+    limiter.update(limited(x_app_usage='{"call_count": 100}'))
+    assert not limiter.try_acquire()
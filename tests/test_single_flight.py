@@ -0,0 +1,124 @@
+import asyncio
+
+import fakeredis
+
+from authy_package.cache.memory_cache import MemoryCaching
+from authy_package.core.auth_manager import SocialAuthManager
+from authy_package.utils.single_flight import SingleFlight
+from tests.databases import mongo_database
+
+
+class Provider:
+    """An OIDC provider whose token endpoint answers after `delay` seconds and counts its calls."""
+
+    name = "idp"
+
+    def __init__(self, delay: float = 0.05):
+        self.delay = delay
+        self.calls = 0
+
+    async def refresh_access_token(self, refresh_token: str):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return {"access_token": f"access-{self.calls}", "refresh_token": refresh_token, "expires_in": 3600}
+
+
+def counting(delay: float = 0.05):
+    calls = []
+
+    async def func():
+        calls.append(None)
+        await asyncio.sleep(delay)
+        return {"value": len(calls)}
+
+    return func, calls
+
+
+def test_concurrent_refreshes_make_one_provider_call():
+    async def scenario():
+        provider, cache = Provider(), MemoryCaching()
+        manager = SocialAuthManager(mongo_database(), cache=cache, oidc_providers=[provider])
+        results = await asyncio.gather(*(manager.refresh_access_token("idp", "refresh", {"username": "jane"}) for _ in range(10)))
+
+        assert provider.calls == 1
+        assert all(result["access_token"] == "access-1" for result in results)
+        assert await cache.retrieve_access_token("jane") == "access-1"
+
+        # Once the shared call is done, the next refresh reaches the provider again
+        await manager.refresh_access_token("idp", "refresh", {"username": "jane"})
+        assert provider.calls == 2
+
+    asyncio.run(scenario())
+
+
+def test_calls_for_different_keys_are_not_coalesced():
+    async def scenario():
+        flight = SingleFlight()
+        func, calls = counting()
+        await asyncio.gather(flight.do("idp:jane", func), flight.do("idp:john", func))
+        assert len(calls) == 2
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_caller_does_not_cancel_the_shared_call():
+    async def scenario():
+        flight = SingleFlight()
+        func, calls = counting(delay=0.1)
+        first = asyncio.ensure_future(flight.do("idp:jane", func))
+        await asyncio.sleep(0.01)
+        second = asyncio.ensure_future(flight.do("idp:jane", func))
+        await asyncio.sleep(0.01)
+        first.cancel()
+
+        assert await second == {"value": 1}
+        assert len(calls) == 1 and first.cancelled()
+
+    asyncio.run(scenario())
+
+
+def test_workers_sharing_redis_make_one_call():
+    async def scenario():
+        redis = fakeredis.FakeAsyncRedis()
+        workers = [SingleFlight(redis=redis, poll_interval=0.01) for _ in range(3)]
+        func, calls = counting(delay=0.1)
+        results = await asyncio.gather(*(worker.do("idp:jane", func) for worker in workers for _ in range(3)))
+
+        assert len(calls) == 1
+        assert results == [{"value": 1}] * 9
+        # The result is handed to late callers for result_ttl seconds
+        assert await workers[0].do("idp:jane", func) == {"value": 1}
+        assert len(calls) == 1
+
+    asyncio.run(scenario())
+
+
+def test_results_from_other_workers_are_loaded():
+    async def scenario():
+        redis = fakeredis.FakeAsyncRedis()
+        leader, follower = SingleFlight(redis=redis), SingleFlight(redis=redis, poll_interval=0.01)
+        func, calls = counting()
+
+        dumped, loaded = await asyncio.gather(
+            leader.do("idp:jane", func, dump=lambda result: result["value"]),
+            follower.do("idp:jane", func, load=lambda value: {"loaded": value})
+        )
+        assert len(calls) == 1
+        assert dumped == {"value": 1} and loaded == {"loaded": 1}
+
+    asyncio.run(scenario())
+
+
+def test_lock_of_a_crashed_worker_expires():
+    async def scenario():
+        redis = fakeredis.FakeAsyncRedis()
+        flight = SingleFlight(redis=redis, lock_timeout=1.0, poll_interval=0.01)
+        # A worker took the lock and died before publishing a result
+        crashed = redis.lock("authy:sf:{idp:jane}:lock", timeout=0.1)
+        assert await crashed.acquire(blocking=False)
+
+        func, calls = counting(delay=0)
+        assert await flight.do("idp:jane", func) == {"value": 1}
+        assert len(calls) == 1
+
+    asyncio.run(scenario())
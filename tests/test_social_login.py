@@ -0,0 +1,75 @@
+import asyncio
+
+from authy_package.cache.memory_cache import MemoryCaching
+from authy_package.core.auth_manager import SocialAuthManager
+from tests.databases import mongo_database, sqlite_database
+
+TOKENS = {"access_token": "provider-access-token", "expires_in": 3600}
+
+
+def test_display_name_does_not_match_an_existing_account():
+    async def scenario():
+        db = mongo_database()
+        await db.create_user({"username": "admin", "email": "admin@example.com", "hashed_password": "secret"})
+        manager = SocialAuthManager(db)
+
+        result = await manager._handle_social_login("github", {"id": 1, "name": "admin", "email": "admin@example.com"}, TOKENS)
+        assert result["user"]["username"] == "github:1"
+        assert await db.collection.count_documents({}) == 2
+
+    asyncio.run(scenario())
+
+
+def test_profile_without_name_or_email_gets_its_own_account():
+    async def scenario():
+        db = mongo_database()
+        await db.create_user({"username": "admin", "hashed_password": "secret"})
+        manager = SocialAuthManager(db)
+
+        result = await manager._handle_social_login("github", {"id": 2}, TOKENS)
+        assert result["user"]["username"] == "github:2" and "hashed_password" not in result["user"]
+        admin = await db.get_user_by_identifier(username="admin")
+        assert not admin.get("identities")
+
+    asyncio.run(scenario())
+
+
+def test_verified_email_links_the_existing_account():
+    async def scenario():
+        db = mongo_database()
+        await db.create_user({"username": "jane", "email": "jane@example.com", "hashed_password": "secret"})
+        manager = SocialAuthManager(db, cache=MemoryCaching())
+
+        profile = {"sub": "g-1", "email": "jane@example.com", "email_verified": True}
+        first = await manager._handle_social_login("google", profile, TOKENS)
+        again = await manager._handle_social_login("google", profile, TOKENS)
+        assert first["user"]["username"] == again["user"]["username"] == "jane"
+        assert await manager.cache.retrieve_access_token("jane") == "provider-access-token"
+
+    asyncio.run(scenario())
+
+
+def test_unverified_email_is_neither_matched_nor_stored():
+    async def scenario():
+        db = mongo_database()
+        await db.create_user({"username": "jane", "email": "jane@example.com", "hashed_password": "secret"})
+        manager = SocialAuthManager(db)
+
+        result = await manager._handle_social_login("google", {"sub": "g-2", "email": "jane@example.com", "email_verified": False}, TOKENS)
+        assert result["user"]["username"] == "google:g-2" and result["user"]["email"] is None
+
+    asyncio.run(scenario())
+
+
+def test_sql_creates_the_identity_table_on_first_use():
+    async def scenario():
+        db = await sqlite_database()
+        await db.create_user({"username": "admin", "hashed_password": "secret"})
+        manager = SocialAuthManager(db)
+
+        first = await manager._handle_social_login("github", {"id": 3, "name": "admin"}, TOKENS)
+        again = await manager._handle_social_login("github", {"id": 3, "name": "admin"}, TOKENS)
+        assert first["user"].username == "github:3" and again["user"].id == first["user"].id
+        await db.engine.dispose()
+
+    asyncio.run(scenario())
@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+from tests.databases import UniqueUser, mongo_database, sqlite_database
+
+
+def test_mongo_upsert_requires_the_key():
+    async def scenario():
+        db = mongo_database()
+        await db.create_user({"username": "admin", "hashed_password": "secret"})
+        with pytest.raises(ValueError):
+            await db.upsert_user({"username": None, "email": None, "provider": "github"})
+        assert await db.collection.count_documents({}) == 1
+
+    asyncio.run(scenario())
+
+
+def test_mongo_upsert_returns_the_existing_user():
+    async def scenario():
+        db = mongo_database()
+        first = await db.upsert_user({"username": "jane", "provider": "github"})
+        second = await db.upsert_user({"username": "jane", "provider": "google"})
+        assert first["_id"] == second["_id"] and second["provider"] == "github"
+
+    asyncio.run(scenario())
+
+
+def test_sql_upsert_without_unique_constraint():
+    async def scenario():
+        db = await sqlite_database()
+        first = await db.upsert_user({"username": "jane", "provider": "github"})
+        second = await db.upsert_user({"username": "jane", "provider": "google"})
+        assert first.id == second.id and second.provider == "github"
+        with pytest.raises(ValueError):
+            await db.upsert_user({"username": None, "provider": "github"})
+        await db.engine.dispose()
+
+    asyncio.run(scenario())
+
+
+def test_sql_upsert_with_unique_constraint():
+    async def scenario():
+        db = await sqlite_database(UniqueUser)
+        assert db._is_unique("username") and not db._is_unique("phone")
+        users = await asyncio.gather(*(db.upsert_user({"username": "jane", "provider": "github"}) for _ in range(5)))
+        assert len({user.id for user in users}) == 1
+        await db.engine.dispose()
+
+    asyncio.run(scenario())